@@ -0,0 +1,210 @@
+'''
+    Incremental store of the coded trial data of all pairs
+
+    Replaces the all_trials_data.csv that analysis.ipynb and
+    compact_fitHDDM.ipynb concatenated from the pair*.csv files. The store
+    keeps one Parquet partition per pair,
+        <store>/pair=<pair id>/<key>.parquet
+    with the coded trials of all its sessions (preprocess.preprocess with the
+    lag features, outliers removed per subject as post_experiment.ipynb
+    does), and a manifest.json with the fingerprint of every raw session
+    file.
+
+    update() only reads the session files whose size or modification time
+    changed since the last run and hashes their content (sha256); a pair is
+    processed again only if the content of one of its sessions, the
+    settings or preprocess.py changed, so a new lab day touches only the
+    files of that day. The partition name is derived from those
+    fingerprints (content-addressed), partitions of removed sessions are
+    deleted and the manifest is replaced in one step, so an interrupted
+    update leaves the previous store usable.
+
+    Needs pyarrow for the Parquet files.
+
+    Usage:
+        python datastore.py [data directory] [--lags 6] [--rtstd 4] [--store data/coded/store]
+    and in the notebooks
+        from datastore import update
+        trials_df = update(datadir)
+'''
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import pandas as pd
+
+from preprocess import sessionFiles, sessionName, readsession, preprocess, remove_outliers
+
+
+manifestName = 'manifest.json'
+
+def defaultStore (datadir):
+    return os.path.join(datadir, 'coded', 'store')
+
+def filehash (path, blocksize=1 << 20):
+    '''
+        sha256 of the content of a file
+    '''
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(blocksize), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def codeVersion ():
+    '''
+        hash of preprocess.py, a change of the coding invalidates every pair
+    '''
+    import preprocess
+    return filehash(os.path.splitext(preprocess.__file__)[0] + '.py')
+
+def pairOf (session):
+    return session.split('_')[0]
+
+def readmanifest (storedir):
+    try:
+        with open(os.path.join(storedir, manifestName), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'files': {}, 'pairs': {}}
+
+def writemanifest (storedir, manifest):
+    filename = os.path.join(storedir, manifestName)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+def fingerprints (datadir, known):
+    '''
+        size, modification time and sha256 of every session file; only the
+        files whose size or time differ from the known ones are hashed
+    '''
+    files = {}
+    hashed = []
+    for path in sessionFiles(datadir):
+        name = sessionName(path)
+        stat = os.stat(path)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        old = known.get(name)
+        if old is not None and old['size'] == entry['size'] and old['mtime'] == entry['mtime']:
+            entry['sha256'] = old['sha256']
+        else:
+            entry['sha256'] = filehash(path)
+            hashed.append(name)
+        entry['path'] = path
+        files[name] = entry
+    return files, hashed
+
+def pairkey (sessions, files, settings):
+    '''
+        content address of a partition: the sessions of the pair, their
+        content and everything the coding depends on
+    '''
+    h = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    for name in sorted(sessions):
+        h.update(name.encode())
+        h.update(files[name]['sha256'].encode())
+    return h.hexdigest()[:16]
+
+def codepair (paths, nlags, rtstd):
+    '''
+        coded trials of all sessions of one pair
+    '''
+    raw = pd.concat([readsession(path) for path in paths], ignore_index=True)
+    raw['session'] = raw['session'].astype('category')
+    df = preprocess(raw, nlags)
+    if rtstd:
+        df, _ = remove_outliers(df, rtstd)
+    return df
+
+def update (datadir, storedir=None, nlags=6, rtstd=4, verbose=True):
+    '''
+        bring the store up to date with the session files in datadir and
+        return the coded trials of all pairs
+    '''
+    storedir = storedir or defaultStore(datadir)
+    os.makedirs(storedir, exist_ok=True)
+    manifest = readmanifest(storedir)
+    files, hashed = fingerprints(datadir, manifest['files'])
+    settings = {'nlags': nlags, 'rtstd': rtstd, 'preprocess': codeVersion()}
+
+    sessions = {}
+    for name in files:
+        sessions.setdefault(pairOf(name), []).append(name)
+
+    pairs = {}
+    coded = []
+    for pair, names in sorted(sessions.items()):
+        key = pairkey(names, files, settings)
+        partition = os.path.join('pair=' + pair, key + '.parquet')
+        old = manifest['pairs'].get(pair)
+        if old is None or old['key'] != key or not os.path.exists(os.path.join(storedir, partition)):
+            df = codepair([files[name]['path'] for name in sorted(names)], nlags, rtstd)
+            filename = os.path.join(storedir, partition)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            df.to_parquet(filename + '.tmp', index=False)
+            os.replace(filename + '.tmp', filename)
+            coded.append(pair)
+            trials = len(df)
+        else:
+            trials = old['trials']
+        pairs[pair] = {'key': key, 'partition': partition, 'sessions': sorted(names), 'trials': trials}
+
+    removed = sorted(set(manifest['pairs']) - set(pairs))
+    known = {name: {k: v for k, v in entry.items() if k != 'path'} for name, entry in files.items()}
+    writemanifest(storedir, {'files': known, 'pairs': pairs, 'settings': settings})
+
+    # the old partitions of changed pairs and the pairs without sessions
+    for pair, old in manifest['pairs'].items():
+        if pair not in pairs:
+            shutil.rmtree(os.path.join(storedir, 'pair=' + pair), ignore_errors=True)
+        elif old['partition'] != pairs[pair]['partition']:
+            try:
+                os.remove(os.path.join(storedir, old['partition']))
+            except FileNotFoundError:
+                pass
+
+    if verbose:
+        print('%d session files, %d hashed, %d of %d pairs coded, %d removed'
+              % (len(files), len(hashed), len(coded), len(pairs), len(removed)))
+    return load(storedir)
+
+def load (storedir, pairs=None):
+    '''
+        coded trials of all (or the given) pairs in the store, without
+        reading any session file; the categorical columns of the Parquet
+        files come back as plain (object) columns, as in all_trials_data.csv
+    '''
+    manifest = readmanifest(storedir)
+    selected = sorted(manifest['pairs']) if pairs is None else [str(p) for p in pairs]
+    parts = [pd.read_parquet(os.path.join(storedir, manifest['pairs'][pair]['partition'])) for pair in selected]
+    if not parts:
+        return pd.DataFrame()
+
+    df = pd.concat(parts, ignore_index=True)
+    # the notebooks write new labels (own, partner) into these columns and
+    # compare them with each other, which categoricals do not allow
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the store of the coded trial data of all pairs.')
+    parser.add_argument('datadir', nargs='?', default=os.path.join(os.getcwd(), 'data'))
+    parser.add_argument('--lags', type=int, default=6, help='number of previous trials to add features for')
+    parser.add_argument('--rtstd', type=float, default=4, help='outlier threshold in standard deviations, 0 keeps all trials')
+    parser.add_argument('--store', default=None, help='store directory, <datadir>/coded/store by default')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = update(args.datadir, args.store, args.lags, args.rtstd)
+    print('%d trials of %d subjects (%.2f s)' % (len(df), df['subj_idx'].nunique(), time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
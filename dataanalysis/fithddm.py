@@ -0,0 +1,614 @@
+'''
+    Parallel fits of the HDDM models
+
+    fit_HDDM.ipynb and compact_fitHDDM.ipynb sample the chains of a model one
+    after the other. This runner fits every chain (trace_id) of every
+    selected model of models_collection in a pool of processes, one chain
+    per core, and runs concat_models for a model as soon as all its chains
+    are done. make_model, run_model and concat_models are the functions of
+    the notebooks (make_model also builds stimcoding_dc_z_resp_dyadic of
+    compact_fitHDDM.ipynb).
+
+    Chains with a saved model are skipped when a job is started again.
+
+    EXPERIMENTAL, off by default: with --checkpoint the chains are sampled in
+    parts of that many iterations, and after every part the pickle db of the
+    chain is copied to a checkpoint together with the number of iterations
+    done. With --resume as well, a job that was killed continues every chain
+    from its last checkpoint when it is started again with the same
+    arguments. The parts and the burn-in (half of the samples, rounded up) are
+    whole thinning steps and the burn-in is counted over the whole chain, so
+    the saved samples are the iterations a single m.sample(samples, burn,
+    thin) call with that burn-in keeps; without --checkpoint the burn-in is
+    half of the samples as in the notebooks. Every chain part draws from its
+    own seed, derived from the model, the trace_id and the iteration.
+
+    Sampling in parts and resuming (m.load_db of the checkpoint, then
+    m.mc.sample) have not been run against hddm/kabuki yet. Before relying on
+    them, kill a job after a checkpoint, resume it and check that the merged
+    chain has (samples - burn) / thin samples and matches an uninterrupted
+    m.sample with the same seed.
+
+    Usage:
+        python fithddm.py <data> --models 1 5 19 --lag 1 --chains 4 --samples 5000
+                          [--workers 32] [--out output] [--checkpoint 500 [--resume]]
+    <data> is either the directory of the session files (coded with the
+    store of datastore.py) or a coded csv file.
+'''
+
+import os
+import glob
+import json
+import time
+import zlib
+import pickle
+import shutil
+import argparse
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import hddm
+import kabuki
+
+
+# the set of models that can be built currently, as in fit_HDDM.ipynb and
+# compact_fitHDDM.ipynb
+models_collection = {
+    1: 'stimcoding_nohist',  # no history baseline model
+    2: 'stimcoding_nohist_svgroup', # no history baseline model
+    3: 'stimcoding_dc_resp',  #previous response dependent, nlags needed
+    4: 'stimcoding_z_resp',  #previous response dependent, nlags needed
+    5: 'stimcoding_dc_z_resp', #previous response dependent, nlags needed
+    6: 'stimcoding_dc_stim',  #previous stimulus dependent, nlags needed
+    7: 'stimcoding_z_stim',  #previous stimulus dependent, nlags needed
+    8: 'stimcoding_dc_z_stim',  #previous stimulus dependent, nlags needed
+    9: 'stimcoding_dc_z_st_resp',  #previous response dependent, nlags needed
+    10:'stimcoding_dc_z_resp_svgroup',  #previous response dependent, nlags needed
+    11:'stimcoding_dc_z_resp_groupsplit',  #previous response dependent, nlags needed
+    12:'stimcoding_dc_z_resp_congruency',  #previous response dependent, nlags needed
+    13:'regress_dc_resp',  #only previous response factored, nlags needed
+    14:'regress_z_resp',  #only previous response factored, nlags needed
+    15:'regress_dcz_resp',  #only previous response factored, nlags needed
+    16:'regress_dc_resp_stim',  #both previous response fand stimulus actored, nlags needed
+    17:'regress_z_resp_stim',  #both previous response fand stimulus actored, nlags needed
+    18:'regress_dcz_resp_stim',  #both previous response fand stimulus actored, nlags needed
+    19:'stimcoding_dc_z_resp_dyadic' #previous response dependent, nlags needed, dyadic assessment
+}
+
+def recode_4stimcoding(mydata):
+    #code stimulus and response direction left as 0, leave direction right as 1.
+    
+    mydata.loc[mydata['direction']==-1,'direction'] = 0
+    mydata.loc[mydata['response']==-1,'response'] = 0
+    for col in mydata.columns.tolist():
+        if ('stim' in col) or ('resp' in col):
+            mydata.loc[mydata[col]==-1,col] = 0
+    
+    return mydata
+
+def z_link_func(x):
+    return 1 / (1 + np.exp(-(x.values.ravel())))
+
+def aic(self):
+    k = len(self.get_stochastics())
+    logp = sum([x.logp for x in self.get_observeds()['node']])
+    return 2 * k - 2 * logp
+
+
+def bic(self):
+    k = len(self.get_stochastics())
+    n = len(self.data)
+    logp = sum([x.logp for x in self.get_observeds()['node']])
+    return -2 * logp + k * np.log(n)
+
+def concat_models(mypath, model_name, nchains=30):
+    traces = range(1,nchains+1)
+
+    # CHECK IF COMBINED MODEL EXISTS
+    if os.path.isfile(os.path.join(mypath, model_name, 'modelfit-combined.model')):
+        print("Combined Model exists: {}".format(os.path.join(mypath, model_name, 'modelfit-combined.model')))
+    else:
+        # ============================================ #
+        # APPEND MODELS
+        # ============================================ #
+        allmodels = []
+        print("Combining all traces for %s" % model_name)
+        for trace_id in traces:  # how many chains were run?
+            model_filename = os.path.join(mypath, model_name, 'modelfit-md%d.model' % trace_id)
+            if os.path.isfile(model_filename) == True:  # if not, this model has to be rerun
+                print(model_filename)
+                thism = hddm.load(model_filename)
+                allmodels.append(thism)  # now append into a list
+            else:
+                print("Not found: trace_id {:2d}".format(trace_id))
+                
+        if len(allmodels) != nchains:
+            return None
+        # ============================================ #
+        # CHECK CONVERGENCE if all traces were found
+        # ============================================ #    
+        print("Performing gelman rubin convergence test\n")
+        try:
+            gr = hddm.analyze.gelman_rubin(allmodels)
+            # save
+            text_file = open(os.path.join(mypath, model_name, 'gelman_rubin.txt'), 'w')
+            for p in gr.items():
+                text_file.write("%s,%s\n" % p)
+                # print a warning when non-convergence is detected
+                # Values should be close to 1 and not larger than 1.02 which would indicate convergence problems.
+                # https://www.ncbi.nlm.nih.gov/pmc/articles/PMC3731670/
+                if abs(p[1] - 1) > 0.02:
+                    print("non-convergence found, %s:%s" % p)
+            text_file.close()
+            print("written gelman rubin stats to file")
+        except Exception as e:
+            print("Error: {}".format(e))
+        m = kabuki.utils.concat_models(allmodels) #creates one model from all chains
+
+        # ============================================ #
+        # SAVE THE FULL MODEL
+        # ============================================ #
+
+        m.save(os.path.join(mypath, model_name, 'modelfit-combined.model'))  # save combined modelto disk
+        print("Concatenated model saved!")
+        
+        # ============================================ #
+        # SAVE POINT ESTIMATES
+        # ============================================ #
+
+        print("saving stats...")
+        results = m.gen_stats()  # point estimate for each parameter and subject
+        results.to_csv(os.path.join(mypath, model_name, 'results-combined.csv'))
+
+        # save the DIC for this model
+        text_file = open(os.path.join(mypath, model_name, 'DIC-combined.txt'), 'w')
+        text_file.write("Combined model: {}\n".format(m.dic))
+        text_file.close()
+        print('done')
+        
+        # ============================================ #
+        # SAVE TRACES
+        # ============================================ #
+
+        print("saving traces...")
+        # get the names for all nodes that are available here
+        group_traces = m.get_group_traces()
+        group_traces.to_csv(os.path.join(mypath, model_name, 'group_traces.csv'))
+
+        all_traces = m.get_traces()
+        all_traces.to_csv(os.path.join(mypath, model_name, 'all_traces.csv'))
+        print('done')
+        
+        # ============================================ #
+        # CONCATENATE MODEL COMPARISON
+        # ============================================ #
+        # average model comparison values across chains
+        print('concatenating model comparison...')
+        fls = glob.glob(os.path.join(mypath, model_name, 'model_comparison_md*.csv'))
+        tmpdf = pd.concat([pd.read_csv(f) for f in fls ])
+        # average over chains
+        df2 = tmpdf.mean()
+        df2 = tmpdf.describe().loc[['mean']]
+        df2.to_csv(os.path.join(mypath, model_name, 'model_comparison.csv')) # save comparison to disk
+        print('done')
+
+
+        # DELETE FILES to save space
+        print("Now deleting files for seperate chains...")
+        for fl in glob.glob(os.path.join(mypath, model_name, 'modelfit-md*.model')):
+            print(fl)
+            os.remove(fl)
+        for fl in glob.glob(os.path.join(mypath, model_name, 'modelfit-md*.db')):
+            if not '-md1.db' in fl: #needed here to load the pickled db in PPC
+                print(fl)
+                os.remove(fl)
+        for fl in glob.glob(os.path.join(mypath, model_name, 'model_comparison_md*.csv')):
+            print(fl)
+            os.remove(fl)
+        for fl in glob.glob(os.path.join(mypath, model_name, 'DIC-md*.txt')):
+            print(fl)
+            os.remove(fl)
+        print('DONE!!!')
+
+def make_model(mydata, model_name, trace_id, nlag=0):
+    
+    #checks before model is created
+    if "nohist" not in model_name and nlag == 0:
+        raise ValueError("For all models with history effects, 'nlag' must be non-zero")
+    elif "nohist" in model_name and nlag != 0:
+        print("'nlag' specified but model is without history effect. 'nlag' value is ignored\n")
+        nlag = 0
+         
+    if 'regress' in model_name:
+        if nlag != 0:
+            lags = range(1,nlag+1)
+            resp_cols = ['l' + str(i) + '_resp' for i in lags]
+            stim_cols = ['l' + str(i) + '_stim' for i in lags]
+            resps = " + ".join(resp_cols)
+            respstim = " + ".join(resp_cols + stim_cols)
+            for col in stim_cols:
+                mydata = mydata[mydata[col].notna()]
+    else:
+        mydata = recode_4stimcoding(mydata)
+        if nlag != 0:
+            col_resp = 'l' + str(nlag) + '_resp'
+            col_stim = 'l' + str(nlag) + '_stim'
+            col_subject = 'l' + str(nlag) + '_subject'
+            col_repeat = 'l' + str(nlag) + '_repeat'
+             
+    if model_name == 'stimcoding_nohist': # NO HISTORY FOR MODEL COMPARISON
+        m = hddm.HDDMStimCoding(mydata, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sv', 'sz'])
+    elif model_name == 'stimcoding_nohist_svgroup': # DOES DRIFT RATE VARIABILITY REDUCE? GROUP
+        # add a group to indicate bias magnitude
+        sjrepetition = mydata.groupby(['subj_idx'])['l1_repeat'].mean().reset_index()
+        sjrepetition['biasgroup'] = pd.qcut(np.abs(sjrepetition['l1_repeat'] - 0.5), 3, labels=False)
+        mydata2 = pd.merge(mydata, sjrepetition, on='subj_idx', how='inner')
+        m = hddm.HDDMStimCoding(mydata2, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sz'],
+                depends_on={'sv': ['biasgroup']})
+    elif model_name == 'stimcoding_dc_resp':
+        m = hddm.HDDMStimCoding(mydata, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sv', 'sz'],
+                depends_on={'dc':[col_resp]})
+    elif model_name == 'stimcoding_z_resp':
+        m = hddm.HDDMStimCoding(mydata, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sv', 'sz'],
+                depends_on={'z':[col_resp]})
+    elif model_name == 'stimcoding_dc_z_resp':
+        m = hddm.HDDMStimCoding(mydata, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sv', 'sz'],
+                depends_on={'dc':[col_resp], 'z':[col_resp]})
+    elif model_name == 'stimcoding_dc_stim': # STIMCODING PREVSTIM
+        m = hddm.HDDMStimCoding(mydata, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sv', 'sz'],
+                depends_on={'dc':[col_stim]})
+    elif model_name == 'stimcoding_z_stim':
+        m = hddm.HDDMStimCoding(mydata, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sv', 'sz'],
+                depends_on={'z':[col_stim]})
+    elif model_name == 'stimcoding_dc_z_stim':
+        m = hddm.HDDMStimCoding(mydata, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sv', 'sz'],
+                depends_on={'dc':[col_stim], 'z':[col_stim]})
+    elif model_name == 'stimcoding_dc_z_st_resp': # also estimate across-trial variability in nondecision time
+        m = hddm.HDDMStimCoding(mydata, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz', 'st'), group_only_nodes=['sv', 'sz', 'st'],
+                depends_on={'dc':[col_resp], 'z':[col_resp]})
+    elif model_name == 'stimcoding_dc_z_resp_svgroup':
+        # add a group to indicate bias magnitude
+        sjrepetition = mydata.groupby(['subj_idx'])[col_repeat].mean().reset_index()
+        sjrepetition['biasgroup'] = pd.qcut(np.abs(sjrepetition[col_repeat] - 0.5), 3, labels=False)
+        mydata2 = pd.merge(mydata, sjrepetition, on='subj_idx', how='inner')
+        m = hddm.HDDMStimCoding(mydata2, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sz'],
+                depends_on={'dc':[col_resp], 'z':[col_resp], 'sv': ['biasgroup']})
+    elif model_name == 'stimcoding_dc_z_resp_groupsplit':# SEPARATE FIT FOR REPEATERS AND ALTERNATORS
+        # add coding for repeaters and alternators
+        sjrepetition = mydata.groupby(['subj_idx'])[col_repeat].mean().reset_index()
+        sjrepetition['group'] = np.sign(sjrepetition[col_repeat] - 0.5)
+        mydata2 = pd.merge(mydata, sjrepetition, on='subj_idx', how='inner')
+        m = hddm.HDDMStimCoding(mydata2, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sv', 'sz'],
+                depends_on={'dc':[col_resp, 'group'], 'z':[col_resp, 'group']})
+    elif model_name == 'stimcoding_dc_z_resp_congruency': #SPLIT BY CONGRUENCE BETWEEN PREVIOUS CHOICE AND CURRENT STIMULUS
+        # compute a double (not boolean) to indicate congruence
+        mydata['congruent'] = (mydata[col_resp] == mydata['direction']) * 1
+        m = hddm.HDDMStimCoding(mydata, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sv', 'sz'],
+                depends_on={'dc':[col_resp, 'congruent'], 'z':[col_resp, 'congruent']})
+    # ============================================ #
+    # Dyadic models..depends on whether the lagged trial was own for partner's
+    # ============================================ #
+    elif model_name == 'stimcoding_dc_z_resp_dyadic':
+        m = hddm.HDDMStimCoding(mydata, stim_col='direction', split_param='v',
+                drift_criterion=True, bias=True, p_outlier=0.05,
+                include=('sv', 'sz'), group_only_nodes=['sv', 'sz'],
+                depends_on={'dc':[col_resp, col_subject], 'z':[col_resp, col_subject]})
+    # ============================================ #
+    # REGRESSION MODELS WITH MULTIPLE LAGS
+    # ============================================ #
+    elif model_name == 'regress_nohist':
+        # only stimulus dependence
+        v_reg = {'model': 'v ~ 1 + direction', 'link_func': lambda x:x}
+        # specify that we want individual parameters for all regressors, see email Gilles 22.02.2017
+        m = hddm.HDDMRegressor(mydata, v_reg,
+            include=['z', 'sv'], group_only_nodes=['sv'],
+            group_only_regressors=False, keep_regressor_trace=False, p_outlier=0.05)
+    elif model_name == 'regress_dc_resp': #only previous response
+        v_reg = {'model': 'v ~ 1 + direction + ' + resps, 'link_func': lambda x:x} 
+        m = hddm.HDDMRegressor(mydata, v_reg,
+            include=['z', 'sv'], group_only_nodes=['sv'],
+            group_only_regressors=False, keep_regressor_trace=False, p_outlier=0.05)
+    elif model_name == 'regress_z_resp': #only prevresp
+        z_reg = {'model': 'z ~ 1  + ' + resps, 'link_func': z_link_func}
+        v_reg = {'model': 'v ~ 1 + direction', 'link_func': lambda x:x}
+        m = hddm.HDDMRegressor(mydata, [z_reg, v_reg],
+            include=['z', 'sv'], group_only_nodes=['sv'],
+            group_only_regressors=False, keep_regressor_trace=False, p_outlier=0.05)
+    elif model_name == 'regress_dcz_resp': #only prevresp
+        v_reg = {'model': 'v ~ 1 + direction + ' + resps, 'link_func': lambda x:x}
+        z_reg = {'model': 'z ~ 1  + ' + resps, 'link_func': z_link_func}
+        m = hddm.HDDMRegressor(mydata, [v_reg, z_reg],
+                               include=['z', 'sv'], group_only_nodes=['sv'],
+                               group_only_regressors=False, keep_regressor_trace=False, p_outlier=0.05)
+    elif model_name == 'regress_dc_resp_stim': #both prevresp and prevstim
+        v_reg = {'model': 'v ~ 1 + direction + ' + respstim, 'link_func': lambda x:x}
+        m = hddm.HDDMRegressor(mydata, v_reg,
+            include=['z', 'sv'], group_only_nodes=['sv'],
+            group_only_regressors=False, keep_regressor_trace=False, p_outlier=0.05)
+    elif model_name == 'regress_z_resp_stim':
+        z_reg = {'model': 'z ~ 1  + ' + respstim, 'link_func': z_link_func}
+        v_reg = {'model': 'v ~ 1 + direction', 'link_func': lambda x:x}
+        m = hddm.HDDMRegressor(mydata, [z_reg, v_reg],
+            include=['z', 'sv'], group_only_nodes=['sv'],
+            group_only_regressors=False, keep_regressor_trace=False, p_outlier=0.05)
+    elif model_name == 'regress_dcz_resp_stim':
+        v_reg = {'model': 'v ~ 1 + direction + ' + respstim, 'link_func': lambda x:x}
+        z_reg = {'model': 'z ~ 1  + '+ respstim, 'link_func': z_link_func}
+        m = hddm.HDDMRegressor(mydata, [v_reg, z_reg],
+                               include=['z', 'sv'], group_only_nodes=['sv'],
+                               group_only_regressors=False, keep_regressor_trace=False, p_outlier=0.05)
+    return m
+
+def get_full_model_name(m,lag):
+    return m if 'nohist' in m else m + '_l' + str(lag)
+
+def chainfile (mypath, model_name, trace_id, suffix):
+    return os.path.join(mypath, model_name, 'modelfit-md%d.%s' % (trace_id, suffix))
+
+def chainseed (model_name, trace_id, iteration=0):
+    '''
+        seed of a part of a chain, the processes of the pool would otherwise
+        all sample from the same state
+    '''
+    return zlib.crc32(('%s %d %d' % (model_name, trace_id, iteration)).encode())
+
+def readprogress (mypath, model_name, trace_id):
+    try:
+        with open(chainfile(mypath, model_name, trace_id, 'progress'), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def savecheckpoint (mypath, model_name, trace_id, progress):
+    '''
+        copy of the pickle db after a part of the chain; the progress file
+        is replaced last, so it always names a complete checkpoint
+    '''
+    old = readprogress(mypath, model_name, trace_id)
+    checkpoint = chainfile(mypath, model_name, trace_id, 'ckpt%d.db' % progress['iterations'])
+    shutil.copyfile(chainfile(mypath, model_name, trace_id, 'db'), checkpoint + '.tmp')
+    os.replace(checkpoint + '.tmp', checkpoint)
+
+    progress['checkpoint'] = os.path.basename(checkpoint)
+    filename = chainfile(mypath, model_name, trace_id, 'progress')
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(progress, f)
+    os.replace(filename + '.tmp', filename)
+
+    if old is not None and old['checkpoint'] != progress['checkpoint']:
+        os.remove(os.path.join(mypath, model_name, old['checkpoint']))
+
+def resume (m, mypath, model_name, trace_id, n_samples, thin):
+    '''
+        load the last checkpoint of a chain into the model, returns the
+        number of iterations it has (0 to start from the beginning)
+    '''
+    progress = readprogress(mypath, model_name, trace_id)
+    if progress is None:
+        return 0
+    if progress['n_samples'] != n_samples or progress['thin'] != thin:
+        print("Checkpoint of trace_id {:2d} is for other settings, starting again".format(trace_id))
+        return 0
+
+    dbname = chainfile(mypath, model_name, trace_id, 'db')
+    shutil.copyfile(os.path.join(mypath, model_name, progress['checkpoint']), dbname)
+    m.load_db(dbname, db='pickle')
+    print("Resuming trace_id {:2d} after {} iterations".format(trace_id, progress['iterations']))
+    return progress['iterations']
+
+def mergechains (dbname):
+    '''
+        every part of a chain is a chain of its own in the pickle db; join
+        them into one, the traces of a model are those of its last chain
+    '''
+    with open(dbname, 'rb') as f:
+        container = pickle.load(f)
+    for name, trace in container.items():
+        if name != '_state_':
+            container[name] = {0: np.concatenate([trace[chain] for chain in sorted(trace)])}
+    with open(dbname + '.tmp', 'wb') as f:
+        pickle.dump(container, f)
+    os.replace(dbname + '.tmp', dbname)
+
+def run_model(m, mypath, model_name, trace_id, n_samples, checkpoint=0, thin=3, resumable=False):
+    print("Running {:<s}, trace_id {:2d}".format(model_name,trace_id))
+    dbname = chainfile(mypath, model_name, trace_id, 'db')
+    burn = n_samples // 2
+    # experimental, see the module docstring
+    done = resume(m, mypath, model_name, trace_id, n_samples, thin) if checkpoint and resumable else 0
+
+    if done == 0:
+        print("finding starting values")
+        try:
+            m.find_starting_values() # this should help the sampling
+        except Exception as e:
+            print(e) #even if starting values couldnt be found, sampling can continue
+
+    print("begin sampling")
+    if not checkpoint:
+        m.sample(n_samples, burn=burn, thin=thin, db='pickle', dbname=dbname)
+    else:
+        # parts and burn-in of whole thinning steps: every part starts on the
+        # thinning grid of the chain and keeps the same iterations whether
+        # pymc counts the thinning from the start or from the burn-in
+        checkpoint = -(-checkpoint // thin) * thin
+        burn = -(-burn // thin) * thin
+        while done < n_samples:
+            size = min(checkpoint, n_samples - done)
+            partburn = min(max(burn - done, 0), size)
+            np.random.seed(chainseed(model_name, trace_id, done))
+            if done == 0:
+                m.sample(size, burn=partburn, thin=thin, db='pickle', dbname=dbname)
+            else:
+                m.mc.sample(size, burn=partburn, thin=thin)
+            done += size
+            savecheckpoint(mypath, model_name, trace_id, {'iterations': done, 'n_samples': n_samples, 'thin': thin})
+
+        mergechains(dbname)
+        m.load_db(dbname, db='pickle')
+
+    savechain(m, mypath, model_name, trace_id)
+
+    if checkpoint:
+        progress = readprogress(mypath, model_name, trace_id)
+        os.remove(os.path.join(mypath, model_name, progress['checkpoint']))
+        os.remove(chainfile(mypath, model_name, trace_id, 'progress'))
+
+def savechain(m, mypath, model_name, trace_id):
+    m.save(os.path.join(mypath, model_name, 'modelfit-md%d.model'%trace_id)) # save the model to disk
+    
+    # ============================================ #
+    # save the output values
+    # ============================================ #
+
+    # save the DIC for this model
+    text_file = open(os.path.join(mypath, model_name, 'DIC-md%d.txt'%trace_id), 'w')
+    text_file.write("Model {}: {}\n".format(trace_id, m.dic))
+    text_file.close()
+
+    # save the other model comparison indices
+    df = dict()
+    df['trace_id'] = trace_id
+    df['dic_original'] = [m.dic]
+    df['aic'] = [aic(m)]
+    df['bic'] = [bic(m)]
+    df2 = pd.DataFrame(df)
+    df2.to_csv(os.path.join(mypath, model_name, 'model_comparison_md%d.csv'%trace_id),index=False)
+
+def loaddata (datasrc):
+    '''
+        coded trials of all pairs, from the store of the session files in a
+        directory or from a coded csv file
+    '''
+    if os.path.isdir(datasrc):
+        from datastore import update
+        return update(datasrc)
+    mydata = hddm.load_csv(datasrc)
+    mydata.rename(columns={'subject_id':'subj_idx'},inplace=True) #https://groups.google.com/g/hddm-users/c/Dhohjq_U2kU
+    return mydata
+
+def prepare (mydata, model_name, nlag):
+    '''
+        the data of a model: the subject of the lagged trial as own or
+        partner and, with history effects, only the trials that have the
+        lagged trial
+    '''
+    mydata = mydata.copy()
+    col_subject = 'l' + str(nlag) + '_subject'
+    if col_subject in mydata.columns:
+        #recode the subject in lagged trial..own or partner
+        subject = mydata[col_subject]
+        mydata[col_subject] = subject.where(subject.isna(), np.where(subject == mydata['subj_idx'], 'own', 'partner'))
+
+    if 'nohist' not in model_name and 'regress' not in model_name:
+        lagged = ['l' + str(nlag) + '_' + c for c in ['stim', 'resp', 'subject']]
+        mydata = mydata.dropna(subset=[c for c in lagged if c in mydata.columns]).reset_index(drop=True)
+    return mydata
+
+def fitchain (mydata, model, lag, trace_id, mypath, n_samples, checkpoint, resumable):
+    '''
+        one chain of a model, in a process of the pool
+    '''
+    full_model_name = get_full_model_name(model,lag)
+    if os.path.isfile(os.path.join(mypath, full_model_name, 'modelfit-md%d.model' % trace_id)):
+        print("Model {}, trace_id {:2d} exists".format(full_model_name, trace_id))
+        return 0
+
+    starttime = time.time()
+    np.random.seed(chainseed(full_model_name, trace_id))
+    m = make_model(prepare(mydata, model, lag), model, trace_id, lag)
+    run_model(m, mypath, full_model_name, trace_id, n_samples, checkpoint, resumable=resumable)
+    return time.time() - starttime
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit the chains of HDDM models in parallel.')
+    parser.add_argument('datasrc', help='directory of the session files or a coded csv file')
+    parser.add_argument('--models', type=int, nargs='+', default=[1], help='models of models_collection')
+    parser.add_argument('--lag', type=int, default=1, help='nth previous trial of the models with history effects')
+    parser.add_argument('--chains', type=int, default=2)
+    parser.add_argument('--samples', type=int, default=5000, help='samples of every chain, the first half is burn-in')
+    parser.add_argument('--checkpoint', type=int, default=0,
+                        help='EXPERIMENTAL: iterations between checkpoints, 0 (default) samples every chain in one call')
+    parser.add_argument('--resume', action='store_true',
+                        help='EXPERIMENTAL: continue the chains from their checkpoints, untested against hddm')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes')
+    parser.add_argument('--out', default='output', help='output directory')
+    args = parser.parse_args()
+
+    for model_id in args.models:
+        if model_id not in models_collection:
+            parser.error('no model {}, the models are {}'.format(model_id, ', '.join(map(str, models_collection))))
+    if args.lag < 1:
+        parser.error('--lag has to be at least 1')
+    if args.resume and not args.checkpoint:
+        parser.error('--resume needs --checkpoint')
+
+    mydata = loaddata(args.datasrc)
+    starttime = time.time()
+
+    # models without history effects have no lag
+    models = {}
+    for model_id in args.models:
+        model = models_collection[model_id]
+        lag = 0 if 'nohist' in model else args.lag
+        models[get_full_model_name(model,lag)] = (model, lag)
+        os.makedirs(os.path.join(args.out, get_full_model_name(model,lag)), exist_ok=True)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        chains = {}
+        for full_model_name, (model, lag) in models.items():
+            for trace_id in range(1, args.chains + 1):
+                future = pool.submit(fitchain, mydata, model, lag, trace_id, args.out, args.samples, args.checkpoint, args.resume)
+                chains[future] = (full_model_name, trace_id)
+
+        left = {full_model_name: args.chains for full_model_name in models}
+        failed = set()
+        combined = []
+        for future in concurrent.futures.as_completed(chains):
+            full_model_name, trace_id = chains[future]
+            try:
+                elapsed = future.result()
+                print("\nElapsed time for %s, trace_id %d, %d samples: %f seconds\n" % (full_model_name, trace_id, args.samples, elapsed))
+            except Exception as e:
+                print("Error in {}, trace_id {:2d}: {}".format(full_model_name, trace_id, e))
+                failed.add(full_model_name)
+
+            left[full_model_name] -= 1
+            if left[full_model_name] == 0 and full_model_name not in failed:
+                combined.append(pool.submit(concat_models, args.out, full_model_name, args.chains))
+
+        for future in concurrent.futures.as_completed(combined):
+            future.result()
+
+    print("%d models, %d chains each: %f seconds" % (len(models), args.chains, time.time() - starttime))
+    if failed:
+        print("Not combined, a chain failed: " + ", ".join(sorted(failed)))
+
+
+if __name__ == "__main__":
+    main()
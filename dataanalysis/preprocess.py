@@ -0,0 +1,285 @@
+'''
+    Preprocessing of the dyadic task data for the analysis and HDDM fits
+
+    Reads every data/DDM_pair*.csv written by dyadic_random_dots.py and turns
+    them into the coded trial data that post_experiment.ipynb used to write
+    pair by pair: one row per trial of the acting subject, subj_idx
+    '<pair>_1' or '<pair>_2', correct 1/0, stimulus and response coded as
+    -1 (left) / 1 (right) and, optionally, the lag features of the previous
+    trials. All sessions are processed together, column by column, and the
+    columns are kept small: categoricals for the ids, int8 for codes and
+    flags, float32 for the response times.
+
+    The lag features of all lags are gathered in one step from an index of
+    the previous trials within each block (historyfeatures), and the
+    probabilities of repeating the response of a previous trial per subject
+    and lag (repeatprobabilities) are a single bincount.
+
+    The notebooks import the helpers from here instead of defining their
+    own copies:
+        from preprocess import loadall, preprocess
+
+    Usage:
+        python preprocess.py [data directory] [--lags 6] [--out data/coded]
+    writes coded/pair<pair id>.csv for every pair.
+'''
+
+import os
+import re
+import glob
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+
+# columns of the session files that are used
+columns = ['pair', 'block', 'trial', 's1_state', 'direction', 'response', 'rt']
+
+# stimulus and response codes, 0 for trials without a response
+codes = {'left': -1, 'right': 1, 'noresponse': 0}
+
+def sessionName (path):
+    '''
+        pair id and date of a session file, e.g. 476030_2021_Dec_13_1613
+    '''
+    return re.sub(r'^DDM_pair', '', os.path.splitext(os.path.basename(path))[0])
+
+def readsession (path):
+    '''
+        one session file as written by the experiment
+
+        The files start with a byte order mark, have a trailing delimiter on
+        every line and write s1_state as True/TRUE and the rt of a trial
+        without response as None.
+    '''
+    df = pd.read_csv(path, encoding='utf-8-sig', usecols=columns, na_values=['None'],
+                     true_values=['True', 'TRUE'], false_values=['False', 'FALSE'],
+                     dtype={'block': np.int16, 'trial': np.int16, 'pair': np.int64,
+                            'direction': str, 'response': str, 'rt': np.float32})
+    df['session'] = sessionName(path)
+    return df
+
+def sessionFiles (datadir):
+    return sorted(glob.glob(os.path.join(datadir, 'DDM_pair*.csv')))
+
+def loadall (datadir, storedir=None):
+    '''
+        the raw trials of all sessions in a data directory, in one frame;
+        read from the columnar store of sessionformat.py (<datadir>/columnar
+        by default) if it holds exactly the current session files, parsed
+        from the csv files otherwise
+    '''
+    import sessionformat
+    storedir = storedir or sessionformat.defaultStore(datadir)
+    if sessionformat.current(storedir, datadir):
+        return sessionformat.rawtrials(storedir, columns)
+
+    df = pd.concat([readsession(path) for path in sessionFiles(datadir)], ignore_index=True)
+    df['session'] = df['session'].astype('category')
+    return df
+
+def keep_neccessary_columns (df):
+    '''
+        only the columns that contain important data
+    '''
+    return df[[c for c in columns + ['session'] if c in df.columns]]
+
+def determine_correct_responses (df):
+    '''
+        correct is 1 if the response matches the direction of the dots
+    '''
+    df['correct'] = (np.asarray(df['direction']) == np.asarray(df['response'])).astype(np.int8)
+    return df
+
+def segregate_trial_data (df):
+    '''
+        every row is a trial of the acting subject, subj_idx is
+        '<pair>_1' or '<pair>_2' (the name HDDM expects)
+    '''
+    chamber = np.where(np.asarray(df['s1_state'], dtype=bool), '_1', '_2')
+    df['subj_idx'] = pd.Categorical(np.char.add(np.asarray(df['pair']).astype(str), chamber))
+    return df
+
+def recode (df):
+    '''
+        left/right as -1/1 (0 for no response), also in the lag columns of
+        data that was not coded yet
+    '''
+    for col in ['direction', 'response']:
+        if df[col].dtype != np.int8:
+            df[col] = df[col].map(codes).fillna(0).astype(np.int8)
+
+    for col in df.columns:
+        if re.match(r'l\d+_(stim|resp)$', col) and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].map(codes).astype(np.float32)
+    return df
+
+def lagrange (lags):
+    '''
+        lags 1..K for an int K, otherwise the given lags
+    '''
+    return np.arange(1, lags + 1) if np.isscalar(lags) else np.asarray(lags, dtype=int)
+
+def previoustrials (df, lags):
+    '''
+        row index of the trial `lag` trials back in the same block of the
+        same session, for every row and lag (rows x lags), and whether there
+        is one
+    '''
+    lags = lagrange(lags)
+    group = df['session'].cat.codes.values.astype(np.int64) * 65536 + df['block'].values
+
+    # position of every row within its block, in the order of the rows
+    order = np.argsort(group, kind='stable')
+    sortedgroup = group[order]
+    start = np.flatnonzero(np.r_[True, sortedgroup[1:] != sortedgroup[:-1]])
+    sizes = np.diff(np.r_[start, len(group)])
+    position = np.empty(len(group), dtype=np.int64)
+    position[order] = np.arange(len(group)) - np.repeat(start, sizes)
+
+    valid = position[:, None] >= lags[None, :]
+    # row of the previous trial, via its place in the sorted order
+    rank = np.empty(len(group), dtype=np.int64)
+    rank[order] = np.arange(len(group))
+    index = order[np.where(valid, rank[:, None] - lags[None, :], 0)]
+    return index, valid
+
+def historyfeatures (df, lags):
+    '''
+        stimulus, response and acting subject of the previous trials and
+        whether the response repeats theirs, l<n>_stim, l<n>_resp,
+        l<n>_subject and l<n>_repeat for all lags at once; a block starts
+        without history
+
+        The coded stimuli and responses are float32, to hold the NaN of the
+        first trials of a block.
+    '''
+    lags = lagrange(lags)
+    index, valid = previoustrials(df, lags)
+
+    def gather (column):
+        values = df[column]
+        if values.dtype == np.int8:
+            return np.where(valid, values.values[index], np.nan).astype(np.float32)
+        codes, categories = pd.factorize(values)
+        return [pd.Categorical.from_codes(c, categories) for c in np.where(valid, codes[index], -1).T]
+
+    stim = gather('direction')
+    resp = gather('response')
+    subject = np.where(valid, df['subj_idx'].cat.codes.values[index], -1)
+    response = pd.factorize(df['response'])[0]
+    repeat = (valid & (response[:, None] == response[index])).astype(np.int8)
+
+    features = {}
+    for k, lag in enumerate(lags):
+        prefix = 'l' + str(lag) + '_'
+        features[prefix + 'stim'] = stim[:, k] if isinstance(stim, np.ndarray) else stim[k]
+        features[prefix + 'resp'] = resp[:, k] if isinstance(resp, np.ndarray) else resp[k]
+        features[prefix + 'subject'] = pd.Categorical.from_codes(subject[:, k], df['subj_idx'].cat.categories)
+        features[prefix + 'repeat'] = repeat[:, k]
+
+    features = pd.DataFrame(features, index=df.index)
+    return pd.concat([df.drop(columns=[c for c in features.columns if c in df.columns]), features], axis=1)
+
+def collect_previous_trials (df, nprev=1):
+    '''
+        the history features of the nth previous trial only
+    '''
+    return historyfeatures(df, [nprev])
+
+def repeatprobabilities (df, lags):
+    '''
+        probability that a subject repeats the response of the trial `lag`
+        trials back: overall (pr), if they did that trial themselves
+        (pr_own) and if their partner did (pr_other); one row per lag and
+        subject, from the history features of the data
+    '''
+    lags = lagrange(lags)
+    subjects = df['subj_idx'].cat.categories
+    subj = df['subj_idx'].cat.codes.values
+
+    def stack (name):
+        return np.column_stack([np.asarray(df['l' + str(lag) + '_' + name]) for lag in lags])
+
+    valid = np.column_stack([df['l' + str(lag) + '_stim'].notna().values for lag in lags])
+    own = np.column_stack([df['l' + str(lag) + '_subject'].cat.codes.values for lag in lags]) == subj[:, None]
+    repeat = stack('repeat').astype(float)
+
+    # one bin per (lag, subject)
+    key = np.arange(len(lags))[None, :] * len(subjects) + subj[:, None]
+    nbins = len(lags) * len(subjects)
+
+    def mean (selected):
+        n = np.bincount(key[selected], minlength=nbins)
+        k = np.bincount(key[selected], weights=repeat[selected], minlength=nbins)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return k / n
+
+    result = pd.DataFrame({
+        'lag': np.repeat(lags, len(subjects)),
+        'subj_idx': np.tile(np.asarray(subjects), len(lags)),
+        'pr': mean(valid),
+        'pr_own': mean(valid & own),
+        'pr_other': mean(valid & ~own)
+    })
+    # only the subjects in the data
+    present = np.bincount(subj, minlength=len(subjects)) > 0
+    return result[np.tile(present, len(lags))].reset_index(drop=True)
+
+def remove_outliers (df, RTstd=4):
+    '''
+        drop the trials with an rt more than RTstd standard deviations above
+        the mean of the subject (Urai et al. 2019); returns the data and the
+        number of outliers per subject
+    '''
+    rt = df.groupby('subj_idx', observed=True)['rt']
+    outlier = (df['rt'] > rt.transform('mean') + RTstd * rt.transform('std', ddof=0)).values
+    counts = pd.Series(outlier).groupby(df['subj_idx'].values, observed=True).sum()
+    return df[~outlier].reset_index(drop=True), {str(s): int(n) for s, n in counts.items()}
+
+def preprocess (df, nlags=0, coded=True):
+    '''
+        trial data of the acting subjects from raw trials (of any number of
+        sessions); with coded=False direction and response stay left/right
+        and recode() can be applied later
+    '''
+    # the only copy of the data
+    df = keep_neccessary_columns(df).copy()
+    df = determine_correct_responses(segregate_trial_data(df))
+    if coded:
+        df = recode(df)
+    if nlags:
+        df = historyfeatures(df, nlags)
+    return df.drop(columns=['pair', 's1_state'])
+
+def savecoded (df, outdir):
+    '''
+        one csv per pair, as post_experiment.ipynb wrote them
+    '''
+    os.makedirs(outdir, exist_ok=True)
+    filenames = []
+    pairs = df['subj_idx'].astype(str).str.split('_').str[0]
+    for pair, rows in df.groupby(pairs.values, sort=False):
+        filename = os.path.join(outdir, 'pair' + pair + '.csv')
+        rows.to_csv(filename, header=True, index=False)
+        filenames.append(filename)
+    return filenames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Code the trial data of all pairs for the analysis and the HDDM fits.')
+    parser.add_argument('datadir', nargs='?', default=os.path.join(os.getcwd(), 'data'))
+    parser.add_argument('--lags', type=int, default=6, help='number of previous trials to add features for')
+    parser.add_argument('--out', default=None, help='output directory, <datadir>/coded by default')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = preprocess(loadall(args.datadir), args.lags)
+    filenames = savecoded(df, args.out or os.path.join(args.datadir, 'coded'))
+    print('%d trials of %d subjects in %d files (%.2f s)'
+          % (len(df), df['subj_idx'].nunique(), len(filenames), time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+'''
+    Typed columnar format of the session files
+
+    The session files are small csv files that every notebook parses again,
+    with the types guessed every time (s1_state as True/TRUE text, the rt of
+    a trial without response as the text None). This module converts all
+    session files of a directory once into a store with an explicit schema:
+        <store>/schema.json      types, categories and the sessions
+        <store>/<column>.npy     one array per column, all sessions stacked
+    Booleans are bool, direction, response and condition are categoricals
+    (int8 codes, -1 for a missing value), rt and threshold are float64 with
+    NaN for no response, and every row has the pair id, the session (int16
+    code into the sessions of schema.json) and the chamber of the acting
+    subject (1 or 2). load() memory-maps the arrays, so reading the whole
+    corpus does not parse anything but the small schema. The types are
+    decided from all files together: an integer column with an empty cell in
+    any file is stored as float64 (NaN) and written back as integers.
+
+    preprocess.loadall() reads the raw trials from the store instead of the
+    csv files as long as it holds exactly the session files of the data
+    directory, unchanged since the conversion (same names, sizes and
+    modification times); after a new session, convert again.
+
+    The conversion is lossless: the byte order mark, the trailing delimiter,
+    the line ends, the spelling of the booleans and of missing values and
+    the columns of every file are kept in the schema, export() writes the
+    csv files back byte for byte, and convert() checks that it does before
+    anything is written. The old files in data/2ifc-visual-contrast-pilots/
+    have other columns (condition, .thisN, chamber, threshold, ...); columns
+    a session does not have are filled with 0, False, NaN or -1 and left
+    out again when it is exported.
+
+    Usage:
+        python sessionformat.py convert [data directory] [--out <data directory>/columnar]
+        python sessionformat.py export <store> <directory>
+    and in the notebooks
+        from sessionformat import load
+        trials = load('data/columnar')
+    or, through the store if it is current,
+        from preprocess import loadall
+        trials = loadall('data')
+'''
+
+import os
+import csv
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+from preprocess import sessionFiles, sessionName
+
+
+schemaName = 'schema.json'
+bom = '\ufeff'
+
+# type of every known column; categories are extended by the values found
+schema = {
+    'block': {'dtype': 'int16'},
+    'trial': {'dtype': 'int16'},
+    's1_state': {'dtype': 'bool'},
+    'direction': {'dtype': 'category', 'categories': ['left', 'right']},
+    'response': {'dtype': 'category', 'categories': ['left', 'right', 'noresponse']},
+    'rt': {'dtype': 'float64'},
+    'pair': {'dtype': 'int64'},
+    # pilots
+    'condition': {'dtype': 'category', 'categories': ['noise', 'signal']},
+    '.thisRepN': {'dtype': 'int16'},
+    '.thisTrialN': {'dtype': 'int16'},
+    '.thisN': {'dtype': 'int16'},
+    '.thisIndex': {'dtype': 'int16'},
+    'pair_id': {'dtype': 'int64'},
+    'chamber': {'dtype': 'int8'},
+    'threshold': {'dtype': 'float64'},
+    'overall': {'dtype': 'int8'},
+    'noise': {'dtype': 'int8'},
+    'signal': {'dtype': 'int8'}
+}
+
+# columns that are not in the csv files
+derived = {
+    'session': {'dtype': 'int16'},
+    'subject': {'dtype': 'int8'}
+}
+
+booleans = [('True', 'False'), ('TRUE', 'FALSE'), ('true', 'false')]
+nulls = ['None', '', 'nan', 'NaN']
+
+def defaultStore (datadir):
+    return os.path.join(datadir, 'columnar')
+
+def infer (values):
+    '''
+        type of a column that is not in the schema, from its values in all
+        session files
+    '''
+    present = [v for v in values if v not in nulls]
+    for dtype, parse, fmt in [('int64', int, str), ('float64', float, repr)]:
+        try:
+            if all(fmt(parse(v)) == v for v in present):
+                if dtype == 'float64' or len(present) == len(values):
+                    return {'dtype': dtype}
+                return {'dtype': 'float64', 'integer': True} # integers with missing values
+        except ValueError:
+            pass
+    for true, false in booleans:
+        if present and set(present) <= {true, false}:
+            return {'dtype': 'bool'}
+    return {'dtype': 'category', 'categories': []}
+
+def readcsv (path):
+    '''
+        header, rows (text) and layout of a session file
+    '''
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        text = f.read()
+    layout = {'bom': text.startswith(bom), 'newline': '\r\n' if '\r\n' in text else '\n'}
+    text = text[1:] if layout['bom'] else text
+    layout['final'] = text.endswith(layout['newline'])
+
+    rows = list(csv.reader(text.split(layout['newline'])[:-1] if layout['final'] else text.split(layout['newline'])))
+    header, rows = rows[0], rows[1:]
+    # a delimiter at the end of every line gives an unnamed empty column
+    layout['trailing'] = header[-1] == '' and all(row[-1] == '' for row in rows)
+    if layout['trailing']:
+        header, rows = header[:-1], [row[:-1] for row in rows]
+    return header, rows, layout
+
+def parse (values, spec, layout, name):
+    '''
+        typed array of the text of a column; records the spelling of the
+        booleans and of missing values in the layout
+    '''
+    dtype = spec['dtype']
+    missing = sorted(set(v for v in values if v in nulls))
+    if dtype in ('float64', 'category') and missing:
+        if len(missing) > 1:
+            raise ValueError("%s has missing values written as %s" % (name, ' and '.join(map(repr, missing))))
+        layout['null'][name] = missing[0]
+
+    if dtype == 'bool':
+        present = set(values)
+        for true, false in booleans:
+            if present <= {true, false}:
+                layout['true'], layout['false'] = true, false
+                return np.array([v == true for v in values], dtype=bool)
+        raise ValueError("%s is not boolean: %s" % (name, ', '.join(sorted(present))))
+    if dtype == 'category':
+        for v in values:
+            if v not in spec['categories'] and v not in missing:
+                spec['categories'].append(v)
+        index = {c: i for i, c in enumerate(spec['categories'])}
+        return np.array([index.get(v, -1) for v in values], dtype=np.int8)
+    if dtype == 'float64':
+        return np.array([np.nan if v in missing else float(v) for v in values], dtype=np.float64)
+    return np.array([int(v) for v in values], dtype=dtype)
+
+def fmt (values, spec, layout, name):
+    '''
+        text of a typed column, as in the session file
+    '''
+    dtype = spec['dtype']
+    null = layout['null'].get(name)
+    if dtype == 'bool':
+        texts = [layout['true'] if v else layout['false'] for v in values]
+    elif dtype == 'category':
+        texts = [spec['categories'][c] if c >= 0 else null for c in values]
+    elif dtype == 'float64':
+        number = (lambda v: str(int(v))) if spec.get('integer') else (lambda v: repr(float(v)))
+        texts = [null if np.isnan(v) else number(v) for v in values]
+    else:
+        texts = [str(v) for v in values]
+
+    # cells written differently, e.g. with 17 digits by a spreadsheet
+    for row, text in layout['text'].get(name, {}).items():
+        texts[int(row)] = text
+    return texts
+
+def writecsv (header, columns, layout):
+    '''
+        text of a session file
+    '''
+    lines = []
+    end = ',' if layout['trailing'] else ''
+    for row in [header] + [list(r) for r in zip(*columns)]:
+        out = []
+        csv.writer(_Lines(out), lineterminator='').writerow(row)
+        lines.append(out[0] + end)
+    text = layout['newline'].join(lines) + (layout['newline'] if layout['final'] else '')
+    return (bom if layout['bom'] else '') + text
+
+class _Lines:
+    '''
+        file-like target of csv.writer that collects the lines
+    '''
+    def __init__ (self, lines):
+        self.lines = lines
+
+    def write (self, line):
+        self.lines.append(line)
+
+def columntypes (paths):
+    '''
+        type of every column of the session files, decided from the values
+        of all files; a schema integer column with a missing value anywhere
+        becomes float64
+    '''
+    values = {}
+    for path in paths:
+        header, rows, _ = readcsv(path)
+        for name, column in zip(header, zip(*rows) if rows else [[] for _ in header]):
+            values.setdefault(name, []).extend(column)
+
+    types = {}
+    for name, column in values.items():
+        if name not in schema:
+            types[name] = infer(column)
+        elif schema[name]['dtype'].startswith('int') and any(v in nulls for v in column):
+            types[name] = {'dtype': 'float64', 'integer': True}
+        else:
+            types[name] = dict(schema[name])
+        if 'categories' in types[name]:
+            types[name]['categories'] = list(types[name]['categories'])
+    return types
+
+def importsession (path, types):
+    '''
+        typed columns and layout of a session file, checked to export to
+        the same text; types are those of columntypes()
+    '''
+    header, rows, layout = readcsv(path)
+    layout['null'] = {}
+    layout['text'] = {}
+    texts = list(zip(*rows)) if rows else [[] for _ in header]
+
+    columns = {}
+    for name, values in zip(header, texts):
+        columns[name] = parse(list(values), types[name], layout, name)
+        written = fmt(columns[name], types[name], layout, name)
+        exceptions = {str(row): text for row, (text, same) in enumerate(zip(values, written)) if text != same}
+        if exceptions:
+            layout['text'][name] = exceptions
+
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        expected = f.read()
+    if writecsv(header, [fmt(columns[name], types[name], layout, name) for name in header], layout) != expected:
+        raise ValueError("%s cannot be stored without loss" % path)
+
+    layout['columns'] = header
+    return columns, len(rows), layout
+
+def blank (spec, nrows):
+    '''
+        column of a session that does not have it
+    '''
+    if spec['dtype'] == 'category':
+        return np.full(nrows, -1, dtype=np.int8)
+    if spec['dtype'] == 'float64':
+        return np.full(nrows, np.nan)
+    return np.zeros(nrows, dtype=spec['dtype'])
+
+def actingchamber (columns, nrows):
+    '''
+        chamber of the subject that responds in every trial, 0 if unknown
+    '''
+    if 's1_state' in columns:
+        return np.where(columns['s1_state'], 1, 2).astype(np.int8)
+    if 'chamber' in columns:
+        return columns['chamber'].astype(np.int8)
+    return np.zeros(nrows, dtype=np.int8)
+
+def convert (datadir, storedir=None):
+    '''
+        store of all session files in datadir; returns the schema
+    '''
+    storedir = storedir or defaultStore(datadir)
+    paths = sessionFiles(datadir)
+    types = columntypes(paths)
+    sessions = []
+    parts = []
+    start = 0
+    for path in paths:
+        columns, nrows, layout = importsession(path, types)
+        stat = os.stat(path)
+        layout.update({'name': sessionName(path), 'file': os.path.basename(path), 'start': start, 'stop': start + nrows,
+                       'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+        # the ids of every row
+        columns['session'] = np.full(nrows, len(sessions), dtype=np.int16)
+        columns['subject'] = actingchamber(columns, nrows)
+        if 'pair' not in columns:
+            columns['pair'] = np.full(nrows, int(layout['name'].split('_')[0]), dtype=np.int64)
+        sessions.append(layout)
+        parts.append(columns)
+        start += nrows
+
+    types.update({name: dict(spec) for name, spec in derived.items()})
+    types.setdefault('pair', dict(schema['pair']))
+    for name, spec in types.items():
+        if spec['dtype'] == 'category' and len(spec['categories']) > 127:
+            raise ValueError("%s has too many categories for int8 codes" % name)
+
+    os.makedirs(storedir, exist_ok=True)
+    for name, spec in types.items():
+        array = np.concatenate([columns[name] if name in columns else blank(spec, layout['stop'] - layout['start'])
+                                for columns, layout in zip(parts, sessions)])
+        np.save(os.path.join(storedir, name + '.npy'), array)
+
+    result = {'rows': start, 'columns': types, 'sessions': sessions}
+    filename = os.path.join(storedir, schemaName)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(result, f, indent=1)
+    os.replace(filename + '.tmp', filename)
+    return result
+
+def readschema (storedir):
+    with open(os.path.join(storedir, schemaName), 'r') as f:
+        return json.load(f)
+
+def current (storedir, datadir):
+    '''
+        whether the store holds exactly the session files of datadir,
+        unchanged since they were converted
+    '''
+    try:
+        info = readschema(storedir)
+    except (FileNotFoundError, ValueError):
+        return False
+
+    stored = {layout['file']: (layout.get('size'), layout.get('mtime')) for layout in info['sessions']}
+    files = {}
+    for path in sessionFiles(datadir):
+        stat = os.stat(path)
+        files[os.path.basename(path)] = (stat.st_size, stat.st_mtime_ns)
+    return files == stored
+
+def arrays (storedir, columns=None):
+    '''
+        memory-mapped arrays of the columns of a store and its schema
+    '''
+    info = readschema(storedir)
+    names = list(info['columns']) if columns is None else columns
+    return {name: np.load(os.path.join(storedir, name + '.npy'), mmap_mode='r') for name in names}, info
+
+def load (storedir, columns=None):
+    '''
+        all sessions of a store in one frame, categoricals built from the
+        codes and session as the names of the sessions; the arrays are not
+        copied or parsed
+    '''
+    data, info = arrays(storedir, columns)
+    frame = {}
+    for name, values in data.items():
+        spec = info['columns'][name]
+        if spec['dtype'] == 'category':
+            frame[name] = pd.Categorical.from_codes(values, spec['categories'])
+        elif name == 'session':
+            frame[name] = pd.Categorical.from_codes(values, [s['name'] for s in info['sessions']])
+        else:
+            frame[name] = values
+    return pd.DataFrame(frame, copy=False)
+
+def rawtrials (storedir, names):
+    '''
+        the given columns of all sessions as preprocess.readsession() reads
+        them: direction and response as text, rt as float32 and session as
+        the names of the sessions
+    '''
+    df = load(storedir, [name for name in names if name != 'session'] + ['session'])
+    for name in ['direction', 'response']:
+        if name in df.columns:
+            df[name] = df[name].astype(object)
+    if 'rt' in df.columns:
+        df['rt'] = df['rt'].astype(np.float32)
+    return df
+
+def export (storedir, outdir):
+    '''
+        the session files of a store, as they were converted
+    '''
+    data, info = arrays(storedir)
+    os.makedirs(outdir, exist_ok=True)
+    filenames = []
+    for layout in info['sessions']:
+        rows = slice(layout['start'], layout['stop'])
+        texts = [fmt(data[name][rows], info['columns'][name], layout, name) for name in layout['columns']]
+        filename = os.path.join(outdir, layout['file'])
+        with open(filename, 'w', encoding='utf-8', newline='') as f:
+            f.write(writecsv(layout['columns'], texts, layout))
+        filenames.append(filename)
+    return filenames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the session files to the columnar format and back.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convertparser = commands.add_parser('convert', help='store all session files of a directory')
+    convertparser.add_argument('datadir', nargs='?', default=os.path.join(os.getcwd(), 'data'))
+    convertparser.add_argument('--out', default=None, help='store directory, <datadir>/columnar by default')
+    exportparser = commands.add_parser('export', help='write the session files of a store')
+    exportparser.add_argument('store')
+    exportparser.add_argument('outdir')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'convert':
+        info = convert(args.datadir, args.out)
+        print('%d trials of %d sessions, %d columns (%.2f s)'
+              % (info['rows'], len(info['sessions']), len(info['columns']), time.perf_counter() - start))
+    else:
+        filenames = export(args.store, args.outdir)
+        print('%d session files written (%.2f s)' % (len(filenames), time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
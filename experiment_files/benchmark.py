@@ -0,0 +1,312 @@
+'''
+    Headless benchmark of the stimulus code and the dyadic trial loop
+
+    Runs without the lab hardware: psychopy's window and stimuli are replaced
+    by stubs that only count draw calls, the BBTK response boxes by fake
+    keyboards answering after a random response time, and the sound by a
+    null backend. What is measured is the CPU work done per frame by our
+    code (dot updates, batching, response polling), i.e. what has to fit
+    into a frame besides the GPU work.
+
+        python benchmark.py [--blocks 1] [--trials 100] [--seed 0]
+
+    reports
+        * construction time of both subjects' mainstim and the dualstim
+        * per-frame CPU time percentiles for pretrial, decision and feedback
+        * memory allocated during construction and one block (tracemalloc)
+'''
+
+import sys
+import time
+import types
+import argparse
+import tracemalloc
+import numpy as np
+
+
+##### STUBS FOR PSYCHOPY #####
+class stubwindow:
+    '''
+        stands in for visual.Window; flip() advances a simulated clock by
+        exactly one frame, so the timing is never the bottleneck, and keeps
+        the CPU time spent since the previous flip in cputimes
+    '''
+    def __init__(self, size, refreshRate):
+        self.size = np.array(size)
+        self.period = 1.0 / refreshRate
+        self.t = 0.0
+        self.nflips = 0
+        self.ndraws = 0
+        self.cputimes = []
+        self.lastflip = time.perf_counter()
+
+    def flip(self):
+        self.cputimes.append(time.perf_counter() - self.lastflip)
+        self.t += self.period
+        self.nflips += 1
+        self.lastflip = time.perf_counter()
+        return self.t
+
+    def getFutureFlipTime(self, clock=None):
+        return self.t + self.period
+
+    def close(self):
+        pass
+
+
+class stubstim:
+    '''
+        stands in for every psychopy stimulus; positions are copied on
+        assignment like psychopy does, drawing only counts the call
+    '''
+    def __init__(self, win=None, **kwargs):
+        self.win = win
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @property
+    def xys(self):
+        return self.__dict__.get('xys')
+
+    @xys.setter
+    def xys(self, value):
+        self.__dict__['xys'] = np.array(value, float)
+
+    def draw(self):
+        self.win.ndraws += 1
+
+
+class nullsound:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def play(self, when=None):
+        pass
+
+    def stop(self):
+        pass
+
+
+class fakekey:
+    def __init__(self, name, rt):
+        self.name = name
+        self.rt = rt
+
+
+class fakeclock:
+    def __init__(self, window):
+        self.window = window
+        self.start = window.t
+
+    def reset(self):
+        self.start = self.window.t
+
+    def getTime(self):
+        return self.window.t - self.start
+
+
+class fakekeyboard:
+    '''
+        a response box that presses `key` once `rt` seconds of simulated
+        time have passed since the clock was reset
+    '''
+    def __init__(self, window):
+        self.clock = fakeclock(window)
+        self.rt = None
+        self.key = None
+
+    def respond(self, key, rt):
+        self.key = key
+        self.rt = rt
+
+    def clearEvents(self, eventType=None):
+        pass
+
+    def getKeys(self, keyList=None, clear=True):
+        if self.rt is None or self.clock.getTime() < self.rt:
+            return []
+        keys = [fakekey(self.key, self.clock.getTime())]
+        if clear:
+            self.rt = None
+        return keys
+
+
+def fallbackColorNames():
+    rgb255 = {'forestgreen': (34, 139, 34), 'deepskyblue': (0, 191, 255), 'yellow': (255, 255, 0)}
+    return {name: tuple(c / 127.5 - 1 for c in rgb) for name, rgb in rgb255.items()}
+
+
+def installstubs():
+    '''
+        put the stubs in place of psychopy.visual, .sound and .hardware
+        before stimuli_random_dots is imported
+    '''
+    try:
+        import psychopy
+        from psychopy import colors
+    except ImportError:
+        psychopy = types.ModuleType('psychopy')
+        colors = types.ModuleType('psychopy.colors')
+        colors.colorNames = fallbackColorNames()
+
+    visual = types.ModuleType('psychopy.visual')
+    visual.Window = stubwindow
+    visual.ElementArrayStim = visual.GratingStim = visual.TextStim = visual.DotStim = stubstim
+
+    sound = types.ModuleType('psychopy.sound')
+    sound.Sound = nullsound
+
+    core = types.ModuleType('psychopy.core')
+    core.getTime = time.perf_counter
+    core.wait = lambda secs: None
+
+    event = types.ModuleType('psychopy.event')
+
+    hardware = types.ModuleType('psychopy.hardware')
+    hardware.keyboard = types.ModuleType('psychopy.hardware.keyboard')
+    hardware.keyboard.Keyboard = fakekeyboard
+    sys.modules['psychopy.hardware.keyboard'] = hardware.keyboard
+
+    for name, module in [('colors', colors), ('visual', visual), ('sound', sound), ('core', core), ('event', event), ('hardware', hardware)]:
+        setattr(psychopy, name, module)
+        sys.modules['psychopy.' + name] = module
+    sys.modules['psychopy'] = psychopy
+
+
+##### BENCHMARK #####
+def percentiles(times):
+    times = np.asarray(times) * 1000
+    if len(times) == 0:
+        return "n/a"
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    return "p50 {:6.3f}  p90 {:6.3f}  p99 {:6.3f}  max {:6.3f} ms  ({} frames)".format(
+        p50, p90, p99, times.max(), len(times))
+
+
+def construct(window, stimuli, coherences, seed=None):
+    '''
+        build both subjects' stimuli like dyadic_random_dots.py does
+    '''
+    offsets = [window.size[0] / 4, -window.size[0] / 4]
+    stims = [stimuli.mainstim(window=window, xoffset=x, coherence=c, seed=seed)
+             for x, c in zip(offsets, coherences)]
+    return stims, stimuli.dualstim(window, stims)
+
+
+class stubsubject:
+    '''
+        the parts of dyadic_random_dots.subject that the trial loop uses
+    '''
+    def __init__(self, stimulus, kb, buttons):
+        from responses import responselistener
+        self.stimulus = stimulus
+        self.kb = kb
+        self.buttons = {**buttons, None: "noresponse"}
+        self.listener = responselistener(kb, self.buttons)
+        self.beep = nullsound()
+        self.state = False
+        self.response = None
+
+
+def runblock(window, stims, renderer, timer, blockSchedule, rng):
+    '''
+        one block of the dyadic main experiment, run by the trial loop of
+        dyadic_random_dots.py (trialloop.dyadictrials) with simulated
+        responses; returns the CPU time of every frame per interval
+    '''
+    import config
+    from trialloop import dyadictrials
+
+    buttons = [{"2": "right", "1": "left"}, {"7": "right", "8": "left"}]
+    subjects = [stubsubject(s, fakekeyboard(window), b) for s, b in zip(stims, buttons)]
+    trials = dyadictrials(window, renderer, timer, subjects, config.frames(100),
+                          config.settings['slowResponse'], config.settings['fastResponse'])
+
+    frametimes = {'pretrial': [], 'decision': [], 'feedback': []}
+    for trial in blockSchedule:
+        # the press is timed from the clock reset at the start of the decision interval
+        acting = 0 if trial['s1_state'] else 1
+        subjects[acting].kb.respond(rng.choice(list(buttons[acting])), rng.lognormal(np.log(0.8), 0.3))
+
+        window.cputimes = []
+        window.lastflip = time.perf_counter()
+        trials.run(trial)
+        timer.summary()
+
+        cputimes = window.cputimes
+        pretrial, feedback = int(trial['pretrialFrames']), int(trial['feedbackFrames'])
+        frametimes['pretrial'].extend(cputimes[:pretrial])
+        frametimes['decision'].extend(cputimes[pretrial:len(cputimes) - feedback])
+        frametimes['feedback'].extend(cputimes[len(cputimes) - feedback:])
+
+    return frametimes
+
+
+def main():
+    import config
+    # the settings flags, e.g. --REFRESH_RATE=144, the rest is parsed below
+    config.init(sys.argv)
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blocks', type=int, default=1)
+    parser.add_argument('--trials', type=int, default=100, help="trials per block")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    installstubs()
+    import schedule
+    import stimuli_random_dots as stimuli
+    from frametiming import frametimer
+
+    rng = np.random.RandomState(args.seed)
+    np.random.seed(args.seed)
+    window = stubwindow((stimuli.M_WIDTH * 2, stimuli.M_HEIGHT), stimuli.REFRESH_RATE)
+
+    # timings first, without tracemalloc slowing everything down
+    t = time.perf_counter()
+    stims, renderer = construct(window, stimuli, [0.1, 0.15], seed=args.seed)
+    constructiontime = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for thread in [thread for s in stims for thread in s.prewarm()]:
+        thread.join()
+    prewarmtime = time.perf_counter() - t
+
+    # the schedule of the session, one more block for the tracemalloc run
+    sessionSchedule = schedule.create(args.seed, args.blocks + 1, args.trials, 0, stimuli.N, stimuli.REFRESH_RATE,
+                                      acting=config.settings['acting'], maxrun=config.settings['maxActingRun'])
+    blockSchedules = schedule.blocks(sessionSchedule)
+
+    timer = frametimer(window, stimuli.REFRESH_RATE)
+    frametimes = {'pretrial': [], 'decision': [], 'feedback': []}
+    t = time.perf_counter()
+    for blockSchedule in blockSchedules[:-1]:
+        for key, times in runblock(window, stims, renderer, timer, blockSchedule, rng).items():
+            frametimes[key].extend(times)
+    blocktime = time.perf_counter() - t
+    nflips, ndraws = window.nflips, window.ndraws
+
+    # then the same again under tracemalloc for the allocations
+    tracemalloc.start()
+    construct(window, stimuli, [0.1, 0.15], seed=args.seed)
+    _, constructionpeak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    runblock(window, stims, renderer, frametimer(window, stimuli.REFRESH_RATE), blockSchedules[-1], rng)
+    retained, blockpeak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("construction (2 subjects): {:8.1f} ms, peak memory {:.1f} MB".format(constructiontime * 1000, constructionpeak / 1e6))
+    print("prewarm of all patches   : {:8.1f} ms".format(prewarmtime * 1000))
+    print("simulated block(s)       : {:8.1f} ms for {} trials, {} flips, {} draw calls".format(
+        blocktime * 1000, args.blocks * args.trials, nflips, ndraws))
+    for key, times in frametimes.items():
+        print("  {:<9s} CPU per frame: {}".format(key, percentiles(times)))
+    alltimes = [t for times in frametimes.values() for t in times]
+    print("  {:<9s} CPU per frame: {}".format('all', percentiles(alltimes)))
+    print("memory during one block  : {:+.2f} MB retained, peak {:.2f} MB".format(retained / 1e6, blockpeak / 1e6))
+
+
+if __name__ == "__main__":
+    main()
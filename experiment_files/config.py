@@ -0,0 +1,284 @@
+'''
+    Settings of the experiment
+
+    The monitor, the dot stimuli, the number of blocks and trials, the
+    button keys and the beeps of all scripts are defined once in
+    experiment.json. Every script calls init(sys.argv) first thing; any of
+    the settings can then be overridden on its command line, and a different
+    file can be used:
+        python dyadic_random_dots.py <pair id> --REFRESH_RATE=144 --N=40
+        python titration_dual.py <pair id> --config=lab2.json --keys.2.left=3
+    The flags are removed from the argument list, so the scripts see their
+    positional arguments as before. All values are checked before anything
+    is set up; a wrong setting exits with a message.
+
+    Importing the module does neither: modules, notebooks and tools that
+    never call init() get the settings of experiment.json, read on the first
+    use of config.settings.
+
+    Durations, the lifetime of the dots and their speed (degrees per second)
+    are given in seconds; frames() converts them to frames at the configured
+    refresh rate, so a 120 or 144 Hz display only needs REFRESH_RATE to be
+    changed.
+'''
+
+import os
+import sys
+import json
+import math
+
+
+defaultFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'experiment.json')
+
+def number (minVal=None, maxVal=None, integer=False):
+    '''
+        check of a numeric setting, returns None or what is wrong with it
+    '''
+    def check (value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            return "has to be a number"
+        if integer and value != int(value):
+            return "has to be a whole number"
+        if minVal is not None and value < minVal:
+            return "has to be at least {}".format(minVal)
+        if maxVal is not None and value > maxVal:
+            return "has to be at most {}".format(maxVal)
+    return check
+
+def even (value):
+    problem = number(minVal=2, integer=True)(value)
+    if problem is None and value % 2:
+        problem = "has to be even (half of the trials move left, half right)"
+    return problem
+
+def text (value):
+    if not isinstance(value, str) or not value:
+        return "has to be a non-empty string"
+
+def oneof (*options):
+    def check (value):
+        if value not in options:
+            return "has to be one of " + ", ".join(options)
+    return check
+
+def keymaps (value):
+    if not isinstance(value, dict) or sorted(value) != ['1', '2']:
+        return "has to have an entry for chamber 1 and 2"
+    for sid, keys in value.items():
+        if not isinstance(keys, dict) or sorted(keys) != ['left', 'right']:
+            return "of chamber {} needs a left and a right key".format(sid)
+        if keys['left'] == keys['right'] or not all(isinstance(k, str) and k for k in keys.values()):
+            return "of chamber {} have to be two different keys".format(sid)
+    if set(value['1'].values()) & set(value['2'].values()):
+        return "of the two chambers have to be different"
+
+def tones (value):
+    if not isinstance(value, dict) or not {'1', '2', 'single'} <= set(value):
+        return "has to have an entry for chamber 1, 2 and single"
+    for name, tone in value.items():
+        if not isinstance(tone, dict) or text(tone.get('note')) or number(0, 8, integer=True)(tone.get('octave')):
+            return "{} needs a note and an octave between 0 and 8".format(name)
+    if value['1'] == value['2']:
+        return "of the two chambers have to be different"
+
+# name -> check of its value
+schema = {
+    'M_WIDTH': number(minVal=1, integer=True),
+    'M_WIDTH_CM': number(minVal=1),
+    'M_HEIGHT': number(minVal=1, integer=True),
+    'REFRESH_RATE': number(minVal=30, maxVal=500),
+    'distance': number(minVal=1),
+
+    'N': number(minVal=1, integer=True),
+    'ndots': number(minVal=1, integer=True),
+    'dotlifetime': number(minVal=0),
+    'dotspeed': number(minVal=0),
+    'practiceTrialCoherence': number(minVal=0, maxVal=1),
+    'trajectorySeconds': number(minVal=1),
+
+    'blocks': number(minVal=1, integer=True),
+    'ntrials': even,
+    'nPracticeTrials': even,
+    'acting': oneof('random', 'balanced'),
+    'maxActingRun': number(minVal=0, integer=True),
+    'onePersonBlocks': number(minVal=1, integer=True),
+    'onePersonTrials': even,
+    'titrationTrials': number(minVal=1, integer=True),
+    'minCoherence': number(minVal=0, maxVal=1),
+    'maxCoherence': number(minVal=0, maxVal=1),
+
+    'slowResponse': number(minVal=0),
+    'fastResponse': number(minVal=0),
+
+    'keys': keymaps,
+    'audioDevice': text,
+    'beepSeconds': number(minVal=0),
+    'beepVolume': number(minVal=0, maxVal=1),
+    'beeps': tones
+}
+
+def parseflags (argv):
+    '''
+        split the --name=value flags of the settings off the arguments
+
+        Returns the config file (None if not given), the overrides as a list
+        of (dotted name, value) and the remaining arguments. Other flags are
+        left to the script, e.g. the argparse options of benchmark.py.
+    '''
+    filename = None
+    overrides = []
+    rest = []
+
+    for arg in argv:
+        name, _, value = arg[2:].partition('=')
+        if not arg.startswith('--') or not _ or (name.split('.')[0] not in schema and name != 'config'):
+            rest.append(arg)
+            continue
+
+        if name == 'config':
+            filename = value
+            continue
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass # plain strings like note names or keys
+        overrides.append((name, value))
+
+    return filename, overrides, rest
+
+def override (settings, name, value):
+    '''
+        set a (dotted) setting, e.g. keys.1.left
+    '''
+    path = name.split('.')
+    target = settings
+    for key in path[:-1]:
+        if not isinstance(target.get(key), dict):
+            raise KeyError(name)
+        target = target[key]
+    if path[-1] not in target:
+        raise KeyError(name)
+
+    # keys and notes stay strings even if they look like numbers
+    if isinstance(target[path[-1]], str) and not isinstance(value, str):
+        value = json.dumps(value)
+    target[path[-1]] = value
+
+def validate (settings):
+    '''
+        list of everything that is wrong with the settings
+    '''
+    problems = []
+    for name, check in schema.items():
+        if name not in settings:
+            problems.append("{} is missing".format(name))
+            continue
+        problem = check(settings[name])
+        if problem is not None:
+            problems.append("{} {}".format(name, problem))
+
+    for name in settings:
+        if name not in schema:
+            problems.append("{} is not a setting".format(name))
+
+    if not problems and settings['minCoherence'] >= settings['maxCoherence']:
+        problems.append("minCoherence has to be smaller than maxCoherence")
+    if not problems and settings['fastResponse'] >= settings['slowResponse']:
+        problems.append("fastResponse has to be shorter than slowResponse")
+
+    return problems
+
+def load (filename=None, overrides=()):
+    '''
+        read and check the settings, exits with a message if they are not
+        usable
+    '''
+    filename = filename or defaultFile
+    problems = []
+    try:
+        with open(filename, 'r') as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        settings, problems = {}, ["Config file {} not found".format(filename)]
+    except ValueError as e:
+        settings, problems = {}, ["Config file {} is not valid json: {}".format(filename, e)]
+
+    if not problems:
+        for name, value in overrides:
+            try:
+                override(settings, name, value)
+            except KeyError:
+                problems.append("--{} is not a setting".format(name))
+        problems += validate(settings)
+
+    if problems:
+        for problem in problems:
+            print(problem)
+        sys.exit(-1)
+
+    settings['file'] = os.path.abspath(filename)
+    return settings
+
+def init (argv=None):
+    '''
+        read the settings for a script: the settings flags are split off
+        argv (the script's sys.argv, changed in place so the script sees its
+        own arguments only) and applied to the config file.
+
+        The first call wins, so the parts that run_session.py runs in the
+        same process keep the settings of the session. Returns the settings.
+    '''
+    global initialised
+    if initialised:
+        return current()
+
+    argv = sys.argv if argv is None else argv
+    filename, overrides, argv[1:] = parseflags(argv[1:])
+    loaded = load(filename, overrides)
+    initialised = True
+
+    # a module may already hold the settings read from the default file
+    if 'settings' in globals():
+        settings.clear()
+        settings.update(loaded)
+    else:
+        globals()['settings'] = loaded
+    return settings
+
+def current ():
+    '''
+        the settings; read from the default file if no script called init()
+    '''
+    if 'settings' not in globals():
+        globals()['settings'] = load()
+    return globals()['settings']
+
+def __getattr__ (name):
+    # config.settings and `from config import settings` before the first read
+    if name == 'settings':
+        return current()
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
+
+def frames (seconds):
+    '''
+        number of frames shown in the given time
+    '''
+    return int(round(seconds * current()['REFRESH_RATE']))
+
+def keymap (sid):
+    '''
+        left and right key of the button box of a chamber
+    '''
+    return current()['keys'][str(sid)]
+
+def beep (sid):
+    '''
+        arguments of the psychopy Sound of a chamber (or 'single')
+    '''
+    settings = current()
+    tone = settings['beeps'][str(sid)]
+    return {'value': tone['note'], 'octave': tone['octave'],
+            'secs': settings['beepSeconds'], 'volume': settings['beepVolume']}
+
+
+initialised = False # by a script, with its command line
@@ -0,0 +1,81 @@
+'''
+    Early stopping of the titration
+
+    convergencemonitor is given the running threshold estimate after every
+    trial (and, for the staircase, the posterior sd) and tells when the
+    titration can end: after at least minTrials trials, as soon as the
+    posterior sd is below tolerance times the estimate, or the estimates of
+    the last `window` trials all lie within the tolerance of the current one.
+    The reason for stopping and the per-trial estimates are kept so they can
+    be stored with the subject data.
+'''
+
+import numpy as np
+
+
+class convergencemonitor:
+    def __init__(self, tolerance=0.1, minTrials=30, window=10, estimates=()):
+        '''
+            tolerance is relative to the current estimate; estimates are those
+            of an earlier titration that is continued, they count towards
+            minTrials and the window
+        '''
+        self.tolerance = tolerance
+        self.minTrials = minTrials
+        self.window = window
+
+        self.estimates = [float(e) for e in estimates]
+        self.sds = [None] * len(self.estimates)
+        self.reason = None
+
+    def __len__ (self):
+        return len(self.estimates)
+
+    @property
+    def stopped (self):
+        return self.reason is not None
+
+    def update (self, estimate, sd=None):
+        '''
+            add the estimate after one more trial, returns True if the
+            titration can stop
+        '''
+        self.estimates.append(float(estimate))
+        self.sds.append(None if sd is None else float(sd))
+
+        if self.stopped or len(self.estimates) < self.minTrials:
+            return self.stopped
+
+        if sd is not None and sd <= self.tolerance * estimate:
+            self.reason = 'posterior sd'
+        elif len(self.estimates) >= self.window:
+            recent = np.array(self.estimates[-self.window:])
+            if np.all(np.abs(recent - estimate) <= self.tolerance * estimate):
+                self.reason = 'stable estimate'
+
+        return self.stopped
+
+    def finish (self, reason='all trials'):
+        '''
+            record why the titration ended if it did not stop early
+        '''
+        if self.reason is None:
+            self.reason = reason
+        return self.reason
+
+
+def plausible (threshold, minVal, maxVal):
+    '''
+        whether a fitted threshold can be used for the experiment
+    '''
+    return threshold is not None and np.isfinite(threshold) and minVal <= threshold <= maxVal
+
+def plausibleposterior (staircase, edge=0.05, width=0.5):
+    '''
+        whether the threshold of a gridstaircase can be used for the
+        experiment; its estimate always lies inside the grid, so instead the
+        posterior must not pile up at an end of the coherence range (more
+        than `edge` of its mass in the outer 2 % of the grid) and its sd
+        must be below `width` times the estimate
+    '''
+    return staircase.edgemass() <= edge and staircase.sd() <= width * staircase.mean()
@@ -5,14 +5,34 @@
 
 import os
 import sys
+import config
+config.init(sys.argv)
+from startup import startuptimer, getpairid, loadthresholds
+import session
+
+startup = startuptimer()
+
+# check the settings (experiment.json and the command-line flags, read by
+# config.init above), the pair id and the titration files before the heavy
+# imports and the window, so a mistake fails right away; in a session run by
+# run_session.py both come from the titration
+if session.current is not None:
+    pair_id = session.current.pair_id
+    thresholds = session.current.thresholds
+else:
+    pair_id = getpairid()
+    thresholds = loadthresholds(pair_id, minVal=config.settings['minCoherence'], maxVal=config.settings['maxCoherence'])
+startup.mark('arguments and titration files')
+
 from subprocess import run
-import numpy as np
-import psychtoolbox as ptb
 from psychopy import visual, event, core, gui, data, prefs, monitors
 from psychopy.hardware import keyboard
 import stimuli_random_dots as stimuli
-import random as rn
-import json
+from frametiming import frametimer
+from trialwriter import trialwriter
+from responses import responselistener, waitforall, getKeyboards
+from trialloop import dyadictrials
+import schedule
 
 # # ''' REMOVED bc doesn't work ON WINDOWS
 # import ctypes
@@ -21,10 +41,18 @@ import json
 # # '''
 
 
-blocks = range(6)
-ntrials = 100 # trials per block
+blocks = range(config.settings['blocks'])
+ntrials = config.settings['ntrials'] # trials per block
+
+nPracticeTrials = config.settings['nPracticeTrials']
 
-nPracticeTrials = 20
+# who acts, the direction, the dot patches and the pretrial and feedback
+# frame counts of every trial of the session, drawn from one seed; the trial
+# loops only index into it. It is saved with the data, see below
+sessionSchedule = schedule.create(schedule.scheduleSeed(pair_id), len(blocks), ntrials, nPracticeTrials,
+                                  config.settings['N'], config.settings['REFRESH_RATE'],
+                                  acting=config.settings['acting'], maxrun=config.settings['maxActingRun'],
+                                  practiceFeedback=1, feedback=0.7)
 
 '''
     TO DO
@@ -54,18 +82,12 @@ Copy the `name` attribute of your device to the audioDevice
 prefs.hardware['audioLib'] = ['PTB']
 
 from psychopy import sound
-sound.setDevice('USB Audio Device: - (hw:3,0)')
+if session.current is None:
+    sound.setDevice(config.settings['audioDevice'])
 
 from psychopy.sound import Sound
 from numpy.random import random
-
-# get pair id via command-line argument
-try:
-    pair_id = int(sys.argv[1])
-    # pair_id = 10
-except:
-    print('Please enter a number as pair id as command-line argument!')
-    pair_id = input()
+startup.mark('imports and audio device')
 
 # monitor specs global variables
 M_WIDTH = stimuli.M_WIDTH * 2
@@ -77,9 +99,12 @@ myMon = monitors.Monitor('DellU2412M', width=M_WIDTH, distance=stimuli.distance)
 myMon.setSizePix([M_WIDTH, M_HEIGHT])
 
 
-window = visual.Window(size=(M_WIDTH, M_HEIGHT), monitor=myMon,
-                       color="black", pos=(0,0), units='pix', blendMode='avg', # have to use 'avg' to avoid artefacts
-                       fullscr=False, allowGUI=False)
+if session.current is not None:
+    window = session.current.window
+else:
+    window = visual.Window(size=(M_WIDTH, M_HEIGHT), monitor=myMon,
+                           color="black", pos=(0,0), units='pix', blendMode='avg', # have to use 'avg' to avoid artefacts
+                           fullscr=False, allowGUI=False)
 
 # window = visual.Window(size=(1000, 800), monitor=myMon,
 #                        color="black", pos=(0,0), units='pix', blendMode='avg',
@@ -87,6 +112,10 @@ window = visual.Window(size=(M_WIDTH, M_HEIGHT), monitor=myMon,
 
 window.mouseVisible = False # hide cursor
 ofs = window.size[0] / 4
+startup.mark('window')
+
+# flip timestamps of the trial loops, for the dropped frame columns
+timer = frametimer(window, REFRESH_RATE)
 
 # update volume level of both speakers
 #run(["amixer", "-D", "pulse", "sset", "Master", "30%,30%", "quiet"])
@@ -102,17 +131,10 @@ class subject:
             xoffset is the constant added to all stimuli rendered for the subject
         '''
 
-        # for now: right key = green (2, 7), left key = red (1, 8)
-        keys = ["1", "2"] if sid == 1 else ["8", "7"]
-        # fetching subject titration thresholds
-        try:
-            f = open("data/" + str(pair_id) + "/data_chamber" + str(sid) + ".json", "r")
-            data = json.load(f)
-        except FileNotFoundError:
-            print("Titration file not found for subject in chamber {}".format(sid))
-            exit(-1)
-        else:
-            self.coherence = data["threshold"]
+        # left and right key of the button box, see experiment.json
+        keys = [config.keymap(sid)['left'], config.keymap(sid)['right']]
+        # subject titration threshold, checked at startup
+        self.coherence = thresholds[sid]
 
         self.id = sid
         self.kb = kb
@@ -120,12 +142,18 @@ class subject:
         self.xoffset = ofs if sid == 1 else -ofs
         self.response = None
 
-        if sid == 1:
-            self.beep = Sound('C', secs=0.5, volume=0.1, octave=5, name="S1")
-        else:
-            self.beep = Sound('F', secs=0.5, volume=0.1, octave=4, name="S2")
+        self.beep = Sound(name="S" + str(sid), **config.beep(sid))
 
-        self.stimulus = stimuli.mainstim(window=window, xoffset=self.xoffset, coherence=self.coherence)
+        # seeded stimuli; played back from data/<pair_id>/trajectories if
+        # precompute_trajectories.py has been run for this pair. In a session
+        # the stimuli of the titration are reused with the new coherence
+        if session.current is not None and sid in session.current.stimuli:
+            self.stimulus = session.current.stimuli[sid]
+            self.stimulus.setCoherence(self.coherence)
+        else:
+            self.stimulus = stimuli.mainstim(window=window, xoffset=self.xoffset, coherence=self.coherence,
+                                             seed=stimuli.stimulusSeed(pair_id, sid),
+                                             trajectories=stimuli.trajectoryDir(pair_id))
 
         self.buttons = {
                 keys[1] : "right",
@@ -133,6 +161,9 @@ class subject:
                 None : "noresponse"
                 }
 
+        # reads the button box once per frame during the decision interval
+        self.listener = responselistener(kb, self.buttons)
+
         # stationary dot patches for pretrial and feedback phase
         self.stationarydotslist = self.stimulus.stationaryDotsList
 
@@ -161,57 +192,46 @@ class subject:
 
 
 
-def getKeyboards():
-    '''
-        Search for the appropriate button box in each of the chambers
-        Once a button has been pressed on each of the button boxes,
-            create a keyboard object for each subject button box and assign it to them
-    '''
-    keybs = keyboard.getKeyboards()
-    k = {"chone" : None, "chtwo" : None}
-
-    for keyb in keybs:
-        if keyb['product'] == "Black Box Toolkit Ltd. BBTK Response Box":
-            if k['chone'] != None:
-                k['chtwo'] = keyb['index']
-                return k
-
-            if k['chtwo'] != None:
-                k['chone'] = keyb['index']
-                return k
-
-            ktemp = keyboard.Keyboard(keyb['index'])
-            keypress = ktemp.waitKeys(keyList=["1", "2", "7", "8"])
+if session.current is not None:
+    sone = subject(1, session.current.keyboards[1])
+    stwo = subject(2, session.current.keyboards[2])
+else:
+    keybs = getKeyboards()
+    startup.mark('button boxes')
+    sone = subject(1, keyboard.Keyboard( keybs["chone"] ))
+    stwo = subject(2, keyboard.Keyboard( keybs["chtwo"] ))
 
-            if keypress[0].name in ["1", "2"]:
-                k['chone'] = keyb['index']
-            else:
-                k['chtwo'] = keyb['index']
 
-keybs = getKeyboards()
-sone = subject(1, keyboard.Keyboard( keybs["chone"] ))
-stwo = subject(2, keyboard.Keyboard( keybs["chtwo"] ))
+subjects = [sone, stwo]
+startup.mark('subjects and stimuli')
 
+# draws the dots and fixation targets of both subjects in one call each
+renderer = stimuli.dualstim(window, [s.stimulus for s in subjects])
+startup.mark('renderer')
 
-subjects = [sone, stwo]
+# restore the dot patches from the snapshot written by
+# precompute_trajectories.py; whatever is not in it is built lazily, the
+# pools are filled in the background while the familiarisation and
+# instruction screens are running
+for s in subjects:
+    s.stimulus.restore(stimuli.snapshotFile(pair_id, s.id))
+    s.stimulus.prewarm()
+startup.mark('dot patch snapshot')
 
-expkb = keyboard.Keyboard()
+expkb = session.current.expkb if session.current is not None else keyboard.Keyboard()
 
 expinfo = {'pair': pair_id}
 
+print(startup.report())
+
 
 #### FUNCTIONS TO CREATE DIFFERENT TEXT SCREENS #####
 def gentext (instr):
     '''
         Generate text on both subject screens
     '''
-    visual.TextStim(window,
-                    text=instr, pos=[0 + sone.xoffset, 0],
-                    color='white', height=20).draw()
-
-    visual.TextStim(window,
-                    text=instr, pos=[0 + stwo.xoffset, 0],
-                    color='white', height=20).draw()
+    stimuli.getText(window, instr, [0 + sone.xoffset, 0]).draw()
+    stimuli.getText(window, instr, [0 + stwo.xoffset, 0]).draw()
 
 def genstartscreen ():
     instructions = "Welcome to the main part of the experiment! \n\n\
@@ -237,8 +257,8 @@ def geninstructionsexperiment ():
 3. Please respond as quickly and as accurately as possible! \n\
 4. Once you've finished one block, you’ll be asked if you’re ready for the next block.\n\
 5. After every second block, you will have a break.\n\
-6. There will be a total of 10 blocks.\n\n\
-Press the blue button when you’re ready to start the experiment"
+6. There will be a total of {} blocks.\n\n\
+Press the blue button when you’re ready to start the experiment".format(len(blocks))
 
     gentext(instructions)
 
@@ -268,139 +288,18 @@ def genmandatorybreakscreen ():
 
 
 ##### FUNCTIONS FOR THE TASK ITSELF #####
-def drawStationaryDots(choice):
-    '''
-        draw the stationary dot patch for both subjects
-    '''
-    for s in subjects:
-        s.stationarydotslist[choice].draw()
-
-
-def drawMovingDotsPractice(subjects, stimOne, stimTwo):
-    '''
-        draw the moving dot patch for both subjects for the practice
-        trials, but interleave three different dot patches
-        (probably not an optimal solution yet, but a fast one)
-    '''
-    stimOne.draw()
-    stimTwo.draw()
-
-
-def drawMovingDots(subjects, stimOne, stimTwo):
-    '''
-        draw the moving dot patch for both subjects for the
-        main experiment, but interleave three different
-        dot patches
-    '''
-    stimOne.draw()
-    stimTwo.draw()
-
-
-def drawFixation(color):
-    '''
-        draw the fixation crosses for both subjects
-    '''
-    if color == "green":
-        for grating_one, grating_two in zip(sone.greencross, stwo.greencross):
-            grating_one.draw()
-            grating_two.draw()
-
-    elif color == "yellow":
-        for grating_one, grating_two in zip(sone.yellowcross, stwo.yellowcross):
-            grating_one.draw()
-            grating_two.draw()
-
-    elif color == "blue":
-        for grating_one, grating_two in zip(sone.bluecross, stwo.bluecross):
-            grating_one.draw()
-            grating_two.draw()
-
-def genpretrialint (choice):
-    drawStationaryDots(choice)
-    drawFixation("green")
-
-def gendecisionint (subjects, section, stimOne, stimTwo):
-    if section == 'main':
-        drawMovingDots(subjects, stimOne, stimTwo)
-        drawFixation("green")
-    else:
-        drawMovingDotsPractice(subjects, stimOne, stimTwo)
-        drawFixation("green")
-
-def genfeedbackint (color, choice, rt_msg="NA"):
-    '''
-        1. Display static dot screen
-        2. Response indicated by fixation dot color: left/ blue or right/ yellow (assignment depends on pair_id)
-        3. The "do" subject sees response time message
-    '''
-    drawStationaryDots(choice)
-    drawFixation(color)
-
-    if rt_msg != "NA":
-        if stwo.state:
-            stwo.indicatordict[rt_msg].draw()
-        else:
-            sone.indicatordict[rt_msg].draw()
-
-def fetchbuttonpress (subjects):
-    '''
-        Get the button box input from the acting subject
-        Return the response (the pressed key) and the reaction time
-    '''
-    for s in subjects:
-        if not s.state:
-            continue
-        else:
-            temp = s.kb.getKeys(keyList=s.buttons.keys(), clear=True)
-
-            if len(temp) == 0:
-                resp = []
-                s.response = s.buttons[None]
-            else:
-                keystroke = temp[0].name
-                s.response = s.buttons[keystroke]
-                resp = [s.buttons[keystroke], temp[0].rt]
-
-    return resp
-
-def updatestate ():
-    '''
-        Update whose turn it is
-    '''
-    sone.state = next(iterstates)
-    stwo.state = bool(1 - sone.state)
-
 def secondstoframes (seconds):
-    return range( int( np.rint(seconds * REFRESH_RATE) ) )
+    return range( config.frames(seconds) )
 
-def getacknowledgements ():
+def getacknowledgements (timeout=None):
     '''
-        Wait until both subjects have confirmed they are ready by pressing "yes"
-
-    sone.kb.clearEvents(eventType="keyboard")
-    stwo.kb.clearEvents(eventType="keyboard")
-    key = []
-    while not key:
-        key = sone.kb.getKeys()
-
-    sone.kb.clearEvents(eventType="keyboard")
-    stwo.kb.clearEvents(eventType="keyboard")
-
+        Wait until both subjects have confirmed they are ready by pressing "right"
+        The experimenter can skip the wait by pressing space
     '''
-    sone_ack, stwo_ack = None, None
-
-    while (sone_ack != 'right') or (stwo_ack != 'right'):
-        resp1 = sone.kb.getKeys(clear=False)
-        resp2 = stwo.kb.getKeys(clear=False)
+    return waitforall([sone.kb, stwo.kb], [rightkeys(sone), rightkeys(stwo)], timeout=timeout, expkb=expkb)
 
-        if resp1:
-            for r in resp1:
-                if sone_ack != 'right': sone_ack = sone.buttons[ r.name ]
-        if resp2:
-            for r in resp2:
-                if stwo_ack != 'right': stwo_ack = stwo.buttons[ r.name ]
-    sone.kb.clearEvents(eventType="keyboard")
-    stwo.kb.clearEvents(eventType="keyboard")
+def rightkeys (s):
+    return [key for key, button in s.buttons.items() if button == 'right']
 
 def getexperimenterack ():
     '''
@@ -419,66 +318,42 @@ def getexperimenterack ():
         window.close()
         core.quit()
 
-def genactingstates (trials):
-    '''
-        Randomly generate list including the subject states (act/ observe)
-    '''
-    return np.random.choice(a=[True, False], size=trials)
-
-
-def genmovingstates (trials):
-    '''
-        Generates list that contains the movement direction of the moving
-        dot patch (left/ right)
-    '''
-    movingstates = ['left'] * (trials//2) + ['right'] * (trials//2)
-    return rn.sample(movingstates, len(movingstates))
-
 def sound_familiarisation():
 
     your_beep = "When you hear this, it's your turn to respond."
     partner_beep = "When you hear this, your partner will respond."
+
+    # the texts are the same on every frame, so fetch them once
+    sone_turn = [stimuli.getText(window, your_beep, [0 + sone.xoffset, 0], color='green'),
+                 stimuli.getText(window, partner_beep, [0 + stwo.xoffset, 0], color='red')]
+    stwo_turn = [stimuli.getText(window, your_beep, [0 + stwo.xoffset, 0], color='green'),
+                 stimuli.getText(window, partner_beep, [0 + sone.xoffset, 0], color='red')]
+
     for _ in range(5):
 
         for frame in secondstoframes(1):
-            visual.TextStim(window,
-                    text=your_beep, pos=[0 + sone.xoffset, 0],
-                    color='green', height=20).draw()
-            visual.TextStim(window,
-                        text=partner_beep, pos=[0 + stwo.xoffset, 0],
-                        color='red', height=20).draw()
+            for text in sone_turn:
+                text.draw()
             window.flip()
         nextflip = window.getFutureFlipTime(clock='ptb')
         sone.beep.play(when=nextflip)
 
         for frame in secondstoframes(3):
-            visual.TextStim(window,
-                    text=your_beep, pos=[0 + sone.xoffset, 0],
-                    color='green', height=20).draw()
-            visual.TextStim(window,
-                        text=partner_beep, pos=[0 + stwo.xoffset, 0],
-                        color='red', height=20).draw()
+            for text in sone_turn:
+                text.draw()
             window.flip()
 
         for frame in secondstoframes(1):
-            visual.TextStim(window,
-                    text=your_beep, pos=[0 + stwo.xoffset, 0],
-                    color='green', height=20).draw()
-            visual.TextStim(window,
-                        text=partner_beep, pos=[0 + sone.xoffset, 0],
-                        color='red', height=20).draw()
+            for text in stwo_turn:
+                text.draw()
             window.flip()
         sone.beep.stop()
         nextflip = window.getFutureFlipTime(clock='ptb')
         stwo.beep.play(when=nextflip)
 
         for frame in secondstoframes(3):
-            visual.TextStim(window,
-                    text=your_beep, pos=[0 + stwo.xoffset, 0],
-                    color='green', height=20).draw()
-            visual.TextStim(window,
-                        text=partner_beep, pos=[0 + sone.xoffset, 0],
-                        color='red', height=20).draw()
+            for text in stwo_turn:
+                text.draw()
             window.flip()
         stwo.beep.stop()
 
@@ -488,7 +363,11 @@ _thisDir = os.path.dirname(os.path.abspath(__file__))
 expName = 'DDM'
 filename = _thisDir + os.sep + u'data/%s_pair%s_%s' % (expName, expinfo['pair'], data.getDateStr())
 
-exphandler = data.ExperimentHandler(name=expName, extraInfo=expinfo, saveWideText=True, dataFileName=filename)
+exphandler = data.ExperimentHandler(name=expName, extraInfo=expinfo, saveWideText=False, dataFileName=filename)
+
+# the rows are written to filename.csv as soon as each trial is finished
+writer = trialwriter(exphandler, filename + '.csv')
+schedule.save(schedule.scheduleFile(filename), sessionSchedule)
 
 
 
@@ -509,99 +388,22 @@ window.flip()
 getacknowledgements()
 
 
-iterstates = iter(genactingstates(nPracticeTrials))
-movingstates = iter(genmovingstates(nPracticeTrials))
 nCorrect = 0
 
-for trialNumber in range(0, nPracticeTrials):
-
-    # subject state update
-    updatestate()
-    flag = "NA"
-
-    # whose turn it is defines which beep is played
-    beep = sone.beep if sone.state == 1 else stwo.beep
-
-    # pretrial interval: display light blue fixation cross & stationary dots for 1 - 2 s (uniformly distributed)
-    if trialNumber == 0:
-        for frame in secondstoframes(np.random.uniform(1, 2)):
-            genpretrialint(0)
-            window.flip()
-    else:
-        for frame in secondstoframes(np.random.uniform(1, 2)):
-            genpretrialint(stationaryChoice)
-            window.flip()
-
-    sone.kb.clearEvents(eventType='keyboard')
-    stwo.kb.clearEvents(eventType='keyboard')
-
-    sone.kb.clock.reset()
-    stwo.kb.clock.reset()
+# pretrial, decision and feedback interval of every trial, see trialloop.py
+trials = dyadictrials(window, renderer, timer, subjects, config.frames(100),
+                      config.settings['slowResponse'], config.settings['fastResponse'])
 
-    # preparing time for next window flip, to precisely co-ordinate window flip and beep
-    nextflip = window.getFutureFlipTime(clock='ptb')
-    beep.play(when=nextflip)
-
-    # make random choice for stationary dot patches that should be used
-    dotpatchChoice = np.random.randint(0, N)
-    movingDirection = next(movingstates)
-
-    # decision interval: light blue cross & moving dots
-    response = []  # we have no response yet
-    if movingDirection == 'right':
-        stimOne = sone.movingrightdotslist[dotpatchChoice]
-        stimTwo = stwo.movingrightdotslist[dotpatchChoice]
-    else:
-        stimOne = sone.movingleftdotslist[dotpatchChoice]
-        stimTwo = stwo.movingleftdotslist[dotpatchChoice]
-
-    for frame in secondstoframes(100):
-        if frame % 3 == 0:
-            gendecisionint(subjects, 'practice', stimOne[0], stimTwo[0])
-        elif frame % 3 == 1:
-            gendecisionint(subjects, 'practice', stimOne[1], stimTwo[1])
-        elif frame % 3 == 2:
-            gendecisionint(subjects, 'practice', stimOne[2], stimTwo[2])
-        else:
-            print('error in secondstoframes gendecisionint')
-        window.flip()
+for trial in schedule.practice(sessionSchedule):
+    response = trials.run(trial)
+    if response and response[0] == str(trial['direction']):  # correct response
+        nCorrect += 1
 
-        # fetch button press
-        if not response:
-            response = fetchbuttonpress(subjects)
-        else:
-            break
-
-    # need to explicity call stop() to go back to the beginning of the track
-    beep.stop()
-
-    # feedback interval (0.7s): color of fixation cross depends on response
-
-    if not response:
-        color = "green"
-    elif response[0] == "left":  # left
-        color = "yellow"
-    elif response[0] == "right":  # right
-        color = "blue"
-
-    if response:
-        if response[0] == movingDirection:  # correct response
-            nCorrect += 1
-        if response[1] > 1.5:
-            flag = "slow"
-        elif response[1] < 0.1:
-            flag = "fast"
-
-    # make random choice for stationary dot patch that should be used
-    stationaryChoice = np.random.randint(0, N)
-
-    # feedback interval: display the fixation cross color based on the correctness of response & stationary dots for 0.7s
-    for frame in secondstoframes(1):
-        genfeedbackint(color, stationaryChoice, flag)
-        window.flip()
+    timer.summary()
 
 # Print correctness on the terminal for Practice Trials
 print("{0:*>31s} {1:<5.2%}".format('Practice Trials Correct: ',nCorrect/nPracticeTrials))
+print(timer.report())
 
 
 
@@ -620,104 +422,20 @@ window.flip()
 getacknowledgements()
 
 # start main experiment
-for blockNumber in blocks:
-
-    # make an iterator object
-    iterstates = iter(genactingstates(ntrials))
-    movingstates = iter(genmovingstates(ntrials))
+for blockNumber, blockSchedule in zip(blocks, schedule.blocks(sessionSchedule)):
 
     # traverse through trials
-    for trialNumber in range(0, ntrials):
-
-        # subject state update
-        updatestate()
-        flag = "NA"
+    for trial in blockSchedule:
+        trialNumber = int(trial['trial'])
 
-        # whose turn it is defines which beep is played
-        beep = sone.beep if sone.state == 1 else stwo.beep
-
-        # make random choice for moving dot patches that should be used and determine the direction
-        dotpatchChoice = np.random.randint(0, N)
-        movingDirection = next(movingstates)
+        # pretrial, decision and feedback interval
+        response = trials.run(trial)
 
         # save trial data to file
         exphandler.addData('block', blockNumber)
         exphandler.addData('trial', trialNumber)
         exphandler.addData('s1_state', sone.state)
-        exphandler.addData('direction', movingDirection)
-
-        # pretrial interval: display green fixation cross & stationary dots for 1 - 2 s (uniformly distributed)
-        if trialNumber == 0:
-            for frame in secondstoframes( np.random.uniform(1, 2) ):
-                genpretrialint(0)
-                window.flip()
-        else:
-            for frame in secondstoframes( np.random.uniform(1, 2) ):
-                genpretrialint(stationaryChoice)
-                window.flip()
-
-        sone.kb.clearEvents(eventType='keyboard')
-        stwo.kb.clearEvents(eventType='keyboard')
-
-        sone.kb.clock.reset()
-        stwo.kb.clock.reset()
-
-        # preparing time for next window flip, to precisely co-ordinate window flip and beep
-        nextflip = window.getFutureFlipTime(clock='ptb')
-        beep.play(when=nextflip)
-
-        # decision interval: light blue cross & moving dots
-        response = []  # we have no response yet
-
-        if movingDirection == 'right':
-            stimOne = sone.movingrightdotslist[dotpatchChoice]
-            stimTwo = stwo.movingrightdotslist[dotpatchChoice]
-        else:
-            stimOne = sone.movingleftdotslist[dotpatchChoice]
-            stimTwo = stwo.movingleftdotslist[dotpatchChoice]
-
-        for frame in secondstoframes(100):
-            if frame % 3 == 0:
-                gendecisionint(subjects, 'main', stimOne[0], stimTwo[0])
-            elif frame % 3 == 1:
-                gendecisionint(subjects, 'main', stimOne[1], stimTwo[1])
-            elif frame % 3 == 2:
-                gendecisionint(subjects, 'main', stimOne[2], stimTwo[2])
-            else:
-                print('error in secondstoframes gendecisionint')
-            window.flip()
-
-            # fetch button press
-            if not response:
-                response = fetchbuttonpress(subjects)
-            else:
-                break
-
-        # need to explicity call stop() to go back to the beginning of the track
-        beep.stop()
-
-        # feedback interval (0.7s): color of fixation cross depends on response
-
-        if not response:
-            color = "green"
-        elif response[0] == "left":  # left
-            color = "yellow"
-        elif response[0] == "right":  # right
-            color = "blue"
-
-        if response:
-            if response[1] > 1.5:
-                flag = "slow"
-            elif response[1] < 0.1:
-                flag = "fast"
-
-        # make random choice for stationary dot patch that should be used
-        stationaryChoice = np.random.randint(0, N)
-
-        # feedback interval: display the fixation cross color based on the correctness of response & stationary dots for 0.7s
-        for frame in secondstoframes(0.7):
-            genfeedbackint(color, stationaryChoice, flag)
-            window.flip()
+        exphandler.addData('direction', str(trial['direction']))
 
         # save response to file
         if not response:
@@ -727,6 +445,10 @@ for blockNumber in blocks:
             exphandler.addData('response', response[0])
             exphandler.addData('rt', response[1])
 
+        # frame timing of pretrial, decision and feedback interval
+        for key, value in timer.summary().items():
+            exphandler.addData(key, value)
+
         # move to next row in output file
         exphandler.nextEntry()
 
@@ -745,6 +467,7 @@ for blockNumber in blocks:
 
 genendscreen()
 window.flip()
+print(timer.report())
 core.wait(5)
 
 
@@ -0,0 +1,74 @@
+'''
+    Frame timing of the trial loops
+
+    frametimer.flip() replaces window.flip() inside a trial: it stores the
+    flip timestamps in a preallocated ring buffer, so nothing is allocated
+    in the frame loop, and summary() reports per trial how many frames were
+    shown, how many refreshes were missed and the longest frame interval.
+'''
+
+import numpy as np
+from psychopy import core
+
+import stimuli_random_dots as stimuli
+
+
+class frametimer:
+    def __init__(self, window, refreshRate=stimuli.REFRESH_RATE, size=8192, tolerance=1.5):
+        '''
+            size is the number of flips kept (more than the longest trial)
+            an interval longer than tolerance frame periods counts as dropped
+        '''
+        self.window = window
+        self.period = 1.0 / refreshRate
+        self.tolerance = tolerance
+        self.times = np.zeros(size)
+        self.size = size
+        self.n = 0 # flips since the timer was created
+        self.trialstart = 0
+        self.totalframes = 0
+        self.totaldropped = 0
+
+    def start (self):
+        '''
+            begin a new trial
+        '''
+        self.trialstart = self.n
+
+    def flip (self):
+        t = self.window.flip()
+        if t is None: # window does not wait for the blank
+            t = core.getTime()
+        self.times[self.n % self.size] = t
+        self.n += 1
+        return t
+
+    def intervals (self):
+        '''
+            the frame intervals of the current trial (at most size - 1)
+        '''
+        first = max(self.trialstart, self.n - self.size)
+        idx = np.arange(first, self.n) % self.size
+        return np.diff(self.times[idx])
+
+    def summary (self):
+        '''
+            n_frames, n_dropped and max_interval (s) of the current trial,
+            call once at the end of each trial (adds to the session totals)
+        '''
+        intervals = self.intervals()
+        late = intervals[intervals > self.tolerance * self.period]
+        dropped = int(np.sum(np.rint(late / self.period) - 1))
+
+        n_frames = self.n - self.trialstart
+        self.totalframes += n_frames
+        self.totaldropped += dropped
+
+        return {
+            'n_frames': n_frames,
+            'n_dropped': dropped,
+            'max_interval': float(intervals.max()) if len(intervals) else 0.0
+        }
+
+    def report (self):
+        return "{0:*>31s} {1} of {2} frames".format('Dropped frames: ', self.totaldropped, self.totalframes)
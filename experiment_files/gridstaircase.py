@@ -0,0 +1,225 @@
+'''
+    Bayesian adaptive staircase on a grid (QUEST / QUEST+ style)
+
+    Drop-in replacement for the parts of psychopy's QuestHandler used by the
+    titration: iterate over it to get the coherences, addResponse() after
+    every answer, mean() and quantile() for the estimate. The posterior over
+    (threshold, slope) lives on a fixed grid and the probability of a correct
+    answer for every (coherence, threshold, slope) is tabulated once, so an
+    update is a single multiplication of the posterior with one row of the
+    table. The candidate coherences are the threshold grid.
+
+    Like QuestHandler the procedure works in log10 coherence: the threshold
+    grid is evenly spaced in log10 coherence between minVal and maxVal and
+    the prior is a gaussian in log10 coherence, startValSd is in log10
+    units. The psychometric function is QUEST's, a Weibull with slope beta
+    (3.5 by default) in log10 coherence, which is the same as a Weibull of
+    the coherence itself. The threshold is the coherence at which the
+    probability of a correct answer is pThreshold (82 % by default), and
+    intensities, mean(), sd() and quantile() are coherences. log=False
+    gives the grid and prior of earlier versions, linear in coherence;
+    states saved by those versions are continued with it.
+
+    Choosing the next coherence is kept separate from the update: call
+    calculateNextIntensity() while the feedback is on screen. With
+    method='entropy' the coherence that minimises the expected posterior
+    entropy is chosen (QUEST+), which is the sensible choice when the slope
+    is estimated as well.
+
+    state() returns everything needed to continue the staircase, fromstate()
+    builds it again, e.g. from the subject json of an earlier titration.
+'''
+
+import numpy as np
+
+
+class gridstaircase:
+    def __init__(self, startVal, startValSd, nTrials, minVal, maxVal, pThreshold=0.82, gamma=0.5, delta=0.01,
+                 slopes=(3.5,), grain=200, method='quantile', posterior=None, log=True):
+        '''
+            threshold is the coherence at which the probability of a correct
+            answer is pThreshold; gamma is the guess rate and delta the lapse
+            rate of the Weibull. The prior is a gaussian with mean startVal and
+            sd startValSd (in log10 coherence with log), as in QuestHandler.
+            Several slopes make it a two-parameter procedure.
+        '''
+        self.startVal = startVal
+        self.startValSd = startValSd
+        self.nTrials = nTrials
+        self.minVal = minVal
+        self.maxVal = maxVal
+        self.pThreshold = pThreshold
+        self.gamma = gamma
+        self.delta = delta
+        self.slopes = np.asarray(slopes, dtype=float)
+        self.grain = grain
+        self.method = method
+        self.log = log
+
+        if log and minVal <= 0:
+            raise ValueError("minVal has to be positive for a grid in log10 coherence, not %s" % minVal)
+        # the grid in the units of the prior, log10 coherence or coherence
+        scale = np.log10 if log else (lambda x: x)
+        self.grid = np.linspace(scale(minVal), scale(maxVal), grain)
+        self.thresholds = 10 ** self.grid if log else self.grid
+        # probability of a correct answer for (coherence, threshold, slope)
+        self.table = self.likelihood(self.thresholds[:, None, None])
+
+        if posterior is None:
+            prior = np.exp(-0.5 * ((self.grid - scale(startVal)) / startValSd) ** 2)
+            posterior = np.repeat(prior[:, None], len(self.slopes), axis=1)
+        self.posterior = np.asarray(posterior, dtype=float).reshape(grain, len(self.slopes))
+        self.posterior /= self.posterior.sum()
+
+        self.intensities = []
+        self.data = []
+        self.thisTrialN = -1
+        self.finished = False
+        self.calculateNextIntensity()
+
+    def __iter__ (self):
+        return self
+
+    def __next__ (self):
+        if self.thisTrialN + 1 >= self.nTrials:
+            self.finished = True
+            raise StopIteration
+
+        self.thisTrialN += 1
+        return self.intensity
+
+    def likelihood (self, x):
+        '''
+            probability of a correct answer at coherence x for every grid point;
+            (x / alpha) ** slope is QUEST's 10 ** (slope * (log10 x - log10 alpha))
+        '''
+        q = (self.pThreshold - self.gamma) / (1 - self.gamma - self.delta)
+        # Weibull scale such that p(threshold) = pThreshold
+        alpha = self.thresholds[:, None] / (-np.log(1 - q)) ** (1 / self.slopes)
+        return self.gamma + (1 - self.gamma - self.delta) * (1 - np.exp(-(x / alpha) ** self.slopes))
+
+    def row (self, intensity):
+        i = np.searchsorted(self.thresholds, intensity)
+        if i < self.grain and self.thresholds[i] == intensity:
+            return self.table[i]
+        return self.likelihood(intensity)
+
+    def addResponse (self, result, intensity=None):
+        '''
+            update the posterior with one answer (1 correct, 0 incorrect)
+        '''
+        intensity = self.intensity if intensity is None else intensity
+        p = self.row(intensity)
+
+        self.posterior *= p if result else 1 - p
+        self.posterior /= self.posterior.sum()
+
+        self.intensities.append(float(intensity))
+        self.data.append(int(result))
+
+    def calculateNextIntensity (self):
+        '''
+            choose the coherence of the next trial
+        '''
+        if self.method == 'quantile':
+            self.intensity = self.quantile(0.5)
+        elif self.method == 'mean':
+            self.intensity = self.mean()
+        elif self.method == 'mode':
+            self.intensity = self.mode()
+        elif self.method == 'entropy':
+            self.intensity = float(self.thresholds[self.expectedEntropy().argmin()])
+        else:
+            raise ValueError("method has to be quantile, mean, mode or entropy, not %s" % self.method)
+
+        self.intensity = float(min(max(self.intensity, self.minVal), self.maxVal))
+        return self.intensity
+
+    def expectedEntropy (self):
+        '''
+            expected entropy of the posterior after a trial at each coherence
+        '''
+        correct = self.posterior * self.table
+        wrong = self.posterior * (1 - self.table)
+        pcorrect = correct.sum(axis=(1, 2))
+
+        def entropy(joint, marginal):
+            post = joint / marginal[:, None, None]
+            return -(post * np.log(np.where(post > 0, post, 1))).sum(axis=(1, 2))
+
+        return pcorrect * entropy(correct, pcorrect) + (1 - pcorrect) * entropy(wrong, 1 - pcorrect)
+
+    def marginal (self):
+        '''
+            posterior of the threshold alone
+        '''
+        return self.posterior.sum(axis=1)
+
+    def mean (self):
+        return float((self.thresholds * self.marginal()).sum())
+
+    def sd (self):
+        marginal = self.marginal()
+        mean = (self.thresholds * marginal).sum()
+        return float(np.sqrt(((self.thresholds - mean) ** 2 * marginal).sum()))
+
+    def edgemass (self, fraction=0.02):
+        '''
+            the larger posterior mass of the lowest and of the highest
+            fraction of the grid; much of it means the threshold lies at or
+            beyond an end of [minVal, maxVal]
+        '''
+        marginal = self.marginal()
+        n = max(1, int(round(fraction * self.grain)))
+        return float(max(marginal[:n].sum(), marginal[-n:].sum()))
+
+    def mode (self):
+        return float(self.thresholds[self.marginal().argmax()])
+
+    def quantile (self, p=0.5):
+        cdf = np.cumsum(self.marginal())
+        return float(self.thresholds[min(np.searchsorted(cdf, p), self.grain - 1)])
+
+    def slope (self):
+        '''
+            posterior mean of the slope
+        '''
+        return float((self.slopes * self.posterior.sum(axis=0)).sum())
+
+    def state (self):
+        '''
+            json-serialisable state to continue the staircase later
+        '''
+        return {
+            'startVal': self.startVal,
+            'startValSd': self.startValSd,
+            'nTrials': self.nTrials,
+            'minVal': self.minVal,
+            'maxVal': self.maxVal,
+            'pThreshold': self.pThreshold,
+            'gamma': self.gamma,
+            'delta': self.delta,
+            'slopes': self.slopes.tolist(),
+            'grain': self.grain,
+            'method': self.method,
+            'log': self.log,
+            'posterior': self.posterior.tolist(),
+            'intensities': self.intensities,
+            'data': self.data
+        }
+
+
+def fromstate (state, nTrials=None):
+    '''
+        continue a staircase from its state(), optionally for nTrials more trials
+    '''
+    settings = {key: value for key, value in state.items() if key not in ('intensities', 'data')}
+    # states of earlier versions have a linear grid
+    settings.setdefault('log', False)
+    if nTrials is not None:
+        settings['nTrials'] = nTrials
+
+    staircase = gridstaircase(**settings)
+    staircase.intensities = list(state['intensities'])
+    staircase.data = list(state['data'])
+    return staircase
@@ -1,15 +1,27 @@
-blocks = range(2)
-ntrials = 50 # trials per block
-threshold= 0.21597
-
-
 import os
 import sys
+import config
+config.init(sys.argv)
+from startup import getchamber
+
+# check the settings (config.init above) and the chamber before the
+# heavy imports and the window, so a mistake fails right away
+chamber_id = getchamber()
+keys = [config.keymap(chamber_id)['left'], config.keymap(chamber_id)['right']] # 2 and 7 are green buttons (21.09.2021)
+
+blocks = range(config.settings['onePersonBlocks'])
+ntrials = config.settings['onePersonTrials'] # trials per block
+threshold= 0.21597
+
 from subprocess import run
 import numpy as np
 import psychtoolbox as ptb
 from psychopy import visual, event, core, gui, data, prefs, monitors
 import stimuli_random_dots as stimuli
+from frametiming import frametimer
+from trialwriter import trialwriter
+from responses import waitforall
+from psychopy.hardware import keyboard
 from random import choice, shuffle, sample
 import json
 import pandas as pd
@@ -24,34 +36,30 @@ Copy the `name` attribute of your device to the audioDevice
 prefs.hardware['audioLib'] = ['PTB']
 
 from psychopy import sound
-sound.setDevice('USB Audio Device: - (hw:3,0)')
+sound.setDevice(config.settings['audioDevice'])
 
 from psychopy.sound import Sound
 from numpy.random import random
 
-# get pair id via command-line argument
-try:
-    chamber_id = int(sys.argv[1])
-except:
-    print('Please enter a number as chamber id as command-line argument!')
-    chamber_id = input()
-
-
-keys = ["1", "2"] if chamber_id == 1 else ["8", "7"] # 2 and 7 are green buttons (21.09.2021)
-
 # monitor specs global variables
 M_WIDTH = stimuli.M_WIDTH
 M_HEIGHT = stimuli.M_HEIGHT
 REFRESH_RATE = stimuli.REFRESH_RATE
 N = stimuli.N
 
-myMon = monitors.Monitor('DellU2412M', width=M_WIDTH, distance=60)
+myMon = monitors.Monitor('DellU2412M', width=M_WIDTH, distance=stimuli.distance)
 myMon.setSizePix([M_WIDTH, M_HEIGHT])
 
 
 window = visual.Window(size=(M_WIDTH, M_HEIGHT), color="black", monitor=myMon, units='pix', fullscr=False, allowGUI=False, pos=(0,0))
 window.mouseVisible = False # hide cursor
 
+# flip timestamps of the trial loops, for the dropped frame columns
+timer = frametimer(window, REFRESH_RATE)
+
+# keyboard for the continue screens, waited on without spinning
+kb = keyboard.Keyboard()
+
 
 
 class subject:
@@ -78,7 +86,7 @@ class subject:
         self.threshold = threshold
 
 
-        keys = ["1", "2"] if sid == 1 else ["8", "7"]
+        keys = [config.keymap(sid)['left'], config.keymap(sid)['right']]
         self.buttons = {
                 keys[1] : "left",
                 keys[0] : "right",
@@ -111,13 +119,16 @@ class subject:
         # passing the response speed feedback to the stim object
         self.indicatordict = self.stimulus.indicatordict
 
-        self.beep = Sound('A', secs=0.5, volume=0.1)
+        self.beep = Sound(**config.beep('single'))
 
     def __repr__ (self):
         return str(self.id)
 
 sone = subject(chamber_id)
 subjects = [sone]
+
+# build the dot patches in the background while the start screen is shown
+sone.stimulus.prewarm(practice=False)
 responsetime = core.Clock()
 
 expinfo = {'chamber': chamber_id, 'threshold': sone.threshold}
@@ -125,7 +136,7 @@ expinfo = {'chamber': chamber_id, 'threshold': sone.threshold}
 
 
 def secondstoframes (seconds):
-    return range( int( np.rint(seconds * REFRESH_RATE) ) )
+    return range( config.frames(seconds) )
 
 
 def fetchbuttonpress (subjects, clock):
@@ -143,9 +154,7 @@ def gentext (instr):
     '''
         Generate text on both subject screens
     '''
-    visual.TextStim(window,
-                    text=instr, pos=[0, 0],
-                    color='white', height=20).draw()
+    stimuli.getText(window, instr, [0, 0]).draw()
 
 
 def genstartscreen ():
@@ -286,7 +295,10 @@ filename = _thisDir + os.sep + u'data/%s_pair%s_%s' % (expName, expinfo['chamber
 
 #triallist = [{"condition": "signal"}, {"condition": "noise"}] * (ntrials//2)
 
-exphandler = data.ExperimentHandler(name=expName, extraInfo=expinfo, saveWideText=True, dataFileName=filename)
+exphandler = data.ExperimentHandler(name=expName, extraInfo=expinfo, saveWideText=False, dataFileName=filename)
+
+# the rows are written to filename.csv as soon as each trial is finished
+writer = trialwriter(exphandler, filename + '.csv')
 
 ##### PRACTICE TRIALS  START #####
 
@@ -297,7 +309,7 @@ exphandler = data.ExperimentHandler(name=expName, extraInfo=expinfo, saveWideTex
 # display instructions for experiment
 genstartscreen() # display instructions
 window.flip()
-key = event.waitKeys(keyList=[keys[1]])
+waitforall([kb], [[keys[1]]])
 
 
 # start main experiment
@@ -311,6 +323,8 @@ for blockNumber in blocks:
     for trialNumber in range(0, ntrials):
 
 
+        timer.start()
+
         # whose turn it is defines which beep is played
         beep = sone.beep
 
@@ -327,11 +341,11 @@ for blockNumber in blocks:
         if trialNumber == 0:
             for frame in secondstoframes( np.random.uniform(1, 2) ):
                 genpretrialint(0)
-                window.flip()
+                timer.flip()
         else:
             for frame in secondstoframes( np.random.uniform(1, 2) ):
                 genpretrialint(stationaryChoice)
-                window.flip()
+                timer.flip()
 
 
         event.clearEvents()
@@ -359,7 +373,7 @@ for blockNumber in blocks:
                 gendecisionint(subjects, stimOne[2])
             else:
                 print('error in secondstoframes gendecisionint')
-            window.flip()
+            timer.flip()
 
             # fetch button press
             if response[0][0] is None:
@@ -390,7 +404,7 @@ for blockNumber in blocks:
         # feedback interval: display the fixation cross color based on the correctness of response & stationary dots for 0.7s
         for frame in secondstoframes(0.7):
             genfeedbackint(color, stationaryChoice)
-            window.flip()
+            timer.flip()
 
         # save response to file
         if not response:
@@ -400,6 +414,10 @@ for blockNumber in blocks:
             exphandler.addData('response', response[0][0])
             exphandler.addData('rt', response[0][1])
 
+        # frame timing of pretrial, decision and feedback interval
+        for key, value in timer.summary().items():
+            exphandler.addData(key, value)
+
         # move to next row in output file
         exphandler.nextEntry()
 
@@ -407,15 +425,16 @@ for blockNumber in blocks:
     if blockNumber % 2 == 0 and blockNumber != (blocks[-1]):
         genmandatorybreakscreen()
         window.flip()
-        event.waitKeys(keyList=[keys[1]])
+        waitforall([kb], [[keys[1]]])
     # otherwise, wait for the subjects to start their next block
     else:
         genbreakscreen()
         window.flip()
-        event.waitKeys(keyList=[keys[1]])
+        waitforall([kb], [[keys[1]]])
 
 genendscreen()
 window.flip()
+print(timer.report())
 core.wait(5)
 
 #code to calculate and show the performance metrics
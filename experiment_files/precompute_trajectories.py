@@ -0,0 +1,53 @@
+'''
+    Precompute the dot trajectories of a pair before the dyadic task
+
+    Run after both titrations are done, e.g.
+        python precompute_trajectories.py <pair_id>
+    The files are written to data/<pair_id>/trajectories and picked up by
+    dyadic_random_dots.py, which then plays the dots back instead of
+    simulating them on every frame. A snapshot of the initial state of all
+    other patches (the stationary dots) is written next to them, so the
+    experiment restores them instead of generating them at startup.
+'''
+
+import sys
+import time
+import config
+config.init(sys.argv)
+from startup import getpairid, loadthresholds
+import stimuli_random_dots as stimuli
+
+
+def precompute(pair_id, sid, coherence, seconds=None):
+    '''
+        write the trajectories of all moving dot patches of one subject,
+        with the same seed and coherences as used by dyadic_random_dots.py
+    '''
+    seed = stimuli.stimulusSeed(pair_id, sid)
+    pool = stimuli.createMovingPool(seed, stimuli.trajectoryDir(pair_id))
+
+    filenames = []
+    for c in [stimuli.practiceTrialCoherence, coherence]:
+        for direction in [0, 180]:
+            filenames.append(pool.precompute(direction, c, stimuli.N, seconds))
+
+    filenames.append(stimuli.writeSnapshot(stimuli.snapshotFile(pair_id, sid),
+                                           stimuli.createStationaryPool(seed), pool, coherence))
+
+    return filenames
+
+
+def main():
+    # the titration files are checked as by dyadic_random_dots.py, which
+    # would not use trajectories of a threshold it rejects
+    pair_id = getpairid()
+    thresholds = loadthresholds(pair_id, minVal=config.settings['minCoherence'], maxVal=config.settings['maxCoherence'])
+
+    for sid in [1, 2]:
+        starttime = time.time()
+        filenames = precompute(pair_id, sid, thresholds[sid])
+        print("chamber {}: {} trajectory and snapshot files in {:.1f} s".format(sid, len(filenames), time.time() - starttime))
+
+
+if __name__ == "__main__":
+    main()
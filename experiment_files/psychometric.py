@@ -0,0 +1,233 @@
+'''
+    Psychometric function fits on trial-level data
+
+    Maximum-likelihood fit of a Weibull psychometric function
+        p(x) = gamma + (1 - gamma - lapse) * (1 - exp(-(x/alpha)**beta))
+    to the raw responses (1 correct, 0 incorrect) of a titration, with the
+    same parametrisation as psychopy's data.FitWeibull (gamma is
+    expectedMin). Everything works on numpy arrays and many data sets (several
+    subjects, or bootstrap resamples of one subject) are fitted together: the
+    likelihood is evaluated on a log-spaced (alpha, beta) grid, which is then
+    refined around each maximum a few times. alpha and beta are bounded by
+    the grid, so a fit can never run away to a threshold like 545190.
+
+    Usage:
+        python psychometric.py [data directory]
+    refits every data/<pair>/data_chamber*.json of the constant stimuli
+    method and prints the thresholds with bootstrap confidence intervals.
+'''
+
+import sys
+import os
+import glob
+import json
+import threading
+import numpy as np
+
+
+# search range of the fit
+alphaRange = (1e-3, 10.0)
+betaRange = (0.2, 20.0)
+
+def weibull (x, alpha, beta, gamma=0.5, lapse=0.0):
+    '''
+        probability of a correct response at intensity x
+    '''
+    return gamma + (1 - gamma - lapse) * (1 - np.exp(-(x / alpha) ** beta))
+
+def inverse (p, alpha, beta, gamma=0.5, lapse=0.0):
+    '''
+        intensity at which the probability of a correct response is p
+    '''
+    q = (p - gamma) / (1 - gamma - lapse)
+    return alpha * (-np.log(1 - q)) ** (1 / beta)
+
+def counts (batch):
+    '''
+        number of trials and of correct responses per intensity level
+
+        batch is a list of (intensities, responses) pairs. Returns the
+        levels (union of all data sets) and two arrays of shape
+        (len(batch), len(levels)).
+    '''
+    batch = [(np.asarray(x, dtype=float), np.asarray(r, dtype=float)) for x, r in batch]
+    levels = np.unique(np.concatenate([x for x, _ in batch]))
+
+    n = np.zeros((len(batch), len(levels)))
+    k = np.zeros((len(batch), len(levels)))
+    for i, (x, r) in enumerate(batch):
+        idx = np.searchsorted(levels, x)
+        n[i] = np.bincount(idx, minlength=len(levels))
+        k[i] = np.bincount(idx, weights=r, minlength=len(levels))
+
+    return levels, n, k
+
+def fitmany (batch, gamma=0.5, lapse=0.0, pThreshold=0.75, grid=(60, 40), refine=4, zoom=11):
+    '''
+        fit all data sets of a batch at once
+
+        Returns a dict of arrays (one entry per data set) with alpha, beta,
+        the threshold at pThreshold and the log-likelihood of the fit.
+    '''
+    levels, n, k = counts(batch)
+    nsets = len(n)
+
+    # global grid, shared by all data sets
+    la = np.linspace(np.log(alphaRange[0]), np.log(alphaRange[1]), grid[0])
+    lb = np.linspace(np.log(betaRange[0]), np.log(betaRange[1]), grid[1])
+    p = weibull(levels, np.exp(la)[:, None, None], np.exp(lb)[None, :, None], gamma, lapse)
+    p = np.clip(p, 1e-12, 1 - 1e-12)
+    ll = np.einsum('sl,abl->sab', k, np.log(p)) + np.einsum('sl,abl->sab', n - k, np.log(1 - p))
+
+    best = ll.reshape(nsets, -1).argmax(axis=1)
+    besta, bestb = la[best // grid[1]], lb[best % grid[1]]
+    stepa, stepb = la[1] - la[0], lb[1] - lb[0]
+
+    # zoom in around the maximum of every data set
+    offsets = np.linspace(-1, 1, zoom)
+    for _ in range(refine):
+        ga = np.clip(besta[:, None] + stepa * offsets, la[0], la[-1])
+        gb = np.clip(bestb[:, None] + stepb * offsets, lb[0], lb[-1])
+        p = weibull(levels, np.exp(ga)[:, :, None, None], np.exp(gb)[:, None, :, None], gamma, lapse)
+        p = np.clip(p, 1e-12, 1 - 1e-12)
+        ll = (k[:, None, None, :] * np.log(p) + (n - k)[:, None, None, :] * np.log(1 - p)).sum(axis=-1)
+
+        best = ll.reshape(nsets, -1).argmax(axis=1)
+        rows = np.arange(nsets)
+        besta, bestb = ga[rows, best // zoom], gb[rows, best % zoom]
+        stepa, stepb = stepa * 2 / (zoom - 1), stepb * 2 / (zoom - 1)
+
+    alpha, beta = np.exp(besta), np.exp(bestb)
+    return {
+        'alpha': alpha,
+        'beta': beta,
+        'threshold': inverse(pThreshold, alpha, beta, gamma, lapse),
+        'loglik': ll.reshape(nsets, -1).max(axis=1)
+    }
+
+def fit (intensities, responses, **kwargs):
+    '''
+        fit a single data set, returns a dict of floats
+    '''
+    result = fitmany([(intensities, responses)], **kwargs)
+    return {key: float(value[0]) for key, value in result.items()}
+
+def resample (intensities, responses, nboot, rng):
+    '''
+        nboot bootstrap resamples of the trials
+    '''
+    intensities = np.asarray(intensities, dtype=float)
+    responses = np.asarray(responses, dtype=float)
+    idx = rng.randint(0, len(intensities), size=(nboot, len(intensities)))
+    return [(intensities[i], responses[i]) for i in idx]
+
+def bootstrap (intensities, responses, nboot=1000, ci=0.95, seed=None, **kwargs):
+    '''
+        confidence interval of the threshold from resampling the trials
+
+        All resamples are fitted together in one batch.
+    '''
+    rng = np.random.RandomState(seed)
+    thresholds = fitmany(resample(intensities, responses, nboot, rng), **kwargs)['threshold']
+    low, high = np.percentile(thresholds, [50 * (1 - ci), 50 * (1 + ci)])
+    return float(low), float(high)
+
+def plotfit (result, intensities, responses, filename, gamma=0.5, lapse=0.0, pThreshold=0.75):
+    '''
+        save a figure of the data and the fitted function
+
+        Uses the object-oriented matplotlib interface so it can run outside
+        the main thread.
+    '''
+    from matplotlib.figure import Figure
+
+    levels, n, k = counts([(intensities, responses)])
+    smooth = np.linspace(levels.min(), levels.max(), 100)
+
+    fig = Figure()
+    ax = fig.add_subplot(1, 1, 1)
+    ax.plot(smooth, weibull(smooth, result['alpha'], result['beta'], gamma, lapse), '-')
+    ax.axhline(pThreshold, linestyle='-', color='orange')
+    ax.axvline(result['threshold'], linestyle='-', color='orange')
+    ax.set_title('threshold = %0.3f' % result['threshold'])
+    ax.plot(levels, k[0] / n[0], 'o')
+    ax.set_ylim([0, 1])
+    fig.savefig(filename)
+
+def plotinbackground (result, intensities, responses, filename, **kwargs):
+    '''
+        plotfit in a separate thread, so saving the figure does not hold up
+        the experiment; the interpreter waits for it before exiting
+    '''
+    thread = threading.Thread(target=plotfit, args=(result, intensities, responses, filename), kwargs=kwargs)
+    thread.start()
+    return thread
+
+def loadtitrations (datadir='data'):
+    '''
+        intensities and responses of every constant stimuli titration,
+        keyed by (pair id, chamber)
+    '''
+    titrations = {}
+    for path in sorted(glob.glob(os.path.join(datadir, '*', 'data_chamber*.json'))):
+        with open(path, 'r') as f:
+            subjectData = json.load(f)
+
+        # QUEST titrations do not store the single responses
+        if not subjectData.get('responses'):
+            continue
+
+        # an interrupted or hand edited file can pair intensities and
+        # responses wrongly, do not fit it
+        if len(subjectData['threshold_list']) != len(subjectData['responses']):
+            print('skipping {}: {} intensities but {} responses'.format(
+                path, len(subjectData['threshold_list']), len(subjectData['responses'])))
+            continue
+
+        key = (str(subjectData['pair_id']), str(subjectData['chamber']))
+        titrations[key] = (subjectData['threshold_list'], subjectData['responses'])
+
+    return titrations
+
+def refitall (datadir='data', nboot=0, ci=0.95, seed=None, **kwargs):
+    '''
+        refit all titrations of a data directory in one batch
+
+        Returns a dict keyed by (pair id, chamber) with the fit and, if
+        nboot > 0, the bootstrap confidence interval of the threshold.
+    '''
+    titrations = loadtitrations(datadir)
+    keys = list(titrations)
+    if not keys:
+        return {}
+
+    fits = fitmany([titrations[key] for key in keys], **kwargs)
+    results = {}
+    for i, key in enumerate(keys):
+        results[key] = {name: float(value[i]) for name, value in fits.items()}
+
+    if nboot > 0:
+        # the resamples of all titrations form a single batch
+        rng = np.random.RandomState(seed)
+        batch = []
+        for key in keys:
+            batch += resample(*titrations[key], nboot, rng)
+        thresholds = fitmany(batch, **kwargs)['threshold'].reshape(len(keys), nboot)
+        low, high = np.percentile(thresholds, [50 * (1 - ci), 50 * (1 + ci)], axis=1)
+        for i, key in enumerate(keys):
+            results[key]['ci'] = (float(low[i]), float(high[i]))
+
+    return results
+
+
+def main():
+    datadir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(), 'data')
+    results = refitall(datadir, nboot=1000)
+
+    for (pair_id, chamber), result in results.items():
+        print('pair %s chamber %s: threshold %.4f (95%% CI %.4f - %.4f)'
+              % (pair_id, chamber, result['threshold'], result['ci'][0], result['ci'][1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+'''
+    Response collection from the button boxes
+
+    psychopy's Keyboard (psychtoolbox backend) timestamps key presses in its
+    own queue, so the rt of a key (key.rt, from key.tDown) does not depend
+    on when the queue is read. The responselistener reads that queue once
+    per frame, right after the flip, in the thread of the trial loop; the
+    loop can then end the decision interval with the next flip.
+
+    waitforall() waits for acknowledgements from several button boxes at
+    once without spinning, getKeyboards() finds the button box of each
+    chamber.
+'''
+
+import time
+from psychopy.hardware import keyboard
+
+
+class responselistener:
+    def __init__(self, kb, buttons):
+        '''
+            kb is the subject's psychopy keyboard, buttons the map of key
+            names to responses ("left"/"right")
+        '''
+        self.kb = kb
+        self.buttons = buttons
+        self.keyList = [k for k in buttons.keys() if k is not None]
+        self.response = []
+        self.listening = False
+
+    def start (self):
+        '''
+            start listening for the first response; the keyboard clock is
+            not touched, reset it before calling start() as before
+        '''
+        self.response = []
+        self.listening = True
+
+    def get (self):
+        '''
+            the response as [response, rt], or [] if there is none yet;
+            reads the keyboard queue once, call it once per frame
+        '''
+        if self.listening and not self.response:
+            keys = self.kb.getKeys(keyList=self.keyList, clear=True)
+            if keys:
+                # rt of the psychtoolbox timestamp, not of the frame it was read in
+                self.response = [self.buttons[keys[0].name], keys[0].rt]
+        return self.response
+
+    def stop (self):
+        self.listening = False
+
+
+def waitforall (keyboards, keyLists, timeout=None, expkb=None, expKeys=None, interval=0.005):
+    '''
+        Block until every keyboard has had one of the keys of its keyList
+        pressed (in any order), e.g. both subjects pressing "right".
+
+        The keyboards are read every `interval` seconds with a plain
+        time.sleep in between, so waiting costs next to no CPU. Pressing one
+        of expKeys (space by default) on the experimenter keyboard expkb ends
+        the wait for everyone.
+        Returns 'ack', 'override' or 'timeout'.
+    '''
+    pending = set(range(len(keyboards)))
+    deadline = None if timeout is None else time.monotonic() + timeout
+    expKeys = ("space",) if expKeys is None else expKeys
+
+    while True:
+        for i in list(pending):
+            if keyboards[i].getKeys(keyList=keyLists[i], clear=True):
+                pending.discard(i)
+
+        if not pending:
+            result = 'ack'
+            break
+
+        if expkb is not None and expkb.getKeys(keyList=expKeys, clear=True):
+            result = 'override'
+            break
+
+        if deadline is not None and time.monotonic() >= deadline:
+            result = 'timeout'
+            break
+
+        time.sleep(interval)
+
+    for kb in keyboards:
+        kb.clearEvents(eventType="keyboard")
+
+    return result
+
+
+def getKeyboards():
+    '''
+        Search for the appropriate button box in each of the chambers
+        Once a button has been pressed on each of the button boxes,
+            create a keyboard object for each subject button box and assign it to them
+    '''
+    keybs = keyboard.getKeyboards()
+    k = {"chone" : None, "chtwo" : None}
+
+    for keyb in keybs:
+        if keyb['product'] == "Black Box Toolkit Ltd. BBTK Response Box":
+            if k['chone'] != None:
+                k['chtwo'] = keyb['index']
+                return k
+
+            if k['chtwo'] != None:
+                k['chone'] = keyb['index']
+                return k
+
+            ktemp = keyboard.Keyboard(keyb['index'])
+            keypress = ktemp.waitKeys(keyList=["1", "2", "7", "8"])
+
+            if keypress[0].name in ["1", "2"]:
+                k['chone'] = keyb['index']
+            else:
+                k['chtwo'] = keyb['index']
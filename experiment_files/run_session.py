@@ -0,0 +1,80 @@
+'''
+    Runs the whole session of a pair in one process
+
+    The two-chamber titration (titration_dual.py) and the dyadic task
+    (dyadic_random_dots.py) are run one after the other with a single
+    window, audio device and pair of button boxes. The stimuli built for the
+    titration, with their dot pools, are reused by the dyadic task, and the
+    thresholds are passed on in memory; the data_chamber*.json files are
+    still written as a record.
+
+    Usage:
+        python run_session.py <pair id>
+'''
+
+import sys
+import os
+import runpy
+import config
+config.init(sys.argv)
+from startup import getpairid
+import stimuli_random_dots as stimuli
+import session
+
+
+def createWindow():
+    '''
+        the split window of the dyadic task, one half per chamber
+    '''
+    from psychopy import visual, monitors
+    M_WIDTH = stimuli.M_WIDTH * 2
+    M_HEIGHT = stimuli.M_HEIGHT
+
+    myMon = monitors.Monitor('DellU2412M', width=M_WIDTH, distance=stimuli.distance)
+    myMon.setSizePix([M_WIDTH, M_HEIGHT])
+
+    window = visual.Window(size=(M_WIDTH, M_HEIGHT), monitor=myMon,
+                           color="black", pos=(0,0), units='pix', blendMode='avg', # have to use 'avg' to avoid artefacts
+                           fullscr=False, allowGUI=False)
+    window.mouseVisible = False # hide cursor
+    return window
+
+def runpart(script):
+    runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), script), run_name='__main__')
+
+
+def main():
+    # check the settings (config.init above) and the pair id before psychopy
+    # is imported and the audio device, window and button boxes are set up;
+    # the titration files are written by the titration of this session
+    pair_id = getpairid()
+
+    from psychopy import prefs
+    from psychopy.hardware import keyboard
+    from responses import getKeyboards
+
+    # setting PTB as our preferred sound library and then import sound
+    prefs.hardware['audioLib'] = ['PTB']
+
+    from psychopy import sound
+    sound.setDevice(config.settings['audioDevice'])
+
+    window = createWindow()
+
+    keybs = getKeyboards()
+    keyboards = {1: keyboard.Keyboard( keybs["chone"] ), 2: keyboard.Keyboard( keybs["chtwo"] )}
+    session.current = session.session(pair_id, window, keyboards, keyboard.Keyboard())
+
+    runpart('titration_dual.py')
+
+    missing = [sid for sid in keyboards if sid not in session.current.thresholds]
+    if missing:
+        print('No accepted threshold for chamber ' + ' and '.join(str(sid) for sid in missing) + ', the session stops here.')
+        window.close()
+        return
+
+    runpart('dyadic_random_dots.py')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+'''
+    Trial schedule of a whole session
+
+    create() draws everything the trial loops of dyadic_random_dots.py used
+    to draw trial by trial: who acts, the direction of the dots, the moving
+    and stationary dot patches and the length of the pretrial interval (in
+    frames). It needs a single seed, so a session can be replayed exactly,
+    and the result is one structured array with a row per trial (the
+    practice trials have block -1), saved next to the data file.
+
+    Acting can be 'random' (every trial independently, as genactingstates
+    did) or 'balanced' (both subjects act in exactly half of the trials of
+    every block); maxrun limits how many trials in a row the same subject
+    acts (0 for no limit). The directions are balanced within every block.
+'''
+
+import numpy as np
+
+
+trialdtype = np.dtype([
+    ('block', np.int16),
+    ('trial', np.int16),
+    ('s1_state', np.bool_), # True if the subject in chamber 1 acts
+    ('direction', 'U5'), # 'left' or 'right'
+    ('movingPatch', np.int16),
+    ('pretrialPatch', np.int16),
+    ('feedbackPatch', np.int16),
+    ('pretrialFrames', np.int32),
+    ('feedbackFrames', np.int32)
+])
+
+def scheduleSeed (pair_id):
+    '''
+        session seed of the schedule; the stimuli use pair_id * 10 + chamber
+    '''
+    return int(pair_id) * 10
+
+def scheduleFile (filename):
+    return filename + '_schedule.npy'
+
+def actingstates (ntrials, rng, acting='random', maxrun=0, attempts=1000):
+    '''
+        whether the subject in chamber 1 acts, for every trial of a block
+    '''
+    if acting not in ('random', 'balanced'):
+        raise ValueError("acting has to be random or balanced, not %s" % acting)
+    if acting == 'balanced' and ntrials % 2:
+        raise ValueError("balanced acting needs an even number of trials, not %d" % ntrials)
+
+    for _ in range(attempts):
+        states = np.empty(ntrials, dtype=bool)
+        # trials left for subject 1 and 2 (balanced only)
+        left = [ntrials // 2, ntrials // 2]
+        run = 0
+
+        for t in range(ntrials):
+            p = left[0] / (left[0] + left[1]) if acting == 'balanced' else 0.5
+            state = rng.rand() < p
+            # the same subject has acted maxrun times in a row: switch
+            if maxrun and run == maxrun and state == states[t - 1]:
+                state = not state
+                if acting == 'balanced' and left[0 if state else 1] == 0:
+                    break
+
+            run = run + 1 if t > 0 and state == states[t - 1] else 1
+            states[t] = state
+            left[0 if state else 1] -= 1
+        else:
+            return states
+
+    raise ValueError("no acting order of %d trials with runs of at most %d found" % (ntrials, maxrun))
+
+def block (ntrials, npatches, rng, feedbackFrames, framesPerSecond, acting='random', maxrun=0, pretrial=(1, 2)):
+    '''
+        schedule of one block, with the block and trial columns left at 0
+    '''
+    trials = np.zeros(ntrials, dtype=trialdtype)
+    trials['trial'] = np.arange(ntrials)
+    trials['s1_state'] = actingstates(ntrials, rng, acting, maxrun)
+    trials['direction'] = rng.permutation(['left'] * (ntrials // 2) + ['right'] * (ntrials // 2))
+    trials['movingPatch'] = rng.randint(0, npatches, ntrials)
+    trials['feedbackPatch'] = rng.randint(0, npatches, ntrials)
+    # the pretrial interval shows the stationary dots of the last feedback,
+    # the first trial of a block the first patch
+    trials['pretrialPatch'][1:] = trials['feedbackPatch'][:-1]
+    trials['pretrialFrames'] = np.rint(rng.uniform(*pretrial, size=ntrials) * framesPerSecond)
+    trials['feedbackFrames'] = feedbackFrames
+    return trials
+
+def create (seed, nblocks, ntrials, npractice, npatches, framesPerSecond, acting='random', maxrun=0,
+           practiceFeedback=1, feedback=0.7):
+    '''
+        schedule of the practice trials and all blocks of a session
+    '''
+    rng = np.random.RandomState(seed)
+    parts = []
+
+    for b in range(-1, nblocks):
+        n, seconds = (npractice, practiceFeedback) if b < 0 else (ntrials, feedback)
+        trials = block(n, npatches, rng, int(np.rint(seconds * framesPerSecond)), framesPerSecond, acting, maxrun)
+        trials['block'] = b
+        parts.append(trials)
+
+    return np.concatenate(parts)
+
+def practice (schedule):
+    return schedule[schedule['block'] < 0]
+
+def blocks (schedule):
+    '''
+        the trials of every block of the main experiment, in order
+    '''
+    nblocks = schedule['block'].max() + 1
+    return [schedule[schedule['block'] == b] for b in range(nblocks)]
+
+def save (filename, schedule):
+    np.save(filename, schedule)
+
+def load (filename):
+    return np.load(filename)
@@ -0,0 +1,29 @@
+'''
+    Resources shared by the parts of a session
+
+    run_session.py runs the titration and the dyadic task one after the
+    other in the same process. It sets `current` to a session object before
+    running them; the scripts then take the window, the button boxes and the
+    stimuli from it instead of creating their own, and the titration hands
+    the thresholds over in memory. When a script is run on its own, `current`
+    is None and it sets everything up itself as before.
+'''
+
+current = None
+
+
+class session:
+    def __init__(self, pair_id, window, keyboards, expkb):
+        '''
+            keyboards maps the chamber number (1, 2) to the psychopy keyboard
+            of its button box, expkb is the experimenter keyboard
+        '''
+        self.pair_id = pair_id
+        self.window = window
+        self.keyboards = keyboards
+        self.expkb = expkb
+
+        # chamber number -> accepted titration threshold
+        self.thresholds = {}
+        # chamber number -> mainstim, built once and kept for the dyadic task
+        self.stimuli = {}
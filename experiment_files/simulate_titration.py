@@ -0,0 +1,193 @@
+'''
+    Offline simulation of the titration procedures
+
+    Runs the titration logic of titration_random_dots.py (grid staircase,
+    threshold = posterior mean) and of titration-cs.py (constant stimuli,
+    Weibull fit at 75% correct) against synthetic observers, so settings like
+    pThreshold, startValSd, minVal/maxVal, the number of trials or the
+    coherence set can be compared without running participants.
+
+    Observers answer with a Weibull or logistic psychometric function with
+    guess rate 0.5 and a random lapse rate; their thresholds and slopes are
+    drawn at random. Subjects are simulated in chunks in a process pool. For
+    every procedure the relative error of the threshold (estimate / true - 1)
+    is summarised as bias and sd, together with the number of trials after
+    which the running estimate stays within the tolerance of the true value,
+    and how many estimates fall outside [minVal, maxVal].
+
+    Usage:
+        python simulate_titration.py --subjects 2000 --observer weibull
+'''
+
+import argparse
+import multiprocessing
+import time
+import numpy as np
+
+import gridstaircase
+import psychometric
+
+
+def observer (kind, x, alpha, beta, lapse, gamma=0.5):
+    '''
+        probability that the observer answers correctly at coherence x
+    '''
+    if kind == 'weibull':
+        f = 1 - np.exp(-(x / alpha) ** beta)
+    elif kind == 'logistic':
+        f = 1 / (1 + np.exp(-beta * (x - alpha) / alpha))
+    else:
+        raise ValueError("observer has to be weibull or logistic, not %s" % kind)
+    return gamma + (1 - gamma - lapse) * f
+
+def trueThreshold (kind, p, alpha, beta, lapse, gamma=0.5):
+    '''
+        coherence at which the observer is correct with probability p
+    '''
+    q = (p - gamma) / (1 - gamma - lapse)
+    if kind == 'weibull':
+        return alpha * (-np.log(1 - q)) ** (1 / beta)
+    return alpha * (1 + np.log(q / (1 - q)) / beta)
+
+def observers (kind, n, lapse, rng):
+    '''
+        random observer parameters: threshold scale, slope and lapse rate
+    '''
+    alpha = np.exp(rng.uniform(np.log(0.05), np.log(0.5), n))
+    beta = rng.uniform(1.5, 4, n) if kind == 'weibull' else rng.uniform(2, 6, n)
+    lapses = rng.uniform(0, lapse, n)
+    return alpha, beta, lapses
+
+def convergence (estimates, truth, tolerance):
+    '''
+        first trial after which the running estimate stays within the
+        relative tolerance of the true threshold (number of trials + 1 if
+        it never does)
+    '''
+    outside = np.abs(estimates / truth[:, None] - 1) > tolerance
+    # index of the last trial outside the tolerance, -1 if there is none
+    last = np.where(outside.any(axis=1), outside.shape[1] - 1 - np.argmax(outside[:, ::-1], axis=1), -1)
+    return last + 2
+
+def quest (kind, alpha, beta, lapses, settings, rng):
+    '''
+        the titration of titration_random_dots.py, one subject after the other
+    '''
+    nsub = len(alpha)
+    estimates = np.empty((nsub, settings['trials']))
+
+    for s in range(nsub):
+        staircase = gridstaircase.gridstaircase(
+                                        startVal=0.5,
+                                        startValSd=settings['startValSd'],
+                                        pThreshold=settings['pThreshold'],
+                                        gamma=0.5,
+                                        delta=0.01,
+                                        nTrials=settings['trials'],
+                                        minVal=settings['minVal'],
+                                        maxVal=settings['maxVal'],
+                                        method=settings['method']
+                                        )
+        for t, coherence in enumerate(staircase):
+            correct = rng.rand() < observer(kind, coherence, alpha[s], beta[s], lapses[s])
+            staircase.addResponse(int(correct))
+            staircase.calculateNextIntensity()
+            estimates[s, t] = staircase.mean()
+
+    truth = trueThreshold(kind, settings['pThreshold'], alpha, beta, lapses)
+    return estimates, truth
+
+def constants (kind, alpha, beta, lapses, settings, rng, every=10):
+    '''
+        the titration of titration-cs.py; the running fit is computed every
+        `every` trials, for all subjects of the chunk in one batch
+    '''
+    nsub = len(alpha)
+    coherences = np.repeat(settings['coherences'], settings['repetitions'])
+    intensities = np.array([rng.permutation(coherences) for _ in range(nsub)])
+    p = observer(kind, intensities, alpha[:, None], beta[:, None], lapses[:, None])
+    responses = (rng.rand(*p.shape) < p).astype(int)
+
+    ntrials = intensities.shape[1]
+    checkpoints = list(range(every, ntrials, every)) + [ntrials]
+    batch = [(intensities[s, :t], responses[s, :t]) for t in checkpoints for s in range(nsub)]
+    fits = psychometric.fitmany(batch, gamma=0.5, pThreshold=0.75)['threshold'].reshape(len(checkpoints), nsub).T
+
+    # the estimate between two checkpoints is the one of the last checkpoint
+    estimates = np.repeat(fits, np.diff([0] + checkpoints), axis=1)
+    truth = trueThreshold(kind, 0.75, alpha, beta, lapses)
+    return estimates, truth
+
+procedures = {'quest': quest, 'constants': constants}
+
+def simulatechunk (args):
+    procedure, kind, nsub, lapse, settings, seed = args
+    rng = np.random.RandomState(seed)
+    alpha, beta, lapses = observers(kind, nsub, lapse, rng)
+    return procedures[procedure](kind, alpha, beta, lapses, settings, rng)
+
+def simulate (procedure, kind='weibull', nsub=1000, lapse=0.05, settings=None, seed=0, processes=None, chunksize=50):
+    '''
+        simulate nsub subjects in parallel and return the running estimates
+        (subjects x trials) and the true thresholds
+    '''
+    chunks = [(procedure, kind, min(chunksize, nsub - start), lapse, settings, seed * 100003 + i)
+              for i, start in enumerate(range(0, nsub, chunksize))]
+
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(simulatechunk, chunks)
+
+    estimates = np.concatenate([r[0] for r in results])
+    truth = np.concatenate([r[1] for r in results])
+    return estimates, truth
+
+def summary (estimates, truth, settings, tolerance=0.2):
+    final = estimates[:, -1]
+    error = final / truth - 1
+    trials = convergence(estimates, truth, tolerance)
+    ntrials = estimates.shape[1]
+
+    return {
+        'bias': float(error.mean()),
+        'sd': float(error.std()),
+        'rmse': float(np.sqrt((error ** 2).mean())),
+        'median_trials_to_convergence': float(np.median(trials)),
+        'not_converged': float((trials > ntrials).mean()),
+        'out_of_range': float(((final < settings['minVal']) | (final > settings['maxVal'])).mean())
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate the titration procedures with synthetic observers.')
+    parser.add_argument('--subjects', type=int, default=1000, help='simulated subjects per procedure')
+    parser.add_argument('--observer', default='weibull', choices=['weibull', 'logistic'])
+    parser.add_argument('--lapse', type=float, default=0.05, help='maximum lapse rate of the observers')
+    parser.add_argument('--procedures', nargs='+', default=['quest', 'constants'], choices=list(procedures))
+    parser.add_argument('--trials', type=int, default=80, help='trials of the staircase')
+    parser.add_argument('--pThreshold', type=float, default=0.82)
+    parser.add_argument('--startValSd', type=float, default=0.5, help='sd of the prior in log10 coherence')
+    parser.add_argument('--minVal', type=float, default=0.035)
+    parser.add_argument('--maxVal', type=float, default=0.8)
+    parser.add_argument('--method', default='quantile', choices=['quantile', 'mean', 'mode', 'entropy'])
+    parser.add_argument('--coherences', type=float, nargs='+', default=[0.05, 0.1, 0.2, 0.4, 0.8])
+    parser.add_argument('--repetitions', type=int, default=40)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative tolerance for convergence')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    settings = {key: getattr(args, key) for key in
+                ['trials', 'pThreshold', 'startValSd', 'minVal', 'maxVal', 'method', 'coherences', 'repetitions']}
+
+    for procedure in args.procedures:
+        start = time.perf_counter()
+        estimates, truth = simulate(procedure, args.observer, args.subjects, args.lapse, settings, args.seed, args.processes)
+        result = summary(estimates, truth, settings, args.tolerance)
+
+        print('%s (%d subjects, %d trials, %.1f s)' % (procedure, len(truth), estimates.shape[1], time.perf_counter() - start))
+        for key, value in result.items():
+            print('    %-30s %.3f' % (key, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+'''
+    Startup of the experiment scripts
+
+    The arguments and the titration files are checked before psychopy is
+    imported or a window is opened, so a wrong pair id or a broken titration
+    fails within a fraction of a second instead of after the full setup.
+    startuptimer records how long each phase of the startup takes.
+'''
+
+import os
+import sys
+import json
+import math
+import time
+
+
+class startuptimer:
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.phases = []
+
+    def mark (self, name):
+        '''
+            end the current phase and give it a name
+        '''
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report (self):
+        total = self.last - self.start
+        lines = ["startup: {:.2f} s".format(total)]
+        for name, seconds in self.phases:
+            lines.append("    {:<32s} {:7.3f} s  {:5.1%}".format(name, seconds, seconds / total if total else 0))
+        return "\n".join(lines)
+
+
+def getpairid ():
+    '''
+        pair id from the command line, asked for if it is missing or not a
+        number
+    '''
+    arg = sys.argv[1] if len(sys.argv) > 1 else ''
+    while not arg.isdigit():
+        print('Please enter a number as pair id as command-line argument!')
+        arg = input().strip()
+    return int(arg)
+
+def getchamber (chambers=(1, 2)):
+    '''
+        chamber number from the command line, asked for if it is missing or
+        not one of the chambers
+    '''
+    arg = sys.argv[1] if len(sys.argv) > 1 else None
+    while arg not in [str(c) for c in chambers]:
+        print('Please enter the chamber number ({}) as command-line argument!'.format(' or '.join(map(str, chambers))))
+        arg = input().strip()
+    return int(arg)
+
+def loadthresholds (pair_id, chambers=(1, 2), minVal=0.035, maxVal=0.8):
+    '''
+        the titration thresholds of the pair, per chamber; exits with a
+        message if a titration file is missing or its threshold is not
+        usable
+    '''
+    thresholds = {}
+    problems = []
+
+    for sid in chambers:
+        path = os.path.join('data', str(pair_id), 'data_chamber' + str(sid) + '.json')
+        try:
+            with open(path, 'r') as f:
+                threshold = json.load(f).get('threshold')
+        except FileNotFoundError:
+            problems.append("Titration file not found for subject in chamber {}".format(sid))
+            continue
+        except ValueError:
+            problems.append("Titration file of chamber {} is not valid json".format(sid))
+            continue
+
+        if not isinstance(threshold, (int, float)) or not math.isfinite(threshold) or not minVal <= threshold <= maxVal:
+            problems.append("Threshold {} of chamber {} is outside {} - {}".format(threshold, sid, minVal, maxVal))
+            continue
+
+        thresholds[sid] = threshold
+
+    if problems:
+        for problem in problems:
+            print(problem)
+        sys.exit(-1)
+
+    return thresholds
@@ -1,15 +1,25 @@
 from __future__ import division
 from __future__ import print_function
 
-from psychopy import visual, event, core
+import os
+import threading
+import weakref
+import zlib
+import numpy as np
+from collections import OrderedDict
 from random import choice
 from math import tan, pi, atan
+from config import settings, frames
 
-# monitor specs global variables
-M_WIDTH = 1920
-M_WIDTH_CM = 51.84
-M_HEIGHT = 1200
-REFRESH_RATE = 60
+# psychopy is imported where the first stimulus is created, so the scripts
+# can check their arguments before the slow import and the dot patches can
+# be precomputed without it
+
+# monitor specs global variables, see experiment.json
+M_WIDTH = settings['M_WIDTH']
+M_WIDTH_CM = settings['M_WIDTH_CM']
+M_HEIGHT = settings['M_HEIGHT']
+REFRESH_RATE = settings['REFRESH_RATE']
 
 def degrees_to_pix(degrees):
     cm = tan(degrees * pi / 180) * distance
@@ -17,13 +27,17 @@ def degrees_to_pix(degrees):
     return pix
 
 my_dpi = 96 # dpi of the lab monitor
-distance = 60 # distance to screen in cm
-N = 25 # number of prepared dot patches
+distance = settings['distance'] # distance to screen in cm
+N = settings['N'] # number of prepared dot patches
+
+ndots = settings['ndots']
+dotlife = max(1, frames(settings['dotlifetime'])) # in frames
+speed = degrees_to_pix(settings['dotspeed']) / REFRESH_RATE # pixels per frame
+practiceTrialCoherence = settings['practiceTrialCoherence']
+trajectorySeconds = settings['trajectorySeconds'] # seconds of motion per patch stored in the trajectory files
 
-ndots = 164
-dotlife = 5
-speed = degrees_to_pix(5) / REFRESH_RATE
-practiceTrialCoherence = 0.5
+# fixation colours: green during the trial, blue/yellow as response feedback
+fixationColors = {"green": "forestgreen", "blue": "deepskyblue", "yellow": "yellow"}
 
 def pix_to_degrees(pix):
     conversion_factor = M_WIDTH_CM / M_WIDTH
@@ -31,6 +45,7 @@ def pix_to_degrees(pix):
     return degrees
 
 def createDots (window, xoffset, dir, ndots, dotlife, speed, coherence):
+    from psychopy import visual
     return visual.DotStim(
         window,
         color=(1.0, 1.0, 1.0),
@@ -47,52 +62,737 @@ def createDots (window, xoffset, dir, ndots, dotlife, speed, coherence):
         coherence=coherence # coherence of practice trials
     )
 
-def createStationaryDots (N, window, xoffset, coherence):
+def newDotsXY (rng, shape, fieldSize):
     '''
-        creates N different patches of randomly distributed stationary dots
+        uniformly distributed dot positions inside a circular field of
+        diameter fieldSize, same sampling as DotStim._newDotsXY
     '''
-    dotsList = []
+    length = np.sqrt(rng.uniform(0, 1, shape))
+    angle = rng.uniform(0., 2 * pi, shape)
+    xy = np.empty(shape + (2,))
+    xy[..., 0] = length * np.cos(angle)
+    xy[..., 1] = length * np.sin(angle)
+    xy *= fieldSize * .5
+    return xy
 
-    for _ in range(N):
-        dotsList.append(createDots(window, xoffset, 0, ndots, -1, 0, coherence))
 
-    return dotsList
+def patchseed (seed, ndots, dir, coherence, patch, sub):
+    '''
+        seed of one sub-patch, derived from the session seed and the patch key
+    '''
+    key = '{}_{}_{}_{:.6f}_{}_{}'.format(seed, ndots, dir, coherence, patch, sub)
+    return zlib.crc32(key.encode())
 
-def createMovingDots (N, window, xoffset, dir, coherence):
+def stimulusSeed (pair_id, sid):
     '''
-        creates 3xN different patches of randomly distributed moving dots
-        3 patches are then used for the interleaving frames
+        session seed for the stimuli of the subject in chamber sid
     '''
-    dots = []
-    dotsList = []
+    return int(pair_id) * 10 + int(sid)
 
-    for _ in range(N):
-        for count in range(3):
-                dots.append(createDots(window, xoffset, dir, ndots//3, dotlife, speed, coherence))
+def trajectoryDir (pair_id):
+    return os.path.join('data', str(pair_id), 'trajectories')
 
-        dotsList.append(dots)
+def snapshotFile (pair_id, sid):
+    return os.path.join(trajectoryDir(pair_id), 'snapshot_chamber{}.npz'.format(sid))
 
-    return dotsList
+def trajectoryFile (directory, ndots, dotlife, speed, dir, coherence, fieldSize, seed):
+    name = 'dots_n{}_life{}_speed{:.4f}_dir{}_coh{:.6f}_field{:.2f}_seed{}.npy'.format(
+        ndots, dotlife, speed, dir, coherence, fieldSize, seed)
+    return os.path.join(directory, name)
 
 
-def createMovingDotsPractice (N, window, xoffset, dir, coherence):
+class lazyrng:
+    '''
+        a RandomState restored from a snapshot; creating a RandomState costs
+        more than restoring the dots themselves, so it is only created when
+        the patch first needs a random number
     '''
-        creates 3xN different patches of randomly distributed moving dots
+    def __init__(self, state):
+        self.state = state
+        self.rng = None
+
+    def __getattr__ (self, name):
+        if self.rng is None:
+            self.rng = np.random.RandomState()
+            self.rng.set_state(self.state)
+        return getattr(self.rng, name)
+
+
+class patchstate:
+    '''
+        positions, remaining lifetimes and motion directions of the dots of
+        one patch, as arrays of shape (interleaved, ndots)
+
+        The update rule is the one of DotStim with signalDots='same',
+        noiseDots='direction' and a circular field: the first
+        int(coherence * ndots) dots are signal dots moving in dir, every
+        other dot keeps a fixed random direction, a dot is replotted at a
+        random position when its life runs out or it leaves the aperture.
+        The interleaved sub-patches (one per rng) are shown on alternating
+        frames; each sub-patch draws from its own rng, so a seeded patch
+        moves the same way however the frames are split across trials.
+
+        arrays = (xy, life, dirs) restores a patch from a snapshot instead
+        of placing the dots anew.
+    '''
+    def __init__(self, rngs, ndots, dotlife, speed, dir, coherence, fieldSize, arrays=None):
+        self.rngs = rngs
+        self.dotlife = dotlife
+        self.speed = speed
+        self.fieldSize = fieldSize
+
+        if arrays is not None:
+            self.xy, self.life, self.dirs = arrays
+        else:
+            shape = (len(rngs), ndots)
+            self.xy = np.empty(shape + (2,))
+            self.life = np.empty(shape)
+            self.dirs = np.empty(shape)
+
+            for sub, rng in enumerate(rngs):
+                self.xy[sub] = newDotsXY(rng, (ndots,), fieldSize)
+                if dotlife > 0:
+                    self.life[sub] = abs(dotlife) * rng.rand(ndots)
+                else:
+                    self.life[sub] = abs(dotlife)
+                self.dirs[sub] = rng.rand(ndots) * 2 * pi
+
+            # signal dots are the same dots on every frame ('same'), noise dots
+            # keep their random direction for their whole life ('direction')
+            signal = np.zeros(ndots, dtype=bool)
+            signal[:int(coherence * ndots)] = True
+            self.dirs[:, signal] = dir * pi / 180
+
+        # stationary dots never change, so there is nothing to update
+        self.static = speed == 0 and dotlife <= 0
+
+    def update (self, sub=0):
+        '''
+            advance the dots of one sub-patch by one frame
+        '''
+        xy = self.xy[sub]
+        if self.static:
+            return xy
+
+        if self.dotlife > 0:
+            life = self.life[sub]
+            life -= 1
+            dead = life <= 0
+            life[dead] = self.dotlife
+        else:
+            dead = np.zeros(len(xy), dtype=bool)
+
+        dirs = self.dirs[sub]
+        xy[:, 0] += self.speed * np.cos(dirs)
+        xy[:, 1] += self.speed * np.sin(dirs)
+
+        # dots that left the aperture are replotted as well
+        dead |= np.hypot(xy[:, 0], xy[:, 1]) > self.fieldSize * .5
+
+        ndead = np.count_nonzero(dead)
+        if ndead:
+            xy[dead] = newDotsXY(self.rngs[sub], (ndead,), self.fieldSize)
+
+        return xy
+
+
+class trajectorystate:
+    '''
+        plays back the precomputed dot positions of one patch from a
+        memory-mapped array of shape (updates, interleaved, ndots, 2)
+
+        Each sub-patch keeps its own position in the recording. Once half of
+        the recording of a sub-patch has been shown, a background thread
+        rebuilds the patch from its seed and winds every sub-patch forward
+        to the end of the recording, so the draw loop can switch to the live
+        simulation without a pause when a sub-patch runs out. The recording
+        is float64 like the live simulation, so the dots continue exactly.
+    '''
+    def __init__(self, pool, key, trajectory):
+        self.pool = pool
+        self.key = key
+        self.trajectory = trajectory
+        self.count = [0] * trajectory.shape[1]
+        self.live = None
+        self.thread = None
+
+    def continuation (self):
+        live = self.pool.buildlive(*self.key)
+        for sub in range(len(self.count)):
+            for _ in range(len(self.trajectory)):
+                live.update(sub)
+        self.live = live
+
+    def prepare (self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.continuation, daemon=True)
+            self.thread.start()
+
+    def update (self, sub=0):
+        u = self.count[sub]
+        if u < len(self.trajectory):
+            self.count[sub] += 1
+            if 2 * u >= len(self.trajectory):
+                self.prepare()
+            return self.trajectory[u, sub]
+
+        if self.live is None:
+            # only waits if the recording is shorter than the wind-up
+            self.prepare()
+            self.thread.join()
+        return self.live.update(sub)
+
+
+class patchpool:
+    '''
+        lazily built dot patches keyed by (direction, coherence, patch index)
+
+        A patch is only created the first time it is requested. The pool
+        keeps the maxsize most recently used patches; older ones are dropped
+        and rebuilt if they are requested again. prewarm() builds patches in
+        a background thread, e.g. while the instruction screens are shown.
+        Building only touches numpy arrays, never OpenGL, so it is safe
+        outside the main thread.
+
+        Without a seed the dots come from the global numpy rng. With a seed
+        every patch is reproducible, and if a trajectory file written by
+        precompute() exists in the trajectories directory, the patch is
+        played back from it instead of being simulated frame by frame.
+    '''
+    def __init__(self, ndots, dotlife, speed, interleaved=1, maxsize=4*N, seed=None, trajectories=None):
+        self.ndots = ndots
+        self.dotlife = dotlife
+        self.speed = speed
+        self.interleaved = interleaved
+        self.maxsize = maxsize
+        self.seed = seed
+        self.trajectories = trajectories
+        self.fieldSize = degrees_to_pix(5)
+
+        self.patches = OrderedDict()
+        self.memmaps = {}
+        self.lock = threading.Lock()
+
+    def __len__ (self):
+        with self.lock:
+            return len(self.patches)
+
+    def __contains__ (self, key):
+        with self.lock:
+            return key in self.patches
+
+    def buildlive (self, dir, coherence, patch):
+        if self.seed is None:
+            rngs = [np.random] * self.interleaved
+        else:
+            rngs = [np.random.RandomState(patchseed(self.seed, self.ndots, dir, coherence, patch, sub))
+                    for sub in range(self.interleaved)]
+
+        return patchstate(rngs, self.ndots, self.dotlife, self.speed, dir, coherence, self.fieldSize)
+
+    def trajectoryFile (self, dir, coherence):
+        return trajectoryFile(self.trajectories, self.ndots, self.dotlife, self.speed,
+                              dir, coherence, self.fieldSize, self.seed)
+
+    def memmap (self, dir, coherence):
+        '''
+            the memory-mapped trajectories of all patches of one direction
+            and coherence, or None if they have not been precomputed
+        '''
+        if self.seed is None or self.trajectories is None:
+            return None
+
+        if (dir, coherence) not in self.memmaps:
+            filename = self.trajectoryFile(dir, coherence)
+            trajectories = np.load(filename, mmap_mode='r') if os.path.exists(filename) else None
+            # files of older versions stored float32, which the live simulation cannot continue exactly
+            if trajectories is not None and trajectories.dtype != np.float64:
+                trajectories = None
+            self.memmaps[(dir, coherence)] = trajectories
+
+        return self.memmaps[(dir, coherence)]
+
+    def build (self, dir, coherence, patch):
+        trajectories = self.memmap(dir, coherence)
+        if trajectories is not None and patch < len(trajectories):
+            return trajectorystate(self, (dir, coherence, patch), trajectories[patch])
+
+        return self.buildlive(dir, coherence, patch)
+
+    def precompute (self, dir, coherence, npatches=N, seconds=None):
+        '''
+            simulate the first `seconds` of every patch of one direction and
+            coherence and write the positions to the trajectory file
+        '''
+        if self.seed is None or self.trajectories is None:
+            raise ValueError("precomputing trajectories needs a seed and a trajectories directory")
+
+        seconds = trajectorySeconds if seconds is None else seconds
+        nupdates = int(np.ceil(seconds * REFRESH_RATE / self.interleaved))
+        shape = (npatches, nupdates, self.interleaved, self.ndots, 2)
+
+        os.makedirs(self.trajectories, exist_ok=True)
+        filename = self.trajectoryFile(dir, coherence)
+        # write next to the final file and rename, so a crash never leaves a partial cache
+        tmpname = filename[:-len('.npy')] + '.tmp.npy'
+        out = np.lib.format.open_memmap(tmpname, mode='w+', dtype=np.float64, shape=shape)
+
+        for patch in range(npatches):
+            state = self.buildlive(dir, coherence, patch)
+            for u in range(nupdates):
+                for sub in range(self.interleaved):
+                    out[patch, u, sub] = state.update(sub)
+
+        out.flush()
+        del out
+        os.replace(tmpname, filename)
+        self.memmaps.pop((dir, coherence), None)
+
+        return filename
+
+
+    def get (self, dir, coherence, patch):
+        key = (dir, coherence, patch)
+
+        with self.lock:
+            state = self.patches.get(key)
+            if state is not None:
+                self.patches.move_to_end(key)
+                return state
+
+        state = self.build(dir, coherence, patch)
+
+        with self.lock:
+            # a prewarm thread may have built the same patch in the meantime
+            state = self.patches.setdefault(key, state)
+            self.patches.move_to_end(key)
+            while len(self.patches) > self.maxsize:
+                self.patches.popitem(last=False)
+
+        return state
+
+    def settings (self):
+        return np.array([self.ndots, self.dotlife, self.speed, self.interleaved, self.fieldSize, self.seed], dtype=float)
+
+    def snapshot (self, keys):
+        '''
+            the freshly built state of the patches of the given keys,
+            including their rng states, as a dict of arrays for restore()
+        '''
+        if self.seed is None:
+            raise ValueError("only the patches of a seeded pool can be restored")
+
+        keys = list(keys)
+        states = [self.buildlive(*key) for key in keys]
+        rngstates = [[rng.get_state() for rng in state.rngs] for state in states]
+        shape = (len(keys), self.interleaved)
+
+        return {
+            'settings': self.settings(),
+            'keys': np.array(keys, dtype=float).reshape(-1, 3),
+            'xy': np.array([state.xy for state in states]).reshape(shape + (self.ndots, 2)),
+            'life': np.array([state.life for state in states]).reshape(shape + (self.ndots,)),
+            'dirs': np.array([state.dirs for state in states]).reshape(shape + (self.ndots,)),
+            'rngkeys': np.array([[r[1] for r in rs] for rs in rngstates], dtype=np.uint32).reshape(shape + (-1,)),
+            'rngpos': np.array([[r[2:] for r in rs] for rs in rngstates], dtype=float).reshape(shape + (3,))
+        }
+
+    def restore (self, arrays):
+        '''
+            put the patches of a snapshot() in the pool, without drawing any
+            random numbers; returns how many patches were restored (0 if the
+            snapshot was made with different settings)
+        '''
+        settings = arrays['settings']
+        if settings.shape != (6,) or not np.allclose(settings, self.settings()):
+            return 0
+
+        restored = {}
+        for i, (dir, coherence, patch) in enumerate(arrays['keys']):
+            rngs = []
+            for sub in range(self.interleaved):
+                pos, gauss, cached = arrays['rngpos'][i, sub]
+                rngs.append(lazyrng(('MT19937', arrays['rngkeys'][i, sub], int(pos), int(gauss), cached)))
+
+            key = (int(dir), float(coherence), int(patch))
+            restored[key] = patchstate(rngs, self.ndots, self.dotlife, self.speed, dir, coherence, self.fieldSize,
+                                       (arrays['xy'][i].copy(), arrays['life'][i].copy(), arrays['dirs'][i].copy()))
+
+        with self.lock:
+            for key, state in restored.items():
+                self.patches[key] = state
+                self.patches.move_to_end(key)
+            while len(self.patches) > self.maxsize:
+                self.patches.popitem(last=False)
+
+        return len(restored)
+
+    def prewarm (self, keys):
+        '''
+            build the patches for the given (direction, coherence, patch)
+            keys in a background thread and return the thread
+        '''
+        keys = list(keys)
+
+        def work():
+            for key in keys:
+                if key not in self:
+                    self.get(*key)
+
+        thread = threading.Thread(target=work, daemon=True)
+        thread.start()
+        return thread
+
+
+class dotfield:
+    '''
+        renders the patches of one direction and coherence from a patchpool
+        through a single ElementArrayStim
+
+        Indexing it gives objects with a draw() method, so
+        dotfield[patch][frame % 3].draw() works like the former DotStim lists.
+        Fields at the same position can share one ElementArrayStim by passing
+        the elements of an existing field.
+    '''
+    def __init__(self, window, xoffset, pool, dir, coherence, N=N, elements=None):
+        from psychopy import visual
+        self.pool = pool
+        self.dir = dir
+        self.coherence = coherence
+
+        self.elements = elements if elements is not None else visual.ElementArrayStim(
+            window,
+            units='pix',
+            fieldPos=[0 + xoffset, 0],
+            fieldSize=pool.fieldSize,
+            fieldShape='circle',
+            nElements=pool.ndots,
+            sizes=2, # DotStim default dotSize
+            xys=np.zeros((pool.ndots, 2)),
+            colors=(1.0, 1.0, 1.0),
+            colorSpace='rgb',
+            elementTex=None,
+            elementMask=None
+        )
+
+        self.patches = [dotpatch(self, i, pool.interleaved) for i in range(N)]
+
+    def __getitem__ (self, patch):
+        return self.patches[patch]
+
+    def __len__ (self):
+        return len(self.patches)
+
+    def keys (self):
+        return [(self.dir, self.coherence, i) for i in range(len(self.patches))]
+
+    def update (self, patch, sub=0):
+        '''
+            move the dots of a (sub-)patch one frame further and return
+            their positions relative to the field centre
+        '''
+        return self.pool.get(self.dir, self.coherence, patch).update(sub)
+
+    def draw (self, patch, sub=0):
+        '''
+            like DotStim.draw: move the dots one frame further, then draw
+        '''
+        self.elements.xys = self.update(patch, sub)
+        self.elements.draw()
+
+
+class dotpatch:
+    def __init__(self, field, patch, interleaved):
+        self.field = field
+        self.patch = patch
+        self.subpatches = [dotsubpatch(field, patch, sub) for sub in range(interleaved)]
+
+    def __getitem__ (self, sub):
+        return self.subpatches[sub]
+
+    def __len__ (self):
+        return len(self.subpatches)
+
+    def draw (self):
+        self.field.draw(self.patch)
+
+
+class dotsubpatch:
+    def __init__(self, field, patch, sub):
+        self.field = field
+        self.patch = patch
+        self.sub = sub
+
+    def draw (self):
+        self.field.draw(self.patch, self.sub)
+
+
+class titrationpatches:
+    '''
+        moving dot patches for the titration, looked up by direction and
+        coherence instead of being created right before every trial
+
+        All fields share one ElementArrayStim, so a new coherence only costs
+        the numpy state of its patches. With a fixed set of coherences (the
+        constant stimuli method and the familiarisation) prewarm() builds
+        everything while the instructions are shown. For QUEST only the next
+        trial is known: prepare() draws its direction and patch and builds
+        that single patch while the feedback of the current trial is on
+        screen, nexttrial() then returns it.
+    '''
+    def __init__(self, window, xoffset, npatches=N, directions=(0, 180)):
+        self.npatches = npatches
+        self.directions = directions
+        self.window = window
+        self.xoffset = xoffset
+        self.pool = patchpool(ndots//3, dotlife, speed, interleaved=3, maxsize=4*npatches)
+        self.elements = dotfield(window, xoffset, self.pool, directions[0], 0, N=0).elements
+        self.fields = {}
+        self.upcoming = {} # coherence: (direction, patch) drawn by prepare()
+
+    def __getitem__ (self, key):
+        '''
+            the dotfield of a (direction, coherence) pair
+        '''
+        if key not in self.fields:
+            dir, coherence = key
+            self.fields[key] = dotfield(self.window, self.xoffset, self.pool, dir, coherence, self.npatches, self.elements)
+        return self.fields[key]
+
+    def get (self, dir, coherence):
+        '''
+            a randomly picked patch of the given direction and coherence
+        '''
+        return self[(dir, coherence)][np.random.randint(0, self.npatches)]
+
+    def choose (self):
+        '''
+            a random direction and patch index
+        '''
+        return np.random.choice(np.array(self.directions)), np.random.randint(0, self.npatches)
+
+    def prepare (self, coherence):
+        '''
+            draw the direction and patch of the next trial at this coherence
+            and build only that patch in a background thread, returns the
+            thread
+        '''
+        dir, patch = self.upcoming[coherence] = self.choose()
+        return self.pool.prewarm([(dir, coherence, patch)])
+
+    def nexttrial (self, coherence):
+        '''
+            direction and dot patch of a trial at this coherence, the ones
+            drawn by prepare() if it was called for the coherence
+        '''
+        dir, patch = self.upcoming.pop(coherence, None) or self.choose()
+        return dir, self[(dir, coherence)][patch]
+
+    def prewarm (self, coherences):
+        '''
+            build the patches of all directions for the given coherences in
+            a background thread and return the thread
+        '''
+        coherences = list(coherences)
+        self.pool.maxsize = max(self.pool.maxsize, len(set(coherences)) * len(self.directions) * self.npatches)
+        return self.pool.prewarm([(dir, coherence, patch)
+                                  for coherence in coherences
+                                  for dir in self.directions
+                                  for patch in range(self.npatches)])
+
+
+def createStationaryPool (seed=None):
+    return patchpool(ndots, -1, 0, maxsize=N, seed=seed)
+
+def createMovingPool (seed=None, trajectories=None):
+    return patchpool(ndots//3, dotlife, speed, interleaved=3, seed=seed, trajectories=trajectories)
+
+def stimulusKeys (coherence, practice=True):
+    '''
+        the (direction, coherence, patch) keys of the stationary and of the
+        moving patches of a mainstim
+    '''
+    coherences = [practiceTrialCoherence, coherence] if practice else [coherence]
+    stationary = [(0, 0, i) for i in range(N)]
+    moving = [(dir, c, i) for c in coherences for dir in (0, 180) for i in range(N)]
+    return stationary, moving
+
+def writeSnapshot (filename, stationaryPool, movingPool, coherence, practice=True):
+    '''
+        save the fresh state of the patches of a mainstim; moving patches
+        that are played back from trajectory files are left out
+    '''
+    stationary, moving = stimulusKeys(coherence, practice)
+    moving = [key for key in moving if movingPool.memmap(key[0], key[1]) is None]
+
+    arrays = {}
+    for name, pool, keys in [('stationary', stationaryPool, stationary), ('moving', movingPool, moving)]:
+        for key, value in pool.snapshot(keys).items():
+            arrays[name + '_' + key] = value
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    # write next to the final file and rename, so a crash never leaves a partial snapshot
+    tmpname = filename[:-len('.npz')] + '.tmp.npz'
+    np.savez(tmpname, **arrays)
+    os.replace(tmpname, filename)
+    return filename
+
+def readSnapshot (filename, stationaryPool, movingPool):
+    '''
+        restore the patches saved by writeSnapshot, returns the number of
+        restored patches (0 if there is no usable snapshot)
+    '''
+    if not os.path.exists(filename):
+        return 0
+
+    with np.load(filename) as f:
+        arrays = dict(f)
+
+    restored = 0
+    for name, pool in [('stationary', stationaryPool), ('moving', movingPool)]:
+        prefix = name + '_'
+        restored += pool.restore({key[len(prefix):]: value for key, value in arrays.items() if key.startswith(prefix)})
+    return restored
+
+def createStationaryDots (N, window, xoffset, coherence, pool=None):
+    '''
+        N different patches of randomly distributed stationary dots
+    '''
+    pool = pool if pool is not None else createStationaryPool()
+    return dotfield(window, xoffset, pool, 0, coherence, N)
+
+def createMovingDots (N, window, xoffset, dir, coherence, pool=None):
+    '''
+        3xN different patches of randomly distributed moving dots
         3 patches are then used for the interleaving frames
     '''
-    dots = []
-    dotsList = []
+    pool = pool if pool is not None else createMovingPool()
+    return dotfield(window, xoffset, pool, dir, coherence, N)
+
+
+def fixationTexture (color, res=64):
+    '''
+        the composite fixation target of createFixation (coloured disc of 21 px,
+        black cross of 25 px, coloured dot of 7 px) as one RGB texture and
+        alpha mask, for an element of 25 px
+    '''
+    from psychopy import colors
+    rgb = np.array(colors.colorNames[color], float)
+    u, v = np.mgrid[-1:1:1j * res, -1:1:1j * res]
+    rad = np.hypot(u, v)
+
+    # in units of the 25 px element: disc radius 10.5 px, dot radius 3.5 px,
+    # cross arms as wide as those of psychopy's 'cross' mask
+    disc = rad < 21 / 25
+    dot = rad < 7 / 25
+    cross = (np.abs(u) < 0.2) | (np.abs(v) < 0.2)
+
+    tex = np.empty((res, res, 3))
+    tex[:] = rgb
+    tex[cross & ~dot] = -1
+
+    mask = np.where(disc | cross, 1., -1.)
+
+    return tex, mask
+
+
+class dualstim:
+    '''
+        draws the dots and the fixation targets of several subjects sharing
+        one window (the dyadic task) with a single ElementArrayStim each
+
+        stims are the subjects' mainstims; their xoffset is baked into the
+        element positions, so a frame costs one draw call for all dots and
+        one for all fixation targets.
+    '''
+    def __init__(self, window, stims):
+        from psychopy import visual
+        self.stims = stims
+        offsets = [s.xoffset for s in stims]
+
+        self.dots = {}
+        for n in [ndots, ndots//3]:
+            self.dots[n] = visual.ElementArrayStim(
+                window,
+                units='pix',
+                fieldPos=[0, 0],
+                nElements=n * len(stims),
+                sizes=2, # DotStim default dotSize
+                xys=np.zeros((n * len(stims), 2)),
+                colors=(1.0, 1.0, 1.0),
+                colorSpace='rgb',
+                elementTex=None,
+                elementMask=None
+            )
+
+        # dot positions of all subjects, written in place every frame
+        self.xys = {n: np.zeros((n * len(stims), 2)) for n in self.dots}
+        self.xoffsets = {n: np.repeat(offsets, n) for n in self.dots}
+
+        self.fixation = {}
+        for name, color in fixationColors.items():
+            tex, mask = fixationTexture(color)
+            self.fixation[name] = visual.ElementArrayStim(
+                window,
+                units='pix',
+                fieldPos=[0, 0],
+                nElements=len(stims),
+                sizes=25,
+                xys=[[x, 0] for x in offsets],
+                colors=(1.0, 1.0, 1.0),
+                colorSpace='rgb',
+                elementTex=tex,
+                elementMask=mask
+            )
+
+    def drawDots (self, fields, patch, sub=0):
+        '''
+            advance and draw one (sub-)patch of each subject's dotfield
+        '''
+        n = fields[0].pool.ndots
+        xys = self.xys[n]
+        for i, field in enumerate(fields):
+            xys[i * n:(i + 1) * n] = field.update(patch, sub)
+        xys[:, 0] += self.xoffsets[n]
+
+        self.dots[n].xys = xys
+        self.dots[n].draw()
+
+    def drawSubpatches (self, subpatches):
+        '''
+            draw the given dotpatch/dotsubpatch of each subject, e.g. the
+            stimOne, stimTwo of the dyadic trial loop
+        '''
+        first = subpatches[0]
+        self.drawDots([s.field for s in subpatches], first.patch, getattr(first, 'sub', 0))
+
+    def drawFixation (self, color):
+        self.fixation[color].draw()
+
+
+# rendered texts per window, see getText
+textCache = weakref.WeakKeyDictionary()
 
-    for _ in range(N):
-        for count in range(3):
-                dots.append(createDots(window, xoffset, dir, ndots//3, dotlife, speed, coherence))
+def getText (window, text, pos, color='white', height=20):
+    '''
+        a TextStim for the given text, position, colour and height, built once
+        per window and reused afterwards, so the glyph layout and the texture
+        upload only happen the first time a string is shown
+    '''
+    cache = textCache.setdefault(window, {})
+    key = (text, tuple(pos), color, height)
 
-        dotsList.append(dots)
+    stim = cache.get(key)
+    if stim is None:
+        from psychopy import visual
+        stim = visual.TextStim(window, text=text, pos=pos, color=color, height=height)
+        cache[key] = stim
 
-    return dotsList
+    return stim
 
 
 def createFixation (window, xoffset, color):
+    from psychopy import visual
     fixationList = [
         visual.GratingStim(
             win=window, size=21, units='pix', pos=[0 + xoffset, 0],
@@ -113,30 +813,39 @@ def createFixation (window, xoffset, color):
 
 
 class mainstim:
-    def __init__(self, window, xoffset, coherence):
-        # list of differently distributed startionary dots
-        self.stationaryDotsList = createStationaryDots(N, window, xoffset, 0)
+    def __init__(self, window, xoffset, coherence, seed=None, trajectories=None):
+        # patches are only built when they are first drawn (or prewarmed);
+        # with a seed they are reproducible and, if precomputed, played back
+        # from the trajectory files in the trajectories directory
+        self.stationaryPool = createStationaryPool(seed)
+        self.movingPool = createMovingPool(seed, trajectories)
+
+        # differently distributed stationary dot patches
+        self.stationaryDotsList = createStationaryDots(N, window, xoffset, 0, self.stationaryPool)
 
-        # lists of differently distributed moving dots (first for direction=0,
+        # differently distributed moving dot patches (first for direction=0,
         # second for direction=180) for practice trials
-        self.movingRightDotsListPractice = createMovingDotsPractice(N, window, xoffset, 0, practiceTrialCoherence)
-        self.movingLeftDotsListPractice = createMovingDotsPractice(N, window, xoffset, 180, practiceTrialCoherence)
+        self.movingRightDotsListPractice = createMovingDots(N, window, xoffset, 0, practiceTrialCoherence, self.movingPool)
+        self.movingLeftDotsListPractice = createMovingDots(N, window, xoffset, 180, practiceTrialCoherence, self.movingPool)
 
-        # lists of differently distributed moving dots (first for direction=0,
+        # differently distributed moving dot patches (first for direction=0,
         # second for direction=180) for main experiment
-        self.movingRightDotsList = createMovingDots(N, window, xoffset, 0, coherence)
-        self.movingLeftDotsList = createMovingDots(N, window, xoffset, 180, coherence)
+        self.movingRightDotsList = createMovingDots(N, window, xoffset, 0, coherence, self.movingPool)
+        self.movingLeftDotsList = createMovingDots(N, window, xoffset, 180, coherence, self.movingPool)
+
+        self.xoffset = xoffset
 
         # fixation composite targets
-        self.fixation_green = createFixation(window, xoffset, "forestgreen")
-        self.fixation_blue = createFixation(window, xoffset, "deepskyblue")
-        self.fixation_yellow = createFixation(window, xoffset, "yellow")
+        self.fixation_green = createFixation(window, xoffset, fixationColors["green"])
+        self.fixation_blue = createFixation(window, xoffset, fixationColors["blue"])
+        self.fixation_yellow = createFixation(window, xoffset, fixationColors["yellow"])
 
         """
         For response time related warning to be shown on top of fixation cross
         a. if response time < 100 ms: Too Fast
         b. response time > 1500 ms: Too Slow
         """
+        from psychopy import visual
         self.indicatordict = {
             "slow": visual.TextStim(
                 win=window, text="Too Slow", units='pix', pos=[0 + xoffset, 0], color='red'
@@ -145,3 +854,42 @@ class mainstim:
                 win=window, text="Too Fast", units='pix', pos=[0 + xoffset, 0], color='red'
             )
         }
+
+    def setCoherence (self, coherence):
+        '''
+            switch the patches of the main experiment to another coherence,
+            e.g. the threshold once the titration is done; the pools, and the
+            patches already built for other coherences, are kept
+        '''
+        self.movingRightDotsList.coherence = coherence
+        self.movingLeftDotsList.coherence = coherence
+
+    def restore (self, filename):
+        '''
+            fill the pools from a snapshot written by writeSnapshot (see
+            precompute_trajectories.py), returns the number of patches
+        '''
+        return readSnapshot(filename, self.stationaryPool, self.movingPool)
+
+    def prewarm (self, practice=True):
+        '''
+            build all patches in the background, e.g. while instructions are shown
+        '''
+        moving = self.movingRightDotsList.keys() + self.movingLeftDotsList.keys()
+        if practice:
+            moving = self.movingRightDotsListPractice.keys() + self.movingLeftDotsListPractice.keys() + moving
+
+        return [
+            self.stationaryPool.prewarm(self.stationaryDotsList.keys()),
+            self.movingPool.prewarm(moving)
+        ]
+
+    def precompute (self, practice=True, seconds=None):
+        '''
+            write the trajectory files for all moving dot patches
+        '''
+        fields = [self.movingRightDotsList, self.movingLeftDotsList]
+        if practice:
+            fields += [self.movingRightDotsListPractice, self.movingLeftDotsListPractice]
+
+        return [self.movingPool.precompute(f.dir, f.coherence, len(f), seconds) for f in fields]
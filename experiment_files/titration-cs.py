@@ -1,17 +1,25 @@
 import sys
 import os
 import json
+import config
+config.init(sys.argv)
 import time
+from startup import getpairid
+
+# check the settings (config.init above) and the pair id before the
+# heavy imports and the window, so a mistake fails right away
+pair_id = getpairid()
+
 import numpy as np
-import pandas as pd
-import psychopy
-from psychopy import visual, event, core, monitors, data, prefs
-from stimuli_random_dots import createDots
+import psychopy.visual
+from psychopy import event, core, monitors, data, prefs
 import stimuli_random_dots as stimuli
+from frametiming import frametimer
+from responses import waitforall
+from psychopy.hardware import keyboard
 from psychopy.sound import Sound
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import psychometric
+from convergence import convergencemonitor, plausible
 import random
 
 
@@ -23,7 +31,7 @@ HOME = os.getcwd()
 DATA = '/data/'
 
 # Subject data dictionary
-subjectData = {'pair_id': [], 'titration_counter': [], 'chamber':[], 'threshold': [], 'threshold_list': [], 'responses': [], 'method': 'constants' }
+subjectData = {'pair_id': [], 'titration_counter': [], 'chamber':[], 'threshold': [], 'threshold_list': [], 'responses': [], 'estimates': [], 'stopping_reason': [], 'method': 'constants', 'frame_timing': [] }
 
 # monitoring the while loop with..
 titration_over = False
@@ -31,6 +39,9 @@ titration_over = False
 # monitoring how often the titration has been done
 titration_counter = 0
 
+# keyboard for the instruction screens, waited on without spinning
+kb = keyboard.Keyboard()
+
 # monitor specs global variables
 M_WIDTH = stimuli.M_WIDTH
 M_HEIGHT = stimuli.M_HEIGHT
@@ -39,27 +50,17 @@ ndots = stimuli.ndots
 dotlife = stimuli.dotlife
 speed = stimuli.speed
 
+# responses after this many frames are too slow, before this many too fast
+slowFrames = config.frames(config.settings['slowResponse'])
+fastFrames = config.frames(config.settings['fastResponse'])
+
 myMon = monitors.Monitor('DellU2412M', width=M_WIDTH, distance=stimuli.distance)
 myMon.setSizePix([M_WIDTH, M_HEIGHT])
 
-# get pair id via command-line argument
-try:
-    pair_id = int(sys.argv[1])
-except:
-    print('Please enter a number as pair id as command-line argument!')
-    pair_id = input()
-
 subjectData['pair_id'] = pair_id
 
 def secondstoframes (seconds):
-    REFRESH_RATE = 60
-    return range( int( np.rint(seconds * REFRESH_RATE) ) )
-
-def createDotPatch(window, xoffset, direction, coherence):
-    stimList = []
-    for _ in range(3):
-        stimList.append(createDots(window, xoffset, direction, ndots//3, dotlife, speed, coherence))
-    return stimList
+    return range( config.frames(seconds) )
 
 def draw_fixation(fixation):
     for grating in fixation:
@@ -95,9 +96,7 @@ def feedback_interval(fixation, dotpatch, indicatordict, rt_msg="NA"):
 def endscreen():
     instructions = "You have finished the first part of the experiment."
 
-    visual.TextStim(window,
-                    text=instructions, pos=(0, 0),
-                    color='white', height=20).draw()
+    stimuli.getText(window, instructions, (0, 0)).draw()
 # TODO:
 def instruction_titration():
     instructions = "Please read the instructions carefully.\n\
@@ -105,9 +104,7 @@ def instruction_titration():
     2. After the beep, you will see some dots moving either to the left or to the right. Hit the left (yellow) button if the dots are moving left, and the right (blue) button if the dots move right.\n\
     Press the right (blue) button to continue"
 
-    visual.TextStim(window,
-                    text=instructions, pos=(0, 0),
-                    color='white', height=20).draw()
+    stimuli.getText(window, instructions, (0, 0)).draw()
 
 # TODO:
 def instruction_familiarization():
@@ -117,30 +114,23 @@ def instruction_familiarization():
     2. After the beep, you will see some dots moving either to the left or to the right. Hit the left (yellow) button if the dots are moving left, and the right (blue) button if the dots move right.\n\
     Press the right (blue) button to start practice trials!"
 
-    visual.TextStim(window,
-                    text=instructions, pos=(0, 0),
-                    color='white', height=20).draw()
+    stimuli.getText(window, instructions, (0, 0)).draw()
 
 def get_threshold(intensities,responses):
-    df = pd.DataFrame(intensities, columns = ['intensity'],dtype=float)
-    df2 = pd.DataFrame(responses, columns = ['response'],dtype=float)
-    df = pd.concat([df,df2],axis=1)
-    df = df.groupby(['intensity'])['response'].mean().reset_index()
-    fit = data.FitWeibull(df['intensity'], df['response'],expectedMin=0.5)
-    smooth_intensities = np.linspace(min(intensities), max(intensities), 100)
-    test_resp = fit.eval(smooth_intensities)
-    threshold = fit.inverse(0.75)
-
-    fig, ax = plt.subplots(1, 1)
-    ax.plot(smooth_intensities, test_resp, '-')
-    ax.axhline(0.75, linestyle='-', color='orange')
-    ax.axvline(threshold, linestyle='-', color='orange')
-    plt.title('threshold = %0.3f' % threshold)
-    plt.plot(df['intensity'], df['response'], 'o')
-    plt.ylim([0, 1])
-    plt.savefig("data" + chamber + data.getDateStr() + '_psyfunc.jpg')
-
-    return threshold
+    fit = psychometric.fit(intensities, responses, gamma=0.5)
+    # the figure is saved in the background, the threshold is needed right away
+    psychometric.plotinbackground(fit, intensities, responses, "data" + chamber + data.getDateStr() + '_psyfunc.jpg')
+
+    return fit['threshold']
+
+def feedback_wait(seconds=1):
+    '''
+        keep the feedback on screen, meanwhile refit the psychometric
+        function to all answers so far
+    '''
+    clock = core.Clock()
+    monitor.update(psychometric.fit(thresholds, responses)['threshold'])
+    core.wait(seconds - clock.getTime())
 
 while titration_over == False:
     # input the chamber number in which titration takes place
@@ -159,22 +149,24 @@ while titration_over == False:
     subjectData['chamber'] = chamber
 
     # create beep for decision interval
-    if chamber == "1":
-        beep = Sound('C', secs=0.5, volume=0.1, octave=5)
-    else:
-        beep = Sound('F', secs=0.5, volume=0.1, octave=4)
+    beep = Sound(**config.beep(chamber))
 
     # variables for button box input
-    keys = ["2", "1"] if chamber == "1" else ["7", "8"] # first one is right
+    keys = [config.keymap(chamber)['right'], config.keymap(chamber)['left']] # first one is right
 
     # the screen
     window = psychopy.visual.Window(size=(M_WIDTH, M_HEIGHT), units='pix', screen=int(chamber), fullscr=False, pos=None, color =[-1,-1,-1])
     window.mouseVisible = False # hide cursor
     xoffset = 0
+    # flip timestamps of the trial loops
+    timer = frametimer(window)
+    subjectData['frame_timing'] = []
     # the stimulus
     stimulus = stimuli.mainstim(window=window, xoffset=xoffset, coherence=0.5)
     stationaryDotsList = stimulus.stationaryDotsList
     stationaryDotPatch = stationaryDotsList[0]
+    # the moving dot patches, per direction and coherence
+    movingPatches = stimuli.titrationpatches(window, xoffset)
 
     bluecross = stimulus.fixation_blue
     greencross = stimulus.fixation_green
@@ -186,26 +178,31 @@ while titration_over == False:
     # 1. Familiarization
     # '''
 
+    practice_trials = [0.05, 0.1, 0.2, 0.4, 0.8]*3
+    random.shuffle(practice_trials)
+    # build the practice patches while the instructions are shown
+    movingPatches.prewarm(practice_trials)
+
     instruction_familiarization() # display instructions
     window.flip()
-    key = event.waitKeys(keyList=keys[:1])
+    waitforall([kb], [keys[:1]])
 
-    practice_trials = [0.05, 0.1, 0.2, 0.4, 0.8]*3
-    random.shuffle(practice_trials)
     for coherence in practice_trials:
 
         flag = "NA"
 
+        timer.start()
+
         # randomly pick dot motion direction and set coherence
         direction = np.random.choice(np.array([0, 180]))
-        movingDotPatch = createDotPatch(window, xoffset, direction, coherence)
+        movingDotPatch = movingPatches.get(direction, coherence)
         key = []
 
         # pretrial interval
         for frame in secondstoframes( np.random.uniform(1, 2) ):
             # window.flip() #(for feedback)
             pretrial_interval(greencross, stationaryDotPatch)
-            window.flip()
+            timer.flip()
 
         # play beep because next is decision interval (beep should depend on chamber number)
 
@@ -224,7 +221,7 @@ while titration_over == False:
                 decision_interval(movingDotPatch[2])
             else:
                 print('error in secondstoframes decision_interval')
-            window.flip()
+            timer.flip()
 
             # fetch button press: response 0 is right, response 1 is left
             if response is None:
@@ -240,9 +237,9 @@ while titration_over == False:
 
             else:
 
-                if frame > int( np.rint(1.5 * stimuli.REFRESH_RATE) ):
+                if frame > slowFrames:
                     flag = "slow"
-                elif frame < int( np.rint(0.1 * stimuli.REFRESH_RATE) ):
+                elif frame < fastFrames:
                     flag = "fast"
 
                 if direction == 180:
@@ -270,16 +267,18 @@ while titration_over == False:
             drawDots(stationaryDotPatch)
             if flag != "NA":
                 indicatordict[flag].draw()
-            window.flip()
+            timer.flip()
             core.wait(1)
         elif response == 0: #right
             draw_fixation(bluecross)
             drawDots(stationaryDotPatch)
             if flag != "NA":
                 indicatordict[flag].draw()
-            window.flip()
+            timer.flip()
             core.wait(1)
 
+        timer.summary()
+
 
 
     '''
@@ -292,13 +291,17 @@ while titration_over == False:
     coherences = [0.05, 0.1, 0.2, 0.4, 0.8] # this is taken from Murphy et al 2014
     thresholds = [{'coherence': c} for c in coherences]
     num_repetitions = 40
+    # thresholds outside this range are not accepted, as in the staircase
+    minVal = config.settings['minCoherence']
+    maxVal = config.settings['maxCoherence']
 
     # the trialhandler
     trials = data.TrialHandler(thresholds, num_repetitions, method='random')
+    movingPatches.prewarm(coherences)
 
     instruction_titration() # display instructions
     window.flip()
-    key = event.waitKeys(keyList=keys[:1])
+    waitforall([kb], [keys[:1]])
 
     """
     Main section
@@ -306,21 +309,24 @@ while titration_over == False:
     # list that is filled with the staircase values
     thresholds = []
     responses = []
+    # ends the titration once the running fit is stable
+    monitor = convergencemonitor(tolerance=0.1, minTrials=100, window=20)
 
     for trial in trials:
         flag = "NA"
+        timer.start()
+
         # randomly pick dot motion direction and set coherence
         direction = np.random.choice(np.array([0, 180]))
         coherence = trial['coherence'] # update the coherence value
-        thresholds.append(coherence)
-        movingDotPatch = createDotPatch(window, xoffset, direction, coherence)
+        movingDotPatch = movingPatches.get(direction, coherence)
         key = []
 
         # pretrial interval
         for frame in secondstoframes( np.random.uniform(1, 2) ):
             # window.flip() #(for feedback)
             pretrial_interval(greencross, stationaryDotPatch)
-            window.flip()
+            timer.flip()
 
         # play beep because next is decision interval (beep should depend on chamber number)
 
@@ -339,7 +345,7 @@ while titration_over == False:
                 decision_interval(movingDotPatch[2])
             else:
                 print('error in secondstoframes decision_interval')
-            window.flip()
+            timer.flip()
 
             # fetch button press: response 0 is right, response 1 is left
             if response is None:
@@ -354,9 +360,9 @@ while titration_over == False:
                     response = 0
 
             else:
-                if frame > int( np.rint(1.5 * stimuli.REFRESH_RATE) ):
+                if frame > slowFrames:
                     flag = "slow"
-                elif frame < int( np.rint(0.1 * stimuli.REFRESH_RATE) ):
+                elif frame < fastFrames:
                     flag = "fast"
                 
                 if direction == 180:
@@ -372,6 +378,8 @@ while titration_over == False:
                 else:
                     correct = 0
 
+                # only answered trials enter the fit
+                thresholds.append(coherence)
                 responses.append(correct)
                 break
 
@@ -386,26 +394,35 @@ while titration_over == False:
             drawDots(stationaryDotPatch)
             if flag != "NA":
                 indicatordict[flag].draw()
-            window.flip()
-            core.wait(1)
+            timer.flip()
+            feedback_wait()
         elif response == 0: #right
             draw_fixation(bluecross)
             drawDots(stationaryDotPatch)
             if flag != "NA":
                 indicatordict[flag].draw()
-            window.flip()
-            core.wait(1)
+            timer.flip()
+            feedback_wait()
+
+        # frame timing of the titration trial
+        subjectData['frame_timing'].append(timer.summary())
+
+        if monitor.stopped:
+            break
 
     # fill subject dictionary with threshold and staircase value list
     subjectData['threshold_list'] = thresholds
     subjectData['responses'] = responses
+    subjectData['estimates'] = monitor.estimates # running fit after every answered trial
+    subjectData['stopping_reason'] = monitor.finish()
+
+    print(timer.report())
 
     endscreen()
     window.flip()
     core.wait(5)
     window.close()
 
-    titration_over = True
     # Create directory and save the responses
     DATAPATH = HOME + DATA + str(pair_id)
     if not os.path.exists(DATAPATH):
@@ -413,7 +430,11 @@ while titration_over == False:
     os.chdir(DATAPATH)
 
     subjectData['threshold'] = get_threshold(thresholds,responses)
-    with open('data_chamber' + chamber + '.json', 'w') as fp:
-        json.dump(subjectData, fp)
+    print("The participant's threshold is: " + str(subjectData['threshold']) + " after " + str(len(responses)) + " trials (" + monitor.reason + ")")
 
-    print("The participant's threshold is: " + str(subjectData['threshold']))
+    if plausible(subjectData['threshold'], minVal, maxVal):
+        titration_over = True
+        with open('data_chamber' + chamber + '.json', 'w') as fp:
+            json.dump(subjectData, fp)
+    else:
+        print("The threshold is outside %s - %s and is not saved, the titration is repeated." % (minVal, maxVal))
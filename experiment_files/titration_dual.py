@@ -0,0 +1,388 @@
+'''
+    Titration of both participants of a pair at the same time
+
+    Runs the familiarisation and the staircase titration of
+    titration_random_dots.py for both chambers in one process, on the split
+    window of dyadic_random_dots.py. Every participant has their own
+    staircase, dot patches, beep and button box. The trials of both start
+    together: whoever answers first sees their feedback and then waits on the
+    stationary dots until the other one has answered as well. When the
+    titration of one participant has converged, they see the end screen while
+    the other one continues. At the end data_chamber1.json and
+    data_chamber2.json are written as titration_random_dots.py would.
+
+    Run from run_session.py, the window and button boxes of the session are
+    used and the accepted thresholds and the stimuli are handed on to the
+    dyadic task.
+
+    Usage:
+        python titration_dual.py <pair id>
+'''
+
+import sys
+import os
+import json
+import config
+config.init(sys.argv)
+import random
+import session
+from startup import getpairid
+
+# check the settings (config.init above) and the pair id before the
+# heavy imports and the window, so a mistake fails right away
+pair_id = session.current.pair_id if session.current is not None else getpairid()
+
+import numpy as np
+from psychopy import visual, core, prefs, monitors
+from psychopy.hardware import keyboard
+import stimuli_random_dots as stimuli
+import gridstaircase
+from convergence import convergencemonitor, plausibleposterior
+from frametiming import frametimer
+from responses import responselistener, waitforall, getKeyboards
+
+
+# set up sound for beeps
+prefs.hardware['audioLib'] = ['PTB']
+
+from psychopy import sound
+if session.current is None:
+    sound.setDevice(config.settings['audioDevice'])
+
+from psychopy.sound import Sound
+
+# set the number of trials (for testing)!
+numberOfTrials = config.settings['titrationTrials'] # should be 100
+
+# Directory Specs
+HOME = os.getcwd()
+
+# monitor specs global variables
+M_WIDTH = stimuli.M_WIDTH * 2
+M_HEIGHT = stimuli.M_HEIGHT
+N = stimuli.N
+
+myMon = monitors.Monitor('DellU2412M', width=M_WIDTH, distance=stimuli.distance)
+myMon.setSizePix([M_WIDTH, M_HEIGHT])
+
+if session.current is not None:
+    window = session.current.window
+else:
+    window = visual.Window(size=(M_WIDTH, M_HEIGHT), monitor=myMon,
+                           color="black", pos=(0,0), units='pix', blendMode='avg',
+                           fullscr=False, allowGUI=False)
+    window.mouseVisible = False # hide cursor
+ofs = window.size[0] / 4
+
+# flip timestamps of the trial loops
+timer = frametimer(window)
+
+expkb = session.current.expkb if session.current is not None else keyboard.Keyboard()
+
+
+class chamber:
+    def __init__(self, sid, kb):
+        '''
+            sid is the chamber number (1 or 2), kb the psychopy keyboard of
+            the chamber's button box
+        '''
+        self.id = sid
+        self.kb = kb
+        self.xoffset = ofs if sid == 1 else -ofs
+
+        keys = [config.keymap(sid)['right'], config.keymap(sid)['left']] # first one is right
+        self.buttons = {keys[0]: "right", keys[1]: "left"}
+        self.rightkeys = keys[:1]
+        self.listener = responselistener(kb, self.buttons)
+
+        self.beep = Sound(name="S" + str(sid), **config.beep(sid))
+
+        # stationary dots, fixation and response speed feedback; seeded like
+        # the stimuli of dyadic_random_dots.py, which reuses them in a session
+        self.stimulus = stimuli.mainstim(window=window, xoffset=self.xoffset, coherence=0.5,
+                                         seed=stimuli.stimulusSeed(pair_id, sid),
+                                         trajectories=stimuli.trajectoryDir(pair_id))
+        if session.current is not None:
+            session.current.stimuli[sid] = self.stimulus
+        self.stimulus.stationaryPool.prewarm(self.stimulus.stationaryDotsList.keys())
+        self.fixation = {
+            "green": self.stimulus.fixation_green,
+            "blue": self.stimulus.fixation_blue,
+            "yellow": self.stimulus.fixation_yellow
+        }
+        # the moving dot patches, per direction and coherence
+        self.movingPatches = stimuli.titrationpatches(window, self.xoffset)
+
+        self.staircase = None
+        self.monitor = None
+        self.staircase_medians = []
+        self.subjectData = {'pair_id': pair_id, 'titration_counter': 1, 'chamber': str(sid), 'threshold': [], 'threshold_list': [],
+                            'estimates': [], 'stopping_reason': [], 'staircase': {}, 'frame_timing': [] }
+
+    def __repr__ (self):
+        return str(self.id)
+
+    def starttitration (self):
+        self.staircase = gridstaircase.gridstaircase(
+                                        startVal=0.5,
+                                        startValSd=0.5, # log10 units, see gridstaircase.py
+                                        pThreshold=0.82, # the threshold is the coherence with 82 % correct
+                                        gamma=0.5,
+                                        delta=0.01,
+                                        nTrials=numberOfTrials,
+                                        minVal=config.settings['minCoherence'],
+                                        maxVal=config.settings['maxCoherence'],
+                                        method='quantile'
+                                        )
+        # ends the titration once the posterior is narrow enough
+        self.monitor = convergencemonitor(tolerance=0.1, minTrials=30)
+        self.movingPatches.prepare(self.staircase.intensity)
+
+    def nextcoherence (self):
+        '''
+            coherence of the next titration trial, None once the titration is over
+        '''
+        if self.monitor.stopped:
+            return None
+        return next(self.staircase, None)
+
+    def addResponse (self, correct):
+        '''
+            update the staircase and prepare the next trial; called as soon
+            as the answer is in, so it happens during the feedback
+        '''
+        self.staircase.addResponse(correct)
+        self.staircase_medians.append(self.staircase.quantile(0.5))
+        self.monitor.update(self.staircase.mean(), self.staircase.sd())
+        self.staircase.calculateNextIntensity()
+        self.movingPatches.prepare(self.staircase.intensity)
+
+    def finish (self):
+        self.subjectData['threshold'] = self.staircase.mean()
+        self.subjectData['threshold_list'] = self.staircase_medians
+        self.subjectData['estimates'] = self.monitor.estimates # posterior mean after every trial
+        self.subjectData['stopping_reason'] = self.monitor.finish()
+        self.subjectData['staircase'] = self.staircase.state() # the posterior, to continue the titration later
+
+        print(f"chamber {self.id}: threshold is {self.staircase.mean()} after {len(self.monitor)} trials ({self.monitor.reason})")
+
+
+def gentext (instr):
+    '''
+        Generate text on both subject screens
+    '''
+    for c in chambers:
+        stimuli.getText(window, instr, [0 + c.xoffset, 0]).draw()
+
+def endscreen (c):
+    instructions = "You have finished the first part of the experiment."
+
+    stimuli.getText(window, instructions, [0 + c.xoffset, 0]).draw()
+
+def instruction_titration():
+    instructions = "Please read the instructions carefully.\n\
+    1. During the experiment, stay fixated on the dot in the center of the screen.\n\
+    2. After the beep, you will see some dots moving either to the left or to the right. Hit the left (yellow) button if the dots are moving left, and the right (blue) button if the dots move right.\n\
+    Press the right (blue) button to continue"
+
+    gentext(instructions)
+
+def instruction_familiarization():
+    instructions = "Welcome to our experiment!\n\n\
+    Please read the instructions carefully.\n\
+    1. During the experiment, stay fixated on the dot in the center of the screen.\n\
+    2. After the beep, you will see some dots moving either to the left or to the right. Hit the left (yellow) button if the dots are moving left, and the right (blue) button if the dots move right.\n\
+    Press the right (blue) button to start practice trials!"
+
+    gentext(instructions)
+
+def getacknowledgements ():
+    '''
+        Wait until both subjects have pressed "right", the experimenter can
+        skip the wait by pressing space
+    '''
+    return waitforall([c.kb for c in chambers], [c.rightkeys for c in chambers], expkb=expkb)
+
+def secondstoframes (seconds):
+    return range( config.frames(seconds) )
+
+def draw_fixation(fixation):
+    for grating in fixation:
+        grating.draw()
+
+def runtrial (coherences, titrate):
+    '''
+        one trial for both chambers; coherences has one entry per chamber,
+        None for a chamber whose titration is over. With titrate the answers
+        are passed on to the staircases.
+    '''
+    timer.start()
+
+    trials = {}
+    for c, coherence in zip(chambers, coherences):
+        if coherence is None:
+            continue
+        # random direction and patch, during titration drawn in the last feedback
+        direction, patch = c.movingPatches.nexttrial(coherence)
+        trials[c] = {'direction': direction, 'patch': patch,
+                     'response': None, 'feedback': 0, 'flag': "NA"}
+
+    stationaryChoice = np.random.randint(0, N)
+
+    def drawstationary(c, color):
+        c.stimulus.stationaryDotsList[stationaryChoice].draw()
+        draw_fixation(c.fixation[color])
+
+    # pretrial interval
+    for frame in secondstoframes( np.random.uniform(1, 2) ):
+        for c in chambers:
+            if c in trials:
+                drawstationary(c, "green")
+            else:
+                endscreen(c)
+        timer.flip()
+
+    # play the beeps because next is decision interval
+    nextflip = window.getFutureFlipTime(clock='ptb')
+    for c in trials:
+        c.kb.clearEvents(eventType='keyboard')
+        c.kb.clock.reset()
+        c.listener.start()
+        c.beep.play(when=nextflip)
+
+    # decision interval: moving dots until the answer, then 1 s feedback,
+    # then stationary dots until the other participant has answered too
+    feedbackframes = len(secondstoframes(1))
+    for frame in secondstoframes(100):
+        for c in chambers:
+            if c not in trials:
+                endscreen(c)
+                continue
+
+            trial = trials[c]
+            if trial['response'] is None:
+                trial['patch'][frame % 3].draw()
+                draw_fixation(c.fixation["green"])
+            elif trial['feedback'] < feedbackframes:
+                drawstationary(c, "yellow" if trial['response'] == "left" else "blue")
+                if trial['flag'] != "NA":
+                    c.stimulus.indicatordict[trial['flag']].draw()
+                trial['feedback'] += 1
+            else:
+                drawstationary(c, "green")
+        timer.flip()
+
+        # fetch button presses, the queue of every button box is read once per frame
+        for c, trial in trials.items():
+            if trial['response'] is not None:
+                continue
+            response = c.listener.get()
+            if not response:
+                continue
+
+            c.beep.stop()
+            trial['response'] = response[0]
+            if response[1] > config.settings['slowResponse']:
+                trial['flag'] = "slow"
+            elif response[1] < config.settings['fastResponse']:
+                trial['flag'] = "fast"
+
+            correct = int((response[0] == "left") == (trial['direction'] == 180))
+            if titrate:
+                c.addResponse(correct)
+
+        if all(trial['response'] is not None and trial['feedback'] >= feedbackframes for trial in trials.values()):
+            break
+
+    for c in trials:
+        c.listener.stop()
+        c.beep.stop()
+
+    return timer.summary()
+
+
+###########################
+##### TITRATION START #####
+###########################
+
+if session.current is not None:
+    chambers = [chamber(sid, session.current.keyboards[sid]) for sid in (1, 2)]
+else:
+    keybs = getKeyboards()
+    chambers = [chamber(1, keyboard.Keyboard( keybs["chone"] )),
+                chamber(2, keyboard.Keyboard( keybs["chtwo"] ))]
+
+'''
+1. Familiarization
+'''
+
+practice_trials = [0.05, 0.1, 0.2, 0.4, 0.8]*3
+orders = []
+for c in chambers:
+    order = random.sample(practice_trials, len(practice_trials))
+    # build the practice patches while the instructions are shown
+    c.movingPatches.prewarm(order)
+    orders.append(order)
+
+instruction_familiarization() # display instructions
+window.flip()
+getacknowledgements()
+
+for coherences in zip(*orders):
+    runtrial(coherences, titrate=False)
+
+'''
+2. Titration
+'''
+
+for c in chambers:
+    c.starttitration()
+
+instruction_titration() # display instructions
+window.flip()
+getacknowledgements()
+
+while True:
+    coherences = [c.nextcoherence() for c in chambers]
+    if all(coherence is None for coherence in coherences):
+        break
+
+    summary = runtrial(coherences, titrate=True)
+    # frame timing of the titration trial
+    for c, coherence in zip(chambers, coherences):
+        if coherence is not None:
+            c.subjectData['frame_timing'].append(summary)
+
+for c in chambers:
+    c.finish()
+
+print(timer.report())
+
+for c in chambers:
+    endscreen(c)
+window.flip()
+core.wait(5)
+if session.current is None:
+    window.close()
+
+DATAPATH = os.path.join(HOME, 'data', str(pair_id))
+if not os.path.exists(DATAPATH):
+    os.makedirs(DATAPATH)
+
+for c in chambers:
+    print('Titration result of chamber ' + str(c.id) + ' sufficient? Enter y/n')
+    answer = input()
+
+    if answer != 'y':
+        print("Not saved, repeat the titration of chamber " + str(c.id) + " with titration_random_dots.py")
+    elif not plausibleposterior(c.staircase):
+        print("The threshold is not determined within %s - %s and is not saved, the titration has to be repeated." % (c.staircase.minVal, c.staircase.maxVal))
+    else:
+        with open(os.path.join(DATAPATH, 'data_chamber' + str(c.id) + '.json'), 'w') as fp:
+            json.dump(c.subjectData, fp)
+        if session.current is not None:
+            session.current.thresholds[c.id] = c.subjectData['threshold']
+
+#########################
+##### TITRATION END #####
+#########################
@@ -1,31 +1,41 @@
 import sys
 import os
 import json
+import config
+config.init(sys.argv)
 import time
+from startup import getpairid
+
+# check the settings (config.init above) and the pair id before the
+# heavy imports and the window, so a mistake fails right away
+pair_id = getpairid()
+
 import numpy as np
-import psychopy
-from psychopy import visual, event, core, prefs, sound
+import psychopy.visual
+from psychopy import event, core, prefs, sound
 from psychopy.sound import Sound
-from psychopy.data import StairHandler
-from psychopy.data import QuestHandler
-from stimuli_random_dots import createDots
 import stimuli_random_dots as stimuli
+import gridstaircase
+from convergence import convergencemonitor, plausibleposterior
+from frametiming import frametimer
+from responses import waitforall
+from psychopy.hardware import keyboard
 import random
 
 
 # set up sound for beeps
 prefs.hardware['audioLib'] = ['PTB']
-# sound.setDevice('USB Audio Device: - (hw:3,0)') #(not working on my computer for some reason, works in the lab though)
+# sound.setDevice(config.settings['audioDevice']) #(not working on my computer for some reason, works in the lab though)
 
 # set the number of trials (for testing)!
-numberOfTrials = 80 # should be 100
+numberOfTrials = config.settings['titrationTrials'] # should be 100
 
 # Directory Specs
 HOME = os.getcwd()
 DATA = '/data/'
 
 # Subject data dictionary
-subjectData = {'pair_id': [], 'titration_counter': [], 'chamber':[], 'threshold': [], 'threshold_list': [] }
+subjectData = {'pair_id': [], 'titration_counter': [], 'chamber':[], 'threshold': [], 'threshold_list': [], 'estimates': [], 'stopping_reason': [], 'staircase': {}, 'frame_timing': [] }
 
 # monitoring the while loop with.
 titration_over = False
@@ -33,6 +43,12 @@ titration_over = False
 # monitoring how often the titration has been done
 titration_counter = 0
 
+# staircases of the earlier titrations in this session, per chamber
+staircases = {}
+
+# keyboard for the instruction screens, waited on without spinning
+kb = keyboard.Keyboard()
+
 # monitor specs global variables
 M_WIDTH = stimuli.M_WIDTH
 M_HEIGHT = stimuli.M_HEIGHT
@@ -41,24 +57,42 @@ ndots = stimuli.ndots
 dotlife = stimuli.dotlife
 speed = stimuli.speed
 
-# get pair id via command-line argument
-try:
-    pair_id = int(sys.argv[1])
-except:
-    print('Please enter a number as pair id as command-line argument!')
-    pair_id = input()
+# responses after this many frames are too slow, before this many too fast
+slowFrames = config.frames(config.settings['slowResponse'])
+fastFrames = config.frames(config.settings['fastResponse'])
 
 subjectData['pair_id'] = pair_id
 
 def secondstoframes (seconds):
-    REFRESH_RATE = 60
-    return range( int( np.rint(seconds * REFRESH_RATE) ) )
+    return range( config.frames(seconds) )
+
+def load_staircase(chamber):
+    '''
+        the staircase state, median list and running estimates of an
+        earlier titration in this chamber, from this session or from the
+        subject json, or None
+    '''
+    if chamber in staircases:
+        return staircases[chamber]
+
+    path = os.path.join(HOME, 'data', str(pair_id), 'data_chamber' + chamber + '.json')
+    if os.path.exists(path):
+        with open(path, 'r') as fp:
+            previous = json.load(fp)
+        if previous.get('staircase'):
+            return previous['staircase'], previous['threshold_list'], previous.get('estimates') or []
 
-def createDotPatch(window, xoffset, direction, coherence):
-    stimList = []
-    for _ in range(3):
-        stimList.append(createDots(window, xoffset, direction, ndots//3, dotlife, speed, coherence))
-    return stimList
+    return None
+
+def feedback_wait(staircase, seconds=1):
+    '''
+        keep the feedback on screen, meanwhile choose the next coherence and
+        build the dot patch of the next trial
+    '''
+    clock = core.Clock()
+    staircase.calculateNextIntensity()
+    movingPatches.prepare(staircase.intensity)
+    core.wait(seconds - clock.getTime())
 
 def draw_fixation(fixation):
     for grating in fixation:
@@ -94,9 +128,7 @@ def feedback_interval(fixation, dotpatch, indicatordict, rt_msg="NA"):
 def endscreen():
     instructions = "You have finished the first part of the experiment."
 
-    visual.TextStim(window,
-                    text=instructions, pos=(0, 0),
-                    color='white', height=20).draw()
+    stimuli.getText(window, instructions, (0, 0)).draw()
 # TODO:
 def instruction_titration():
     instructions = "Please read the instructions carefully.\n\
@@ -104,9 +136,7 @@ def instruction_titration():
     2. After the beep, you will see some dots moving either to the left or to the right. Hit the left (yellow) button if the dots are moving left, and the right (blue) button if the dots move right.\n\
     Press the right (blue) button to continue"
 
-    visual.TextStim(window,
-                    text=instructions, pos=(0, 0),
-                    color='white', height=20).draw()
+    stimuli.getText(window, instructions, (0, 0)).draw()
 
 # TODO:
 def instruction_familiarization():
@@ -116,9 +146,7 @@ def instruction_familiarization():
     2. After the beep, you will see some dots moving either to the left or to the right. Hit the left (yellow) button if the dots are moving left, and the right (blue) button if the dots move right.\n\
     Press the right (blue) button to start practice trials!"
 
-    visual.TextStim(window,
-                    text=instructions, pos=(0, 0),
-                    color='white', height=20).draw()
+    stimuli.getText(window, instructions, (0, 0)).draw()
 
 
 ###########################
@@ -138,26 +166,36 @@ while titration_over == False:
             continue
 
     # create beep for decision interval
-    if chamber == "1":
-        beep = Sound('C', secs=0.5, volume=0.1, octave=5)
-    else:
-        beep = Sound('F', secs=0.5, volume=0.1, octave=4)
+    beep = Sound(**config.beep(chamber))
 
     titration_counter += 1
     subjectData['titration_counter'] = titration_counter
     subjectData['chamber'] = chamber
 
     # variables for button box input
-    keys = ["2", "1"] if chamber == "1" else ["7", "8"] # first one is yes
+    keys = [config.keymap(chamber)['right'], config.keymap(chamber)['left']] # first one is yes
+
+    # an earlier titration in this chamber can be continued instead of restarted
+    previous = load_staircase(chamber)
+    resume = False
+    if previous is not None:
+        print('Continue the previous titration in this chamber ({} of {} trials done)? Enter y/n'
+              .format(len(previous[0]['data']), numberOfTrials))
+        resume = input() == 'y'
 
     # the screen
     window = psychopy.visual.Window(size=(M_WIDTH, M_HEIGHT), units='pix', screen=int(chamber), fullscr=False, pos=None, color =[-1,-1,-1])
     window.mouseVisible = False # hide cursor
     xoffset = 0
+    # flip timestamps of the trial loops
+    timer = frametimer(window)
+    subjectData['frame_timing'] = []
     # the stimulus
     stimulus = stimuli.mainstim(window=window, xoffset=xoffset, coherence=0.5)
     stationaryDotsList = stimulus.stationaryDotsList
     stationaryDotPatch = stationaryDotsList[0]
+    # the moving dot patches, per direction and coherence
+    movingPatches = stimuli.titrationpatches(window, xoffset)
 
     bluecross = stimulus.fixation_blue
     greencross = stimulus.fixation_green
@@ -169,26 +207,31 @@ while titration_over == False:
     # 1. Familiarization
     # '''
 
+    practice_trials = [0.05, 0.1, 0.2, 0.4, 0.8]*3
+    random.shuffle(practice_trials)
+    # build the practice patches while the instructions are shown
+    movingPatches.prewarm(practice_trials)
+
     instruction_familiarization() # display instructions
     window.flip()
-    key = event.waitKeys(keyList=keys[:1])
+    waitforall([kb], [keys[:1]])
 
-    practice_trials = [0.05, 0.1, 0.2, 0.4, 0.8]*3
-    random.shuffle(practice_trials)
     for coherence in practice_trials:
 
         flag = "NA"
 
+        timer.start()
+
         # randomly pick dot motion direction and set coherence
         direction = np.random.choice(np.array([0, 180]))
-        movingDotPatch = createDotPatch(window, xoffset, direction, coherence)
+        movingDotPatch = movingPatches.get(direction, coherence)
         key = []
 
         # pretrial interval
         for frame in secondstoframes( np.random.uniform(1, 2) ):
             # window.flip() #(for feedback)
             pretrial_interval(greencross, stationaryDotPatch)
-            window.flip()
+            timer.flip()
 
         # play beep because next is decision interval (beep should depend on chamber number)
 
@@ -207,7 +250,7 @@ while titration_over == False:
                 decision_interval(movingDotPatch[2])
             else:
                 print('error in secondstoframes decision_interval')
-            window.flip()
+            timer.flip()
 
             # fetch button press: response 0 is right, response 1 is left
             if response is None:
@@ -223,9 +266,9 @@ while titration_over == False:
 
             else:
 
-                if frame > int( np.rint(1.5 * stimuli.REFRESH_RATE) ):
+                if frame > slowFrames:
                     flag = "slow"
-                elif frame < int( np.rint(0.1 * stimuli.REFRESH_RATE) ):
+                elif frame < fastFrames:
                     flag = "fast"
 
                 if direction == 180:
@@ -253,55 +296,65 @@ while titration_over == False:
             drawDots(stationaryDotPatch)
             if flag != "NA":
                 indicatordict[flag].draw()
-            window.flip()
+            timer.flip()
             core.wait(1)
         elif response == 0: #right
             draw_fixation(bluecross)
             drawDots(stationaryDotPatch)
             if flag != "NA":
                 indicatordict[flag].draw()
-            window.flip()
+            timer.flip()
             core.wait(1)
 
+        timer.summary()
+
 
 
     '''
     2. Titration
     '''
 
-    staircase = QuestHandler(
-                                    startVal=0.5,
-                                    startValSd=0.5,
-                                    pThreshold=0.82, # gives 75 % for 2IFC
-                                    gamma=0.5,
-                                    delta=0.01,
-                                    #stopInterval=0,
-                                    nTrials=numberOfTrials,
-                                    minVal=0.035,
-                                    maxVal=0.8,
-                                    method='quantile'
-                                    )
+    if resume:
+        # the trials of the earlier titration count towards numberOfTrials
+        staircase = gridstaircase.fromstate(previous[0], nTrials=max(numberOfTrials - len(previous[0]['data']), 0))
+        staircase_medians = list(previous[1])
+    else:
+        staircase = gridstaircase.gridstaircase(
+                                        startVal=0.5,
+                                        startValSd=0.5, # log10 units, see gridstaircase.py
+                                        pThreshold=0.82, # the threshold is the coherence with 82 % correct
+                                        gamma=0.5,
+                                        delta=0.01,
+                                        nTrials=numberOfTrials,
+                                        minVal=config.settings['minCoherence'],
+                                        maxVal=config.settings['maxCoherence'],
+                                        method='quantile'
+                                        )
+        staircase_medians = []
+    movingPatches.prepare(staircase.intensity)
+    # ends the titration once the posterior is narrow enough
+    monitor = convergencemonitor(tolerance=0.1, minTrials=30, estimates=previous[2] if resume else ())
 
     instruction_titration() # display instructions
     window.flip()
-    key = event.waitKeys(keyList=keys[:1])
-    staircase_medians = []
+    waitforall([kb], [keys[:1]])
 
     thresholds = []
     responses = []
 
     for coherence in staircase:
 
-        # randomly pick dot motion direction and set coherence
-        direction = np.random.choice(np.array([0, 180]))
-        movingDotPatch = createDotPatch(window, xoffset, direction, coherence)
+        timer.start()
+
+        # dot motion direction and patch, drawn at random during the last feedback
+        direction, movingDotPatch = movingPatches.nexttrial(coherence)
         key = []
 
         # pretrial interval
         for frame in secondstoframes( np.random.uniform(1, 2) ):
             # window.flip() #(for feedback)
             pretrial_interval(greencross, stationaryDotPatch)
-            window.flip()
+            timer.flip()
 
         # play beep because next is decision interval (beep should depend on chamber number)
 
@@ -320,7 +373,7 @@ while titration_over == False:
                 decision_interval(movingDotPatch[2])
             else:
                 print('error in secondstoframes decision_interval')
-            window.flip()
+            timer.flip()
 
             # fetch button press: response 0 is right, response 1 is left
             if response is None:
@@ -335,9 +388,9 @@ while titration_over == False:
                     response = 0
 
             else:
-                if frame > int( np.rint(1.5 * stimuli.REFRESH_RATE) ):
+                if frame > slowFrames:
                     flag = "slow"
-                elif frame < int( np.rint(0.1 * stimuli.REFRESH_RATE) ):
+                elif frame < fastFrames:
                     flag = "fast"
 
                 if direction == 180:
@@ -354,6 +407,7 @@ while titration_over == False:
                     correct = 0
                 staircase.addResponse(correct)
                 staircase_medians.append(staircase.quantile(0.5))
+                monitor.update(staircase.mean(), staircase.sd())
 
                 #event.clearEvents()
 
@@ -371,24 +425,36 @@ while titration_over == False:
             drawDots(stationaryDotPatch)
             if flag != "NA":
                 indicatordict[flag].draw()
-            window.flip()
-            core.wait(1)
+            timer.flip()
+            feedback_wait(staircase)
         elif response == 0: #right
             draw_fixation(bluecross)
             drawDots(stationaryDotPatch)
             if flag != "NA":
                 indicatordict[flag].draw()
-            window.flip()
-            core.wait(1)
+            timer.flip()
+            feedback_wait(staircase)
+
+        # frame timing of the titration trial
+        subjectData['frame_timing'].append(timer.summary())
+
+        if monitor.stopped:
+            break
 
     subjectData['threshold'] = staircase.mean()
     subjectData['threshold_list'] = staircase_medians # all coherence values the participant saw during titration
+    subjectData['estimates'] = monitor.estimates # posterior mean after every trial
+    subjectData['stopping_reason'] = monitor.finish()
+    subjectData['staircase'] = staircase.state() # the posterior, to continue the titration later
+    staircases[chamber] = (subjectData['staircase'], staircase_medians, monitor.estimates)
 
     # print('reversals:')
     # print(staircase.reversalIntensities)
     # print("The subject's threshold is: = %.5f" % np.average(staircase.reversalIntensities[-6:])) # TODO: needs to be changed to match the quest method
 
-    print(f"threshold is {staircase.mean()}")
+    print(f"threshold is {staircase.mean()} after {len(monitor)} trials ({monitor.reason})")
+
+    print(timer.report())
 
     endscreen()
     window.flip()
@@ -403,7 +469,9 @@ while titration_over == False:
         print("Enter yes(y) or no(n) !")
         answer = input()
     else:
-        if answer == 'y':
+        if answer == 'y' and not plausibleposterior(staircase):
+            print("The threshold is not determined within %s - %s and is not saved, the titration has to be repeated." % (staircase.minVal, staircase.maxVal))
+        elif answer == 'y':
             titration_over = True
             DATAPATH = HOME+DATA+str(pair_id)
             if not os.path.exists(DATAPATH):
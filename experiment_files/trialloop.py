@@ -0,0 +1,174 @@
+'''
+    Trial loop of the dyadic experiment
+
+    A trial has three intervals: the pretrial interval (stationary dots and
+    green fixation), the decision interval (moving dots until the acting
+    subject responds) and the feedback interval (stationary dots, the color
+    of the fixation shows the response). The trials come from the session
+    schedule, see schedule.py.
+
+    dyadic_random_dots.py runs the practice and the main trials through
+    dyadictrials with the psychopy window and the button boxes, benchmark.py
+    runs the very same code against its stubs.
+'''
+
+
+class dyadictrials:
+    def __init__(self, window, renderer, timer, subjects, decisionFrames, slowResponse, fastResponse):
+        '''
+            subjects are sone and stwo, each with its stimulus, kb, listener,
+            buttons and beep; renderer is the stimuli.dualstim of both and
+            timer the frametimer that flips the window.
+
+            decisionFrames is the longest decision interval in frames, a
+            response slower than slowResponse or faster than fastResponse
+            (seconds) gets the "slow"/"fast" feedback
+        '''
+        self.window = window
+        self.renderer = renderer
+        self.timer = timer
+        self.subjects = subjects
+        self.decisionFrames = decisionFrames
+        self.slowResponse = slowResponse
+        self.fastResponse = fastResponse
+
+    def updatestate (self, trial):
+        '''
+            Update whose turn it is
+        '''
+        sone, stwo = self.subjects
+        sone.state = bool(trial['s1_state'])
+        stwo.state = not sone.state
+
+    def acting (self):
+        return self.subjects[0] if self.subjects[0].state else self.subjects[1]
+
+    ##### DRAWING #####
+    def drawStationaryDots (self, choice):
+        '''
+            draw the stationary dot patch for both subjects
+        '''
+        self.renderer.drawDots([s.stimulus.stationaryDotsList for s in self.subjects], choice)
+
+    def genpretrialint (self, choice):
+        self.drawStationaryDots(choice)
+        self.renderer.drawFixation("green")
+
+    def gendecisionint (self, stimOne, stimTwo):
+        '''
+            draw one of the interleaved dot patches of both subjects
+        '''
+        self.renderer.drawSubpatches([stimOne, stimTwo])
+        self.renderer.drawFixation("green")
+
+    def genfeedbackint (self, color, choice, rt_msg="NA"):
+        '''
+            1. Display static dot screen
+            2. Response indicated by fixation dot color: left/ blue or right/ yellow (assignment depends on pair_id)
+            3. The "do" subject sees response time message
+        '''
+        self.drawStationaryDots(choice)
+        self.renderer.drawFixation(color)
+
+        if rt_msg != "NA":
+            self.acting().stimulus.indicatordict[rt_msg].draw()
+
+    ##### RESPONSES #####
+    def fetchbuttonpress (self):
+        '''
+            Get the button box input from the acting subject
+            Return the response (the pressed key) and the reaction time
+
+            The subject's responselistener reads the keyboard queue once (it
+            does not block); the rt is the timestamp of the key press
+        '''
+        s = self.acting()
+        resp = s.listener.get()
+        s.response = resp[0] if resp else s.buttons[None]
+        return resp
+
+    ##### INTERVALS #####
+    def pretrial (self, trial):
+        '''
+            pretrial interval: stationary dots and green fixation for 1 - 2 s
+        '''
+        stationaryChoice = int(trial['pretrialPatch'])
+        for frame in range(trial['pretrialFrames']):
+            self.genpretrialint(stationaryChoice)
+            self.timer.flip()
+
+    def decision (self, trial):
+        '''
+            decision interval: moving dots until the acting subject responds,
+            returns [response, rt] or [] without a response
+        '''
+        s = self.acting()
+        for kb in [x.kb for x in self.subjects]:
+            kb.clearEvents(eventType='keyboard')
+        for kb in [x.kb for x in self.subjects]:
+            kb.clock.reset()
+        s.listener.start()
+
+        # preparing time for next window flip, to precisely co-ordinate window flip and beep
+        nextflip = self.window.getFutureFlipTime(clock='ptb')
+        s.beep.play(when=nextflip)
+
+        # moving dot patch and direction of the trial
+        dotpatchChoice = int(trial['movingPatch'])
+        if str(trial['direction']) == 'right':
+            stimOne, stimTwo = [x.stimulus.movingRightDotsList[dotpatchChoice] for x in self.subjects]
+        else:
+            stimOne, stimTwo = [x.stimulus.movingLeftDotsList[dotpatchChoice] for x in self.subjects]
+
+        response = []  # we have no response yet
+        for frame in range(self.decisionFrames):
+            self.gendecisionint(stimOne[frame % 3], stimTwo[frame % 3])
+            self.timer.flip()
+
+            # fetch button press; a response ends the decision interval with this flip
+            response = self.fetchbuttonpress()
+            if response:
+                break
+
+        s.listener.stop()
+
+        # need to explicity call stop() to go back to the beginning of the track
+        s.beep.stop()
+        return response
+
+    def feedback (self, trial, response):
+        '''
+            feedback interval: stationary dots, the fixation color shows the
+            response (yellow left, blue right, green none) and the acting
+            subject sees whether it was too slow or too fast
+        '''
+        if not response:
+            color = "green"
+        elif response[0] == "left":
+            color = "yellow"
+        else:
+            color = "blue"
+
+        flag = "NA"
+        if response:
+            if response[1] > self.slowResponse:
+                flag = "slow"
+            elif response[1] < self.fastResponse:
+                flag = "fast"
+
+        stationaryChoice = int(trial['feedbackPatch'])
+        for frame in range(trial['feedbackFrames']):
+            self.genfeedbackint(color, stationaryChoice, flag)
+            self.timer.flip()
+
+    def run (self, trial):
+        '''
+            one trial of the schedule, returns the response as decision();
+            timer.summary() of the trial is left to the caller
+        '''
+        self.updatestate(trial)
+        self.timer.start()
+        self.pretrial(trial)
+        response = self.decision(trial)
+        self.feedback(trial, response)
+        return response
@@ -0,0 +1,81 @@
+'''
+    Crash-safe streaming of the trial data
+
+    The ExperimentHandler only writes its wide text file when the experiment
+    ends, so a crash (or core.quit()) loses the whole session. trialwriter
+    hooks into exphandler.nextEntry() and appends every finished row to the
+    csv file straight away, in exactly the layout of saveAsWideText (utf-8
+    with BOM, a delimiter after every field), so the file can replace the one
+    the handler would have written; create the handler with
+    saveWideText=False. The writing itself is done by a background thread,
+    nextEntry() only formats the row and puts it in a queue.
+'''
+
+import atexit
+import queue
+import threading
+
+
+class trialwriter:
+    def __init__(self, exphandler, filename, delim=','):
+        '''
+            filename is the full name of the csv file, including extension
+        '''
+        self.exphandler = exphandler
+        self.filename = filename
+        self.delim = delim
+        self.names = None
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+        # write every row as soon as the handler moves on to the next one
+        self.handlerNextEntry = exphandler.nextEntry
+        exphandler.nextEntry = self.nextEntry
+
+        # rows still queued when the script exits (also via core.quit) are written
+        atexit.register(self.close)
+
+    def nextEntry (self):
+        self.handlerNextEntry()
+        entry = self.exphandler.entries[-1]
+
+        if self.names is None:
+            # same column order as saveAsWideText: data names, then extra info
+            self.names = list(self.exphandler.dataNames)
+            self.names += [key for key in self.exphandler.extraInfo if key not in self.names]
+            self.queue.put(''.join(u'%s%s' % (name, self.delim) for name in self.names) + '\n')
+
+        self.queue.put(self.formatRow(entry))
+
+    def formatRow (self, entry):
+        row = []
+        for name in self.names:
+            if name in entry:
+                ename = str(entry[name])
+                if ',' in ename or '\n' in ename:
+                    fmt = u'"%s"%s'
+                else:
+                    fmt = u'%s%s'
+                row.append(fmt % (entry[name], self.delim))
+            else:
+                row.append(self.delim)
+        return ''.join(row) + '\n'
+
+    def run (self):
+        with open(self.filename, 'w', encoding='utf-8-sig', newline='') as f:
+            while True:
+                line = self.queue.get()
+                if line is None:
+                    break
+                f.write(line)
+                f.flush()
+
+    def close (self):
+        '''
+            write the remaining rows and close the file
+        '''
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()